@@ -0,0 +1,852 @@
+#!/usr/bin/env python3
+#
+# aio.py -- asyncio version of the tournament.py API (Python 3.7+, asyncpg)
+#
+# Every function mirrors its namesake in tournament.py and returns the same
+# rows (as tuples), but is a coroutine running on an asyncpg pool:
+#
+#     await aio.registerPlayer(None, "Twilight Sparkle")
+#     standings = await aio.playerStandings(None)
+#
+# `db` may be None (use the module's pool), an asyncpg pool, or an asyncpg
+# connection.  A connection that is already inside a transaction is used
+# as-is, so several calls can share it:
+#
+#     async with pool.acquire() as conn:
+#         async with conn.transaction():
+#             await aio.reportMatch(conn, id1, id2)
+#             await aio.reportMatch(conn, id3, id4)
+#
+import asyncio
+import collections
+import concurrent.futures
+from array import array
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+import archive
+import checkpoint
+import feed
+import pairing
+import ratings
+from cache import ALL_SCOPES
+from tournament import DB_NAME, POOL_MIN_CONN, POOL_MAX_CONN, BULK_CHUNK_SIZE, FEED_QUEUE_SIZE
+from tournament import STANDINGS_COLUMNS, STANDINGS_TIEBREAK_COLUMNS, STANDINGS_ORDER
+from tournament import LEADERBOARD_PAGE_SIZE, ResultConflict, TiebreakStandingsRow, _SCORE_KEY
+from tournament import _ARCHIVE_QUERIES, _pair_tournament, _paired_ids
+
+# Fields larger than this are paired in a worker thread so the event loop
+# keeps serving other requests.
+EXECUTOR_PAIRING_THRESHOLD = 2000
+
+_pool = None
+_pool_lock = None
+
+# The connection LISTENing for live standings events, and the queues of
+# the subscribeStandings generators it feeds.
+_feed_conn = None
+_feed_lock = None
+_feed_queues = set()
+
+
+async def configure_pool(db_name=DB_NAME, min_size=POOL_MIN_CONN,
+                         max_size=POOL_MAX_CONN, **kwargs):
+    """ (Re)create the module's asyncpg pool.
+
+    Keyword arguments are passed to asyncpg.create_pool.
+    """
+    global _pool
+    pool = await asyncpg.create_pool(database=db_name, min_size=min_size,
+                                     max_size=max_size, **kwargs)
+    old_pool, _pool = _pool, pool
+    if old_pool is not None:
+        await old_pool.close()
+    return pool
+
+
+async def get_pool():
+    """ The module's asyncpg pool, created on first use. """
+    global _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                await configure_pool()
+    return _pool
+
+
+async def close_pool():
+    """ Close the module's pool. """
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+@asynccontextmanager
+async def _connection(db):
+    """ Yield a connection inside a transaction, joining db's if it has one. """
+    if isinstance(db, asyncpg.Connection):
+        if db.is_in_transaction():
+            yield db
+        else:
+            async with db.transaction():
+                yield db
+        return
+    pool = db if db is not None else await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            yield conn
+
+
+def _tuples(records):
+    return [tuple(record) for record in records]
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _next_ids(conn, sequence, count):
+    rows = await conn.fetch("SELECT nextval($1) FROM generate_series(1, $2);",
+                            sequence, count)
+    return [row[0] for row in rows]
+
+
+async def _announce(conn, event):
+    """ Publish a feed event once conn's transaction commits, if the feed is on. """
+    await conn.execute("SELECT pg_notify($1, $2) "
+                       "WHERE current_setting('tournament.feed') = 'on';",
+                       feed.FEED_CHANNEL, feed.encode(event))
+
+
+async def _reset_ratings(conn):
+    await conn.execute("UPDATE players SET rating = $1 WHERE rating <> $1;",
+                       ratings.INITIAL_RATING)
+
+
+async def _delete_totals_checkpoint(conn):
+    await conn.execute("DELETE FROM checkpoints WHERE round_id IN ("
+                       "SELECT round_id FROM rounds WHERE tournament_id IS NULL);")
+
+
+async def _zero_player_stats(conn, scope_filter=""):
+    await conn.execute("UPDATE player_stats SET wins = 0, losses = 0, draws = 0, matches = 0, "
+                       "buchholz = 0, sonneborn_berger = 0, opp_match_win_pct = 0, "
+                       "rank = NULL WHERE (matches <> 0 OR buchholz <> 0 "
+                       "OR sonneborn_berger <> 0 OR opp_match_win_pct <> 0 "
+                       "OR rank IS NOT NULL)" + scope_filter + ";")
+
+
+async def resetDatabase(db):
+    """ Empty every table and restart all ids; see tournament.resetDatabase. """
+    async with _connection(db) as conn:
+        await conn.execute("TRUNCATE matches, checkpoints, pairings, rounds, "
+                           "tournament_roster, player_stats, tournaments, players "
+                           "RESTART IDENTITY;")
+        await _announce(conn, feed.Resync([ALL_SCOPES]))
+
+
+async def deleteMatches(db):
+    """ Remove all the match records from the database. """
+    async with _connection(db) as conn:
+        await conn.execute("TRUNCATE matches, checkpoints;")
+        await _zero_player_stats(conn)
+        await _reset_ratings(conn)
+        await _announce(conn, feed.Resync([ALL_SCOPES]))
+
+
+async def deletePlayers(db):
+    """ Remove all the player records from the database. """
+    async with _connection(db) as conn:
+        if await conn.fetchval("SELECT EXISTS (SELECT 1 FROM matches);"):
+            await conn.execute("DELETE FROM tournament_roster;")
+            await conn.execute("DELETE FROM pairings;")
+            await conn.execute("DELETE FROM players;")
+        else:
+            await conn.execute("TRUNCATE tournament_roster, pairings, player_stats, "
+                               "matches, players;")
+        await conn.execute("DELETE FROM checkpoints;")
+        await _announce(conn, feed.Resync([ALL_SCOPES]))
+
+
+async def deleteTournaments(db):
+    """ Remove all tournaments from the database. """
+    async with _connection(db) as conn:
+        if await conn.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM matches WHERE tournament_id IS NULL) "
+                "OR EXISTS (SELECT 1 FROM rounds WHERE tournament_id IS NULL);"):
+            await conn.execute("DELETE FROM tournaments;")
+            await _delete_totals_checkpoint(conn)
+        else:
+            await conn.execute("TRUNCATE matches, checkpoints, pairings, rounds, "
+                               "tournament_roster, tournaments;")
+            await _zero_player_stats(conn, " AND tournament_id = 0")
+            await _reset_ratings(conn)
+        await conn.execute("DELETE FROM player_stats WHERE tournament_id <> 0;")
+        await _announce(conn, feed.Resync([ALL_SCOPES]))
+
+
+async def deleteTournament(db, tournament_id):
+    """ Remove a single tournament, its roster, rounds and matches from the database. """
+    async with _connection(db) as conn:
+        await conn.execute("DELETE FROM tournaments WHERE tournament_id = $1;",
+                           tournament_id)
+        await conn.execute("DELETE FROM player_stats WHERE tournament_id = $1;",
+                           tournament_id)
+        await _delete_totals_checkpoint(conn)
+        await _announce(conn, feed.Resync([tournament_id, None]))
+
+
+async def rebuildPlayerStats(db):
+    """ Recompute the player_stats table from the full match history. """
+    async with _connection(db) as conn:
+        await conn.execute("SELECT rebuild_player_stats();")
+        await conn.execute("DELETE FROM checkpoints;")
+        await _announce(conn, feed.Resync([ALL_SCOPES]))
+
+
+async def verifyPlayerStats(db):
+    """ Check player_stats against the match history; see tournament.py. """
+    async with _connection(db) as conn:
+        return _tuples(await conn.fetch("SELECT * FROM verify_player_stats();"))
+
+
+async def countPlayers(db):
+    """ Returns the number of players currently registered. """
+    async with _connection(db) as conn:
+        return int(await conn.fetchval("SELECT COUNT(*) AS num FROM players;"))
+
+
+async def getTournaments(db):
+    """ Get all tournments registered in the database. """
+    async with _connection(db) as conn:
+        return _tuples(await conn.fetch("SELECT * FROM tournaments;"))
+
+
+async def getTournamentRoster(db, tournament_id):
+    """ Get the players registered in a specific tournament. """
+    async with _connection(db) as conn:
+        return _tuples(await conn.fetch(
+            "SELECT * FROM tournament_roster WHERE tournament_id = $1;", tournament_id))
+
+
+async def registerPlayer(db, name):
+    """ Adds a player to the tournament database. """
+    async with _connection(db) as conn:
+        await conn.execute("INSERT INTO players (name) VALUES ($1);", name)
+        await _announce(conn, feed.Resync([None]))
+
+
+async def registerPlayers(db, names, chunk_size=BULK_CHUNK_SIZE):
+    """ Adds many players at once with COPY; returns their ids in input order. """
+    ids = []
+    async with _connection(db) as conn:
+        for chunk in _chunks(names, chunk_size):
+            chunk_ids = await _next_ids(conn, 'players_id_seq', len(chunk))
+            await conn.copy_records_to_table('players', columns=['id', 'name'],
+                                             records=list(zip(chunk_ids, chunk)))
+            ids.extend(chunk_ids)
+        await _announce(conn, feed.Resync([None]))
+    return ids
+
+
+async def registerTournament(db):
+    """ Create a new tournament. """
+    async with _connection(db) as conn:
+        await conn.execute("INSERT INTO tournaments DEFAULT VALUES;")
+
+
+async def playerStandings(db, tournament_id=None, tiebreaks=False):
+    """ Returns the players and their win records; see tournament.playerStandings. """
+    columns = STANDINGS_TIEBREAK_COLUMNS if tiebreaks else STANDINGS_COLUMNS
+    async with _connection(db) as conn:
+        if tournament_id is None:
+            rows = await conn.fetch("SELECT {0} FROM total_matches;".format(columns))
+        else:
+            rows = await conn.fetch(
+                "SELECT {0} FROM tournament_standings WHERE tournament_id = $1 "
+                "ORDER BY {1};".format(columns, STANDINGS_ORDER), tournament_id)
+    return _tuples(rows)
+
+
+async def leaderboard(db, tournament_id=None, limit=LEADERBOARD_PAGE_SIZE, after=None):
+    """ Returns one page of the standings by score; see tournament.leaderboard. """
+    select = ("SELECT p.id, p.name, s.wins, s.losses, s.draws, s.matches, s.buchholz, "
+              "s.sonneborn_berger, s.opp_match_win_pct "
+              "FROM player_stats s JOIN players p ON p.id = s.player_id "
+              "WHERE s.tournament_id = $1")
+    if tournament_id is not None:
+        select += (" AND EXISTS (SELECT 1 FROM tournament_roster r "
+                   "WHERE r.tournament_id = s.tournament_id AND r.player_id = s.player_id)")
+    order = " ORDER BY {0} DESC, s.player_id LIMIT $2".format(" DESC, ".join(_SCORE_KEY))
+    scope = tournament_id or 0
+    async with _connection(db) as conn:
+        if after is None:
+            rows = await conn.fetch(select + order + ";", scope, limit)
+        else:
+            row = TiebreakStandingsRow._make(after)
+            key = (2 * row.wins + row.draws, row.wins, row.draws, row.buchholz,
+                   row.sonneborn_berger, row.opp_match_win_pct)
+            rows = await conn.fetch(
+                "SELECT * FROM (({0} AND ({1}) = ({2}) AND s.player_id > $9{3}) "
+                "UNION ALL ({0} AND ({1}) < ({2}){3})) AS page "
+                "ORDER BY 2 * wins + draws DESC, wins DESC, draws DESC, buchholz DESC, "
+                "sonneborn_berger DESC, opp_match_win_pct DESC, id "
+                "LIMIT $2;".format(select, ", ".join(_SCORE_KEY),
+                                   "$3::integer, $4::integer, $5::integer, "
+                                   "$6::float8, $7::float8, $8::float8", order),
+                scope, limit, *(key + (row.id,)))
+    return [TiebreakStandingsRow._make(row) for row in rows]
+
+
+async def playerRank(db, player_id, tournament_id=None):
+    """ Returns a player's stored rank, or None; see tournament.playerRank. """
+    async with _connection(db) as conn:
+        return await conn.fetchval("SELECT rank FROM player_stats WHERE tournament_id = $1 "
+                                   "AND player_id = $2;", tournament_id or 0, player_id)
+
+
+async def updateTiebreaks(db, tournament_id=None):
+    """ Recompute every player's tie-break scores from the match history. """
+    async with _connection(db) as conn:
+        await conn.execute("SELECT update_tiebreaks($1);", tournament_id or 0)
+        row = await conn.fetchrow(
+            "SELECT r.round_id, r.number FROM checkpoints k "
+            "JOIN rounds r ON r.round_id = k.round_id "
+            "WHERE r.tournament_id IS NOT DISTINCT FROM $1::integer;", tournament_id)
+        if row is not None:
+            await _write_checkpoint(conn, tournament_id, *row)
+        await _announce(conn, feed.Resync([tournament_id]))
+
+
+async def playerRatings(db, tournament_id=None):
+    """ Returns (id, name, rating), highest first; see tournament.playerRatings. """
+    async with _connection(db) as conn:
+        if tournament_id is None:
+            rows = await conn.fetch("SELECT id, name, rating FROM players "
+                                    "ORDER BY rating DESC, id;")
+        else:
+            rows = await conn.fetch(
+                "SELECT p.id, p.name, p.rating FROM tournament_roster r "
+                "JOIN players p ON p.id = r.player_id WHERE r.tournament_id = $1 "
+                "ORDER BY p.rating DESC, p.id;", tournament_id)
+    return _tuples(rows)
+
+
+async def recomputeRatings(db, fetch_size=BULK_CHUNK_SIZE):
+    """ Replay the match history to recompute every rating; see tournament.py.
+
+    The replay runs in a worker thread so the event loop keeps serving
+    other requests.
+    """
+    async with _connection(db) as conn:
+        await conn.execute("LOCK TABLE matches IN SHARE MODE;")
+        players = await conn.fetch("SELECT id, rating FROM players ORDER BY id;")
+        player_ids = array('l', [row[0] for row in players])
+        ones, twos, draws = array('l'), array('l'), array('b')
+        async for row in conn.cursor(
+                "SELECT COALESCE(winner_id, draw_id_one), "
+                "COALESCE(loser_id, draw_id_two, 0), draw_id_one IS NOT NULL "
+                "FROM matches ORDER BY match_id;", prefetch=fetch_size):
+            ones.append(row[0])
+            twos.append(row[1])
+            draws.append(row[2])
+
+        loop = asyncio.get_event_loop()
+        replayed = await loop.run_in_executor(
+            None, ratings.replay, player_ids, ones, twos, draws)
+        changed = [(row[0], rating) for row, rating in zip(players, replayed)
+                   if rating != row[1]]
+        if changed:
+            await conn.execute("CREATE TEMPORARY TABLE replayed_ratings "
+                               "(id integer PRIMARY KEY, rating double precision) "
+                               "ON COMMIT DROP;")
+            await conn.copy_records_to_table('replayed_ratings', columns=['id', 'rating'],
+                                             records=changed)
+            await conn.execute("UPDATE players p SET rating = r.rating "
+                               "FROM replayed_ratings r WHERE p.id = r.id;")
+            await conn.execute("DROP TABLE replayed_ratings;")
+    return len(changed)
+
+
+async def reportMatch(db, winner, loser, draw=False, tournament_id=None, pairing_id=None):
+    """ Records the outcome of a single match; returns its id.
+
+    Idempotent when reported against a pairing; see tournament.reportMatch.
+    """
+    async with _connection(db) as conn:
+        if pairing_id is not None:
+            row = await conn.fetchrow(
+                "SELECT p.player_one, p.player_two, r.tournament_id "
+                "FROM pairings p JOIN rounds r ON r.round_id = p.round_id "
+                "WHERE p.pairing_id = $1 FOR UPDATE OF p;", pairing_id)
+            if row is None:
+                raise ValueError("Unknown pairing id {0}.".format(pairing_id))
+            if set([winner, loser]) != set([row[0], row[1]]):
+                raise ValueError("Pairing {0} is between players {1} and {2}.".format(
+                    pairing_id, row[0], row[1]))
+            if tournament_id is None:
+                tournament_id = row[2]
+            existing = await conn.fetchrow(
+                "SELECT match_id, winner_id, draw_id_one IS NOT NULL FROM matches "
+                "WHERE pairing_id = $1;", pairing_id)
+            if existing is not None:
+                match_id, recorded_winner, recorded_draw = existing
+                if bool(draw) != recorded_draw or (not draw and recorded_winner != winner):
+                    raise ResultConflict(
+                        "Pairing {0} already has a different result (match {1}).".format(
+                            pairing_id, match_id))
+                return match_id
+        if draw:
+            return await conn.fetchval(
+                "INSERT INTO matches (draw_id_one, draw_id_two, tournament_id, pairing_id) "
+                "VALUES ($1, $2, $3, $4) RETURNING match_id;",
+                winner, loser, tournament_id, pairing_id)
+        return await conn.fetchval(
+            "INSERT INTO matches (winner_id, loser_id, tournament_id, pairing_id) "
+            "VALUES ($1, $2, $3, $4) RETURNING match_id;",
+            winner, loser, tournament_id, pairing_id)
+
+
+async def reportMatches(db, results, tournament_id=None, chunk_size=BULK_CHUNK_SIZE):
+    """ Records many match outcomes with COPY; returns their ids in input order. """
+    def match_row(match_id, result):
+        winner, loser = result[0], result[1]
+        if len(result) > 2 and result[2]:
+            return (match_id, None, None, winner, loser, tournament_id)
+        return (match_id, winner, loser, None, None, tournament_id)
+
+    ids = []
+    async with _connection(db) as conn:
+        # One resync for the batch instead of a notification per result.
+        previous = await conn.fetchval("SELECT current_setting('tournament.feed');")
+        await conn.execute("SET LOCAL tournament.feed = 'off';")
+        for chunk in _chunks(results, chunk_size):
+            # Before reserving ids; see tournament.reportMatches.
+            await conn.execute("LOCK TABLE matches IN ROW EXCLUSIVE MODE;")
+            chunk_ids = await _next_ids(conn, 'matches_match_id_seq', len(chunk))
+            await conn.copy_records_to_table(
+                'matches',
+                columns=['match_id', 'winner_id', 'loser_id', 'draw_id_one',
+                         'draw_id_two', 'tournament_id'],
+                records=[match_row(match_id, result)
+                         for match_id, result in zip(chunk_ids, chunk)])
+            ids.extend(chunk_ids)
+        await conn.execute("SELECT set_config('tournament.feed', $1, true);", previous)
+        await _announce(conn, feed.Resync([tournament_id, None]))
+    return ids
+
+
+def _feed_put(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # A slow subscriber: drop its backlog and have it read the
+        # standings afresh.
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(feed.Resync([ALL_SCOPES]))
+
+
+def _feed_notified(conn, pid, channel, payload):
+    event = feed.parse(payload)
+    for queue in list(_feed_queues):
+        _feed_put(queue, event)
+
+
+def _feed_lost(conn):
+    # Events may be missed until a resync listens again.
+    global _feed_conn
+    if conn is _feed_conn:
+        _feed_conn = None
+    for queue in list(_feed_queues):
+        _feed_put(queue, feed.Resync([ALL_SCOPES]))
+
+
+async def _feed_listen():
+    """ Start the module's listening connection, unless it is up. """
+    global _feed_conn, _feed_lock
+    if _feed_lock is None:
+        _feed_lock = asyncio.Lock()
+    async with _feed_lock:
+        if _feed_conn is None or _feed_conn.is_closed():
+            conn = await asyncpg.connect(database=DB_NAME)
+            conn.add_termination_listener(_feed_lost)
+            await conn.add_listener(feed.FEED_CHANNEL, _feed_notified)
+            _feed_conn = conn
+
+
+async def _feed_snapshot(db, tournament_id):
+    async with _connection(db) as conn:
+        rows = await playerStandings(conn, tournament_id, tiebreaks=True)
+        number = await conn.fetchval(
+            "SELECT MAX(number) FROM rounds WHERE tournament_id IS NOT DISTINCT FROM "
+            "$1::integer;", tournament_id)
+    return rows, number
+
+
+async def subscribeStandings(db, tournament_id=None, tiebreaks=False,
+                             max_queue=FEED_QUEUE_SIZE):
+    """ Async generator of (event, standings) pairs as results come in; see
+    tournament.subscribeStandings.  The first pair is (None, standings)
+    as they were on subscribing.  Every generator of the process shares one
+    listening connection; `db` is only used to read the standings.
+
+        async for event, standings in aio.subscribeStandings(None, tournament_id):
+            print(standings[0])
+    """
+    queue = asyncio.Queue(max_queue)
+    _feed_queues.add(queue)
+    standings = feed.LiveStandings(tournament_id)
+    event = None
+    try:
+        while True:
+            if standings.stale:
+                # Events queued so far are covered by the fresh read.
+                while not queue.empty():
+                    queue.get_nowait()
+                await _feed_listen()
+                standings.load(*await _feed_snapshot(db, tournament_id))
+            yield event, standings.standings(tiebreaks)
+            event = await queue.get()
+            while not standings.apply(event):
+                event = await queue.get()
+    finally:
+        _feed_queues.discard(queue)
+
+
+async def getMatchHistory(db, tournament_id=None):
+    """ Returns (player_one, player_two) for every match; see tournament.py. """
+    query = ("SELECT COALESCE(winner_id, draw_id_one), "
+             "COALESCE(loser_id, draw_id_two) FROM matches")
+    async with _connection(db) as conn:
+        if tournament_id is None:
+            rows = await conn.fetch(query + ";")
+        else:
+            rows = await conn.fetch(query + " WHERE tournament_id = $1;", tournament_id)
+    return _tuples(rows)
+
+
+async def swissPairings(db, tournament_id=None, by_rating=False):
+    """ Returns the pairings for the next round; see tournament.swissPairings. """
+    async with _connection(db) as conn:
+        standings = await playerStandings(conn, tournament_id)
+        history = pairing.History(await getMatchHistory(conn, tournament_id))
+        if by_rating:
+            rated = dict((row[0], row[2]) for row in await playerRatings(conn, tournament_id))
+    names = dict((row[0], row[1]) for row in standings)
+    scores = dict((row[0], pairing.score(row[2], row[4])) for row in standings)
+    players = [row[0] for row in standings]
+    if by_rating:
+        players.sort(key=lambda player: -rated[player])
+
+    if len(players) > EXECUTOR_PAIRING_THRESHOLD:
+        loop = asyncio.get_event_loop()
+        pairs, bye = await loop.run_in_executor(
+            None, pairing.pair_players, players, scores, history)
+    else:
+        pairs, bye = pairing.pair_players(players, scores, history)
+    match_list = [(one, names[one], two, names[two]) for one, two in pairs]
+    if bye is not None:
+        match_list.append((bye, names[bye], None, None))
+    return match_list
+
+
+async def getPairingData(db, tournament_ids):
+    """ Standings and match history of many tournaments; see tournament.py. """
+    tournament_ids = list(tournament_ids)
+    async with _connection(db) as conn:
+        known = await conn.fetch("SELECT tournament_id FROM tournaments "
+                                 "WHERE tournament_id = ANY ($1::integer[]);", tournament_ids)
+        data = dict((row[0], ([], [])) for row in known)
+        if not data:
+            return data
+        standings = await conn.fetch(
+            "SELECT tournament_id, {0} FROM tournament_standings "
+            "WHERE tournament_id = ANY ($1::integer[]) ORDER BY tournament_id, {1};".format(
+                STANDINGS_COLUMNS, STANDINGS_ORDER), list(data))
+        history = await conn.fetch(
+            "SELECT tournament_id, COALESCE(winner_id, draw_id_one), "
+            "COALESCE(loser_id, draw_id_two) FROM matches "
+            "WHERE tournament_id = ANY ($1::integer[]);", list(data))
+    for row in standings:
+        data[row[0]][0].append(tuple(row)[1:])
+    for row in history:
+        data[row[0]][1].append(tuple(row)[1:])
+    return data
+
+
+async def pairAll(db, tournament_ids, executor=None):
+    """ Pairs many tournaments at once; see tournament.pairAll.
+
+    Pairing runs on `executor`, a process pool of one worker per CPU by
+    default, so the event loop keeps serving other requests.
+
+    Returns:
+      (pairings, errors), dicts keyed by tournament id.
+    """
+    tournament_ids = list(collections.OrderedDict.fromkeys(tournament_ids))
+    data = await getPairingData(db, tournament_ids)
+    tasks = [(tournament_id,) + data[tournament_id]
+             for tournament_id in tournament_ids if tournament_id in data]
+    loop = asyncio.get_event_loop()
+    own_executor = executor is None and tasks
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor()
+    try:
+        results = await asyncio.gather(
+            *[loop.run_in_executor(executor, _pair_tournament, task) for task in tasks])
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    pairings = {}
+    errors = dict((tournament_id,
+                   ValueError("Unknown tournament id {0}.".format(tournament_id)))
+                  for tournament_id in tournament_ids if tournament_id not in data)
+    for tournament_id, result, error in results:
+        if error is None:
+            pairings[tournament_id] = result
+        else:
+            errors[tournament_id] = error
+    return pairings, errors
+
+
+async def createRound(db, pairings, tournament_id=None, checkpoint=False):
+    """ Records the pairings of a new round; returns (round_id, pairing_ids).
+
+    With checkpoint=True a checkpoint is stored too; see checkpointRound.
+    """
+    pairings = list(pairings)
+    async with _connection(db) as conn:
+        round_id, number = await conn.fetchrow(
+            "INSERT INTO rounds (tournament_id, number) "
+            "SELECT $1::integer, COALESCE(MAX(number), 0) + 1 FROM rounds "
+            "WHERE tournament_id IS NOT DISTINCT FROM $1::integer "
+            "RETURNING round_id, number;", tournament_id)
+        await _announce(conn, feed.Round(tournament_id, number))
+        pairing_ids = []
+        if pairings:
+            pairing_ids = await _next_ids(conn, 'pairings_pairing_id_seq', len(pairings))
+            await conn.copy_records_to_table(
+                'pairings', columns=['pairing_id', 'round_id', 'player_one', 'player_two'],
+                records=[(pairing_id, round_id) + _paired_ids(row)
+                         for pairing_id, row in zip(pairing_ids, pairings)])
+        if checkpoint:
+            await _write_checkpoint(conn, tournament_id, round_id, number)
+    return round_id, pairing_ids
+
+
+async def getPairings(db, round_id):
+    """ Returns (pairing_id, player_one, player_two, match_id) for a round. """
+    async with _connection(db) as conn:
+        return _tuples(await conn.fetch(
+            "SELECT p.pairing_id, p.player_one, p.player_two, m.match_id "
+            "FROM pairings p LEFT JOIN matches m ON m.pairing_id = p.pairing_id "
+            "WHERE p.round_id = $1 ORDER BY p.pairing_id;", round_id))
+
+
+async def _read_checkpoint(conn, tournament_id, round_id, number):
+    """ A Checkpoint of a scope as it is now; see tournament._read_checkpoint. """
+    await conn.execute("LOCK TABLE matches IN SHARE MODE;")
+    last_match_id = await conn.fetchval("SELECT COALESCE(MAX(match_id), 0) FROM matches;")
+    standings = await playerStandings(conn, tournament_id, tiebreaks=True)
+    history = await getMatchHistory(conn, tournament_id)
+    pairings = await getPairings(conn, round_id)
+    return checkpoint.Checkpoint.from_rows(tournament_id, round_id, number, last_match_id,
+                                           standings, history, pairings)
+
+
+async def _write_checkpoint(conn, tournament_id, round_id, number):
+    state = await _read_checkpoint(conn, tournament_id, round_id, number)
+    await conn.execute("DELETE FROM checkpoints WHERE round_id IN ("
+                       "SELECT round_id FROM rounds "
+                       "WHERE tournament_id IS NOT DISTINCT FROM $1::integer);", tournament_id)
+    await conn.execute("INSERT INTO checkpoints (round_id, snapshot) VALUES ($1, $2);",
+                       round_id, state.encode())
+
+
+async def _latest_round(conn, tournament_id):
+    return await conn.fetchrow("SELECT round_id, number FROM rounds "
+                               "WHERE tournament_id IS NOT DISTINCT FROM $1::integer "
+                               "ORDER BY number DESC LIMIT 1;", tournament_id)
+
+
+async def checkpointRound(db, tournament_id=None):
+    """ Stores a checkpoint as of the latest round; returns its round id.
+    See tournament.checkpointRound. """
+    async with _connection(db) as conn:
+        row = await _latest_round(conn, tournament_id)
+        if row is None:
+            raise ValueError("Tournament {0} has no rounds.".format(tournament_id))
+        await _write_checkpoint(conn, tournament_id, *row)
+    return row[0]
+
+
+async def resumeTournament(db, tournament_id=None):
+    """ Returns a tournament's checkpoint brought up to date, or None; see
+    tournament.resumeTournament. """
+    query = ("SELECT match_id, COALESCE(winner_id, draw_id_one), "
+             "COALESCE(loser_id, draw_id_two), draw_id_one IS NOT NULL, pairing_id "
+             "FROM matches WHERE match_id > $1")
+    async with _connection(db) as conn:
+        data = await conn.fetchval(
+            "SELECT k.snapshot FROM checkpoints k JOIN rounds r ON r.round_id = k.round_id "
+            "WHERE r.tournament_id IS NOT DISTINCT FROM $1::integer;", tournament_id)
+        if data is None:
+            return None
+        state = checkpoint.decode(data)
+        if tournament_id is None:
+            player_count = await conn.fetchval(
+                "SELECT COUNT(*) FROM player_stats WHERE tournament_id = 0;")
+            matches = await conn.fetch(query + " ORDER BY match_id;", state.last_match_id)
+        else:
+            player_count = await conn.fetchval(
+                "SELECT COUNT(*) FROM tournament_roster WHERE tournament_id = $1;",
+                tournament_id)
+            matches = await conn.fetch(query + " AND tournament_id = $2 ORDER BY match_id;",
+                                       state.last_match_id, tournament_id)
+        round_id, number = await _latest_round(conn, tournament_id)
+        if not checkpoint.catch_up(state, player_count, number, _tuples(matches)):
+            state = await _read_checkpoint(conn, tournament_id, round_id, number)
+    return state
+
+
+async def registerTournamentPlayer(db, tournament_id, player_id):
+    """ Register a player in a specific tournament. """
+    async with _connection(db) as conn:
+        await conn.execute("INSERT INTO tournament_roster (tournament_id, player_id) "
+                           "VALUES ($1, $2);", tournament_id, player_id)
+        await _announce(conn, feed.Resync([tournament_id]))
+
+
+async def registerTournamentPlayers(db, tournament_id, player_ids,
+                                    chunk_size=BULK_CHUNK_SIZE):
+    """ Register many players in a specific tournament; returns the row count. """
+    count = 0
+    async with _connection(db) as conn:
+        for chunk in _chunks(player_ids, chunk_size):
+            await conn.copy_records_to_table(
+                'tournament_roster', columns=['tournament_id', 'player_id'],
+                records=[(tournament_id, player_id) for player_id in chunk])
+            count += len(chunk)
+        await _announce(conn, feed.Resync([tournament_id]))
+    return count
+
+
+async def exportTournament(db, tournament_id, path, fetch_size=BULK_CHUNK_SIZE):
+    """ Writes a tournament to an archive file; see tournament.py.
+
+    Returns:
+      A dict of archive table name -> rows written.
+    """
+    tables = {}
+    async with _connection(db) as conn:
+        if await conn.fetchval("SELECT 1 FROM tournaments WHERE tournament_id = $1;",
+                               tournament_id) is None:
+            raise ValueError("Unknown tournament id {0}.".format(tournament_id))
+        await conn.execute("LOCK TABLE tournament_roster, rounds, pairings, matches "
+                           "IN SHARE MODE;")
+        for table in archive.SCHEMA:
+            columns = archive.new_table(table)
+            async for row in conn.cursor(_ARCHIVE_QUERIES[table].replace('%s', '$1'),
+                                         tournament_id, prefetch=fetch_size):
+                for column, value in zip(columns.values(), row):
+                    column.append(value)
+            tables[table] = columns
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, archive.write_archive, path, tables)
+    return dict((table, len(list(columns.values())[0]))
+                for table, columns in tables.items())
+
+
+def _nullable(*columns):
+    """ Rows of aligned integer columns, with 0 as None. """
+    return [tuple(int(value) or None for value in row) for row in zip(*columns)]
+
+
+async def importTournament(db, path):
+    """ Loads a tournament from an archive; returns its new id.  See tournament.py. """
+    with archive.Archive(path) as source:
+        players = source.table('players')
+        roster = source.table('roster')
+        rounds = source.table('rounds')
+        pairings = source.table('pairings')
+        matches = source.table('matches')
+        async with _connection(db) as conn:
+            tournament_id = await conn.fetchval(
+                "INSERT INTO tournaments DEFAULT VALUES RETURNING tournament_id;")
+            player_ids = await _next_ids(conn, 'players_id_seq', len(players['id']))
+            round_ids = await _next_ids(conn, 'rounds_round_id_seq', len(rounds['round_id']))
+            pairing_ids = await _next_ids(conn, 'pairings_pairing_id_seq',
+                                          len(pairings['pairing_id']))
+            await conn.execute("LOCK TABLE matches IN ROW EXCLUSIVE MODE;")
+            match_ids = await _next_ids(conn, 'matches_match_id_seq',
+                                        len(matches['match_id']))
+
+            def player(column):
+                return archive.remap(column, players['id'], player_ids)
+
+            ones, twos = player(matches['one']), player(matches['two'])
+            loop = asyncio.get_event_loop()
+            rated = await loop.run_in_executor(
+                None, ratings.replay, player_ids, ones, twos, matches['draw'])
+
+            await conn.execute("SET LOCAL tournament.bulk_load = 'on';")
+            await conn.copy_records_to_table(
+                'players', columns=['id', 'name', 'rating'],
+                records=list(zip(player_ids, players['name'], rated)))
+            await conn.copy_records_to_table(
+                'tournament_roster', columns=['tournament_id', 'player_id'],
+                records=_nullable([tournament_id] * len(roster['player_id']),
+                                  player(roster['player_id'])))
+            await conn.copy_records_to_table(
+                'rounds', columns=['round_id', 'tournament_id', 'number'],
+                records=_nullable(round_ids, [tournament_id] * len(round_ids),
+                                  rounds['number']))
+            await conn.copy_records_to_table(
+                'pairings', columns=['pairing_id', 'round_id', 'player_one', 'player_two'],
+                records=_nullable(
+                    pairing_ids,
+                    archive.remap(pairings['round_id'], rounds['round_id'], round_ids),
+                    player(pairings['player_one']), player(pairings['player_two'])))
+            await conn.copy_records_to_table(
+                'matches', columns=['match_id', 'winner_id', 'loser_id', 'draw_id_one',
+                                    'draw_id_two', 'tournament_id', 'pairing_id'],
+                records=_nullable(
+                    match_ids, *(list(archive.split_results(ones, twos, matches['draw'])) +
+                                 [[tournament_id] * len(match_ids),
+                                  archive.remap(matches['pairing_id'],
+                                                pairings['pairing_id'], pairing_ids)])))
+            await conn.execute("SET LOCAL tournament.bulk_load = 'off';")
+
+            await conn.execute(
+                "INSERT INTO player_stats (tournament_id, player_id, wins, losses, draws, "
+                "matches) SELECT scope, player_id, SUM(wins), SUM(losses), SUM(draws), "
+                "SUM(wins + losses + draws) FROM ("
+                "SELECT 0 AS scope, unnest($1::integer[]) AS player_id, "
+                "0 AS wins, 0 AS losses, 0 AS draws "
+                "UNION ALL SELECT $2, player_id, 0, 0, 0 FROM tournament_roster "
+                "WHERE tournament_id = $2 "
+                "UNION ALL SELECT scopes.scope, player_id, wins, losses, draws "
+                "FROM match_results CROSS JOIN (VALUES (0), ($2)) AS scopes (scope) "
+                "WHERE tournament_id = $2) AS results "
+                "GROUP BY scope, player_id;", player_ids, tournament_id)
+            await conn.execute("SELECT update_tiebreaks($1);", tournament_id)
+            await conn.execute(
+                "UPDATE player_stats z SET buchholz = s.buchholz, "
+                "sonneborn_berger = s.sonneborn_berger, opp_match_win_pct = s.opp_match_win_pct "
+                "FROM player_stats s WHERE s.tournament_id = $1 "
+                "AND z.tournament_id = 0 AND z.player_id = s.player_id;", tournament_id)
+            await _announce(conn, feed.Resync([None]))
+    return tournament_id
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# aio_loadtest.py -- throughput of the asyncio API as concurrency grows
+#
+# Simulates many tables reporting results at once while scoreboards read
+# standings, at increasing numbers of concurrent clients:
+#
+#   python3 aio_loadtest.py --players 1024 --reports 5000 --concurrency 1,8,32,128
+#
+# WARNING: the load test deletes everything in the tournament database.
+#
+import argparse
+import asyncio
+import random
+import time
+
+import aio
+
+# One in this many requests is a standings read rather than a report.
+READ_EVERY = 10
+
+
+async def seed(players):
+    await aio.resetDatabase(None)
+    await aio.registerTournament(None)
+    [(tournament_id,)] = await aio.getTournaments(None)
+    player_ids = await aio.registerPlayers(
+        None, ("Player {0}".format(i) for i in range(players)))
+    await aio.registerTournamentPlayers(None, tournament_id, player_ids)
+    return tournament_id, player_ids
+
+
+async def run_level(concurrency, requests, tournament_id, player_ids, rng):
+    """ Serve `requests` requests with `concurrency` concurrent clients.
+
+    Returns:
+      (elapsed seconds, reports, reads)
+    """
+    queue = list(range(requests))
+    counts = {'reports': 0, 'reads': 0}
+
+    async def client():
+        while queue:
+            request = queue.pop()
+            if request % READ_EVERY == 0:
+                await aio.playerStandings(None, tournament_id)
+                counts['reads'] += 1
+            else:
+                winner, loser = rng.sample(player_ids, 2)
+                await aio.reportMatch(None, winner, loser, tournament_id=tournament_id)
+                counts['reports'] += 1
+
+    start = time.time()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return time.time() - start, counts['reports'], counts['reads']
+
+
+async def main(args):
+    levels = [int(level) for level in args.concurrency.split(',')]
+    await aio.configure_pool(max_size=args.pool_size)
+    rng = random.Random(args.seed)
+    tournament_id, player_ids = await seed(args.players)
+
+    row = "{0:>12}{1:>12}{2:>14}{3:>10}"
+    print(row.format("concurrency", "seconds", "requests/s", "speedup"))
+    baseline = None
+    for level in levels:
+        await aio.deleteMatches(None)
+        elapsed, reports, reads = await run_level(level, args.reports, tournament_id,
+                                                  player_ids, rng)
+        throughput = (reports + reads) / elapsed
+        if baseline is None:
+            baseline = throughput
+        print(row.format(level, "{0:.2f}".format(elapsed), "{0:.0f}".format(throughput),
+                         "{0:.1f}x".format(throughput / baseline)))
+    await aio.close_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Load test the asyncio tournament API.")
+    parser.add_argument('--players', type=int, default=1024)
+    parser.add_argument('--reports', type=int, default=5000,
+                        help="requests per concurrency level")
+    parser.add_argument('--concurrency', default="1,4,16,64,256",
+                        help="comma separated numbers of concurrent clients")
+    parser.add_argument('--pool-size', type=int, default=50,
+                        help="connections in the asyncpg pool")
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+#
+# Test cases for aio.py
+#
+# Every scenario runs twice against PostgreSQL, through aio.py and then
+# through tournament.py, and both runs must see the same results.  Needs
+# Python 3.7+ and asyncpg.
+#
+# WARNING: like tournament_test.py, this deletes everything in the
+# tournament database.
+import asyncio
+import os
+import shutil
+import tempfile
+
+import aio
+import feed
+import tournament
+from tournament import ResultConflict
+
+
+class Api(object):
+    """ A module's API functions as coroutines, with `db` left out: aio's
+    on its pool, tournament.py's on its pool. """
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        function = getattr(self.module, name)
+
+        async def call(*args, **kwargs):
+            if asyncio.iscoroutinefunction(function):
+                return await function(None, *args, **kwargs)
+            return function(None, *args, **kwargs)
+        return call
+
+
+async def compare(scenario):
+    """ Run scenario(api) through aio.py and tournament.py; returns aio's
+    results once they match. """
+    expected = await scenario(Api(tournament))
+    results = await scenario(Api(aio))
+    if results != expected:
+        raise ValueError("aio.{0} should match tournament.py:\n  {1}\n  {2}".format(
+            scenario.__name__, results, expected))
+    return results
+
+
+async def registration(api):
+    await api.resetDatabase()
+    await api.registerPlayer("Twilight Sparkle")
+    ids = await api.registerPlayers(("Player {0}".format(i) for i in range(9)),
+                                    chunk_size=4)
+    await api.registerTournament()
+    [(t_id,)] = await api.getTournaments()
+    await api.registerTournamentPlayer(t_id, 1)
+    count = await api.registerTournamentPlayers(t_id, iter(ids), chunk_size=4)
+    roster = sorted(await api.getTournamentRoster(t_id))
+    return (ids, count, await api.countPlayers(), roster,
+            await api.playerStandings(), await api.playerStandings(t_id))
+
+
+async def testRegistration():
+    ids, count, players, roster, standings, tournament_standings = await compare(registration)
+    if ids != list(range(2, 11)) or count != 9 or players != 10:
+        raise ValueError("Players should be registered in bulk, ids in input order.")
+    if len(roster) != 10 or len(tournament_standings) != 10:
+        raise ValueError("Every registered player should be on the roster.")
+    print("1. aio registers players and tournaments as tournament.py does.")
+
+
+async def reporting(api):
+    await api.resetDatabase()
+    ids = await api.registerPlayers(["Applejack", "Rarity", "Fluttershy", "Rainbow Dash",
+                                     "Pinkie Pie"])
+    await api.registerTournament()
+    [(t_id,)] = await api.getTournaments()
+    await api.registerTournamentPlayers(t_id, ids)
+    round_id, pairing_ids = await api.createRound(await api.swissPairings(t_id), t_id)
+    rows = await api.getPairings(round_id)
+    (first, one, two, _), (second, three, four, _) = rows[:2]
+    match_id = await api.reportMatch(one, two, pairing_id=first)
+    replayed = await api.reportMatch(one, two, pairing_id=first)
+    try:
+        await api.reportMatch(two, one, pairing_id=first)
+        conflict = None
+    except ResultConflict as e:
+        conflict = str(e)
+    await api.reportMatch(three, four, draw=True, pairing_id=second)
+    [(bye, player, _, _)] = [row for row in rows if row[2] is None]
+    await api.reportMatch(player, None, pairing_id=bye)
+    batch = await api.reportMatches([(ids[0], ids[1]), (ids[2], ids[3], True)], t_id)
+    await api.updateTiebreaks(t_id)
+    return (pairing_ids, await api.getPairings(round_id), match_id, replayed, conflict,
+            batch, await api.playerStandings(), await api.playerStandings(t_id, tiebreaks=True),
+            await api.getMatchHistory(t_id), await api.verifyPlayerStats())
+
+
+async def testReporting():
+    (pairing_ids, rows, match_id, replayed, conflict, batch, standings,
+     tournament_standings, history, drift) = await compare(reporting)
+    if replayed != match_id:
+        raise ValueError("Reporting a pairing's result again should return its match.")
+    if conflict is None:
+        raise ValueError("A different result for a pairing should raise ResultConflict.")
+    if len(batch) != 2 or any(row[3] is None for row in rows):
+        raise ValueError("Every pairing and batched result should be recorded.")
+    if drift:
+        raise ValueError("player_stats should match the recorded matches.")
+    print("2. aio reports results, replays and conflicts as tournament.py does.")
+
+
+async def paging(api):
+    await api.resetDatabase()
+    ids = await api.registerPlayers("Player {0}".format(i) for i in range(25))
+    await api.registerTournament()
+    [(t_id,)] = await api.getTournaments()
+    await api.registerTournamentPlayers(t_id, ids[:20])
+    await api.reportMatches([(ids[i], ids[(3 * i + 1) % 25], i % 4 == 0)
+                             for i in range(25)], t_id)
+    await api.updateTiebreaks(t_id)
+    await api.updateTiebreaks()
+    pages = []
+    for scope in (None, t_id):
+        after = None
+        while True:
+            page = await api.leaderboard(scope, limit=6, after=after)
+            if not page:
+                break
+            pages.append(page)
+            after = page[-1]
+    return pages, await api.leaderboard(None, limit=100), await api.leaderboard(t_id, limit=100)
+
+
+async def testLeaderboard():
+    pages, total, scoped = await compare(paging)
+    if [row for page in pages for row in page] != total + scoped:
+        raise ValueError("Leaderboard pages should add up to the whole leaderboard.")
+    if len(total) != 25 or len(scoped) != 20:
+        raise ValueError("The leaderboard should list the players in its scope.")
+    print("3. aio pages through the leaderboard as tournament.py does.")
+
+
+async def deletes(api):
+    await api.resetDatabase()
+    ids = await api.registerPlayers(["Player {0}".format(i) for i in range(6)])
+    for _ in range(2):
+        await api.registerTournament()
+    [t_one, t_two] = sorted(row[0] for row in await api.getTournaments())
+    await api.registerTournamentPlayers(t_one, ids[:4])
+    await api.registerTournamentPlayers(t_two, ids[2:])
+    await api.reportMatches([(ids[0], ids[1]), (ids[2], ids[3])], t_one)
+    await api.reportMatches([(ids[4], ids[5]), (ids[2], ids[4], True)], t_two)
+    states = []
+
+    async def state():
+        states.append((await api.getTournaments(), await api.playerStandings(),
+                       await api.playerStandings(t_two), await api.countPlayers(),
+                       await api.verifyPlayerStats()))
+    await api.deleteTournament(t_one)
+    await state()
+    await api.deleteMatches()
+    await state()
+    await api.deleteTournaments()
+    await state()
+    await api.deletePlayers()
+    await state()
+    return states
+
+
+async def testDeletes():
+    states = await compare(deletes)
+    if [len(tournaments) for tournaments, _, _, _, _ in states] != [1, 1, 0, 0]:
+        raise ValueError("Tournaments should be deleted one at a time or all at once.")
+    if states[-1][3] != 0 or any(drift for _, _, _, _, drift in states):
+        raise ValueError("Deletes should leave player_stats consistent.")
+    print("4. aio deletes tournaments, matches and players as tournament.py does.")
+
+
+def resumed(state):
+    """ What a resumeTournament Checkpoint holds, comparably. """
+    if state is None:
+        return None
+    return (state.tournament_id, state.round_id, state.round_number, state.last_match_id,
+            state.standings(tiebreaks=True), state.pairings, state.swiss_pairings())
+
+
+async def rounds(api):
+    await api.resetDatabase()
+    ids = await api.registerPlayers(["Player {0}".format(i) for i in range(15)])
+    await api.registerTournament()
+    await api.registerTournament()
+    [t_id, t_other] = sorted(row[0] for row in await api.getTournaments())
+    await api.registerTournamentPlayers(t_id, ids[:9])
+    await api.registerTournamentPlayers(t_other, ids[9:])
+    states = []
+    for number in range(3):
+        pairings = await api.swissPairings(t_id, by_rating=number == 2)
+        round_id, pairing_ids = await api.createRound(pairings, t_id, checkpoint=number == 0)
+        # The last board is left to be played after the checkpoint.
+        rows = await api.getPairings(round_id)
+        for pairing_id, one, two, _ in rows[:-1]:
+            await api.reportMatch(one, two, draw=(one + two) % 5 == 0, pairing_id=pairing_id)
+        states.append(resumed(await api.resumeTournament(t_id)))
+        if number == 1:
+            await api.checkpointRound(t_id)
+        if number < 2:
+            pairing_id, one, two, _ = rows[-1]
+            await api.reportMatch(one, two, pairing_id=pairing_id)
+        await api.updateTiebreaks(t_id)
+    states.append(resumed(await api.resumeTournament(t_id)))
+    states.append(resumed(await api.resumeTournament(t_other)))
+    # Plain pairs, as schedules.py produces them, outside any tournament.
+    round_id, _ = await api.createRound([(ids[9], ids[10]), (ids[11], None)])
+    changed = await api.recomputeRatings(fetch_size=4)
+    pairings, errors = await api.pairAll([t_id, t_other, 999])
+    errors = dict((key, (type(error).__name__, str(error))) for key, error in errors.items())
+    return (states, await api.getPairings(round_id), await api.swissPairings(),
+            changed, await api.playerRatings(t_id), await api.playerRank(ids[0], t_id),
+            await api.getPairingData([t_id, t_other]), pairings, errors)
+
+
+async def testRounds():
+    states, pairs, totals, changed, ratings, rank, data, pairings, errors = await compare(rounds)
+    if states[0] is None or states[-1] is not None:
+        raise ValueError("Tournaments should resume from their checkpoints only.")
+    if len(pairs) != 2 or set(errors) != set([999]) or len(pairings) != 2:
+        raise ValueError("Plain pairs and pairAll should be handled alike.")
+    print("5. aio pairs, checkpoints and resumes rounds as tournament.py does.")
+
+
+async def archives(api):
+    await api.resetDatabase()
+    ids = await api.registerPlayers(["Player {0}".format(i) for i in range(6)])
+    await api.registerTournament()
+    [(t_id,)] = await api.getTournaments()
+    await api.registerTournamentPlayers(t_id, ids)
+    round_id, _ = await api.createRound(await api.swissPairings(t_id), t_id)
+    for pairing_id, one, two, _ in await api.getPairings(round_id):
+        await api.reportMatch(one, two, pairing_id=pairing_id)
+    await api.updateTiebreaks(t_id)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'tournament.archive')
+        await api.exportTournament(t_id, path, fetch_size=2)
+        imported = await api.importTournament(path)
+    finally:
+        shutil.rmtree(directory)
+    return (imported, await api.playerStandings(imported, tiebreaks=True),
+            sorted(await api.getTournamentRoster(imported)),
+            await api.getMatchHistory(imported), await api.playerRatings(imported),
+            await api.verifyPlayerStats())
+
+
+async def testArchives():
+    imported, standings, roster, history, ratings, drift = await compare(archives)
+    if len(standings) != 6 or len(history) != 3 or drift:
+        raise ValueError("An imported tournament should have the exported results.")
+    print("6. aio exports and imports tournaments as tournament.py does.")
+
+
+async def following(api):
+    await api.resetDatabase()
+    ids = await api.registerPlayers(["Player {0}".format(i) for i in range(4)])
+    await api.registerTournament()
+    [(t_id,)] = await api.getTournaments()
+    await api.registerTournamentPlayers(t_id, ids)
+    round_id, pairing_ids = await api.createRound(await api.swissPairings(t_id), t_id)
+    if api.module is aio:
+        subscription = aio.subscribeStandings(None, t_id)
+        _, start = await subscription.__anext__()
+
+        async def next_change():
+            return await asyncio.wait_for(subscription.__anext__(), 10)
+    else:
+        subscription = tournament.subscribeStandings(None, t_id)
+        start = subscription.standings.standings()
+
+        async def next_change():
+            return subscription.get(timeout=10)
+    changes = []
+    try:
+        for pairing_id, one, two, _ in await api.getPairings(round_id):
+            await api.reportMatch(one, two, pairing_id=pairing_id)
+            changes.append(await next_change())
+    finally:
+        if api.module is aio:
+            await subscription.aclose()
+        else:
+            subscription.close()
+    return start, changes, await api.playerStandings(t_id)
+
+
+async def testFeed():
+    start, changes, standings = await compare(following)
+    if [type(event) for event, _ in changes] != [feed.Result, feed.Result]:
+        raise ValueError("Subscribers should be sent every result.")
+    if changes[-1][1] != standings:
+        raise ValueError("The standings pushed should match the database.")
+    print("7. aio pushes live standings as tournament.py does.")
+
+
+TESTS = [
+    testRegistration,
+    testReporting,
+    testLeaderboard,
+    testDeletes,
+    testRounds,
+    testArchives,
+    testFeed,
+]
+
+
+async def main():
+    # Both APIs announce their writes on the live standings feed.
+    await aio.configure_pool(server_settings={'tournament.feed': 'on'})
+    tournament.configure_pool(options="-c tournament.feed=on")
+    try:
+        for test in TESTS:
+            await test()
+    finally:
+        tournament.disable_feed()
+        await aio.close_pool()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+#
+# archive.py -- compact columnar files holding whole tournaments
+#
+# An archive stores a tournament's players, roster, rounds, pairings and
+# matches column by column, as little-endian fixed-width arrays behind a
+# small JSON header, so it can be read through mmap without parsing.  Ids
+# are the ones the tournament had when it was exported; importing assigns
+# new ones (see remap).  0 stands for NULL in id columns.
+#
+# tournament.exportTournament and importTournament move archives in and out
+# of the database.  Uses NumPy when it is installed.
+#
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MAGIC = b'TRNARCH1'
+
+# Columns of each table in an archive, and their types: 'i4' for 32 bit
+# integers, 'b1' for booleans and 'text' for UTF-8.
+SCHEMA = collections.OrderedDict([
+    ('players', (('id', 'i4'), ('name', 'text'))),
+    ('roster', (('player_id', 'i4'),)),
+    ('rounds', (('round_id', 'i4'), ('number', 'i4'))),
+    ('pairings', (('pairing_id', 'i4'), ('round_id', 'i4'),
+                  ('player_one', 'i4'), ('player_two', 'i4'))),
+    # one is the winner (or a drawing player), two the loser (or the other
+    # drawing player, or 0 for a bye).
+    ('matches', (('match_id', 'i4'), ('one', 'i4'), ('two', 'i4'),
+                 ('draw', 'b1'), ('pairing_id', 'i4'))),
+])
+
+# array typecodes, and NumPy dtypes, of the fixed-width column types.
+_TYPECODES = {'i4': 'i', 'b1': 'b'}
+_DTYPES = {'i4': '<i4', 'b1': '<i1'}
+
+# Column blocks start on multiples of this many bytes.
+_ALIGNMENT = 8
+
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def to_bytes(column):
+    """ The little-endian bytes of an array. """
+    if _BIG_ENDIAN:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes() if hasattr(column, 'tobytes') else column.tostring()
+
+
+def from_bytes(typecode, data):
+    """ An array of `typecode` from little-endian bytes. """
+    column = array(typecode)
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if _BIG_ENDIAN:
+        column.byteswap()
+    return column
+
+
+def _column_bytes(kind, column):
+    """ The bytes of a fixed-width column as an archive stores them. """
+    if numpy is not None and not isinstance(column, array):
+        return numpy.asarray(column, dtype=_DTYPES[kind]).tobytes()
+    if not isinstance(column, array) or column.typecode != _TYPECODES[kind]:
+        column = array(_TYPECODES[kind], column)
+    return to_bytes(column)
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def new_table(table):
+    """ Empty columns to append a table's rows to, as write_archive takes them. """
+    return collections.OrderedDict(
+        (name, [] if kind == 'text' else array(_TYPECODES[kind]))
+        for name, kind in SCHEMA[table])
+
+
+def write_archive(path, tables):
+    """ Write an archive atomically.
+
+    Args:
+      path: the file to create or replace.
+      tables: dict of table name -> dict of column name -> sequence, with a
+        column for every entry of SCHEMA.
+    """
+    header = {'tables': collections.OrderedDict()}
+    blocks = []
+    offset = 0
+
+    def add_block(data):
+        start = offset + (-offset % _ALIGNMENT)
+        blocks.append((start, data))
+        return start, start + len(data)
+
+    for table, columns in SCHEMA.items():
+        values = tables[table]
+        rows = len(values[columns[0][0]])
+        described = collections.OrderedDict()
+        for name, kind in columns:
+            column = values[name]
+            if len(column) != rows:
+                raise ValueError("Column {0}.{1} has {2} rows, not {3}.".format(
+                    table, name, len(column), rows))
+            if kind == 'text':
+                encoded = [_encode(text or u'') for text in column]
+                ends = array('i', [0])
+                for text in encoded:
+                    ends.append(ends[-1] + len(text))
+                start, offset = add_block(to_bytes(ends))
+                described[name] = {'type': kind, 'offsets': start}
+                start, offset = add_block(b''.join(encoded))
+                described[name]['data'] = start
+            else:
+                start, offset = add_block(_column_bytes(kind, column))
+                described[name] = {'type': kind, 'data': start}
+        header['tables'][table] = {'rows': rows, 'columns': described}
+
+    encoded_header = json.dumps(header).encode('utf-8')
+    base = len(MAGIC) + 4 + len(encoded_header)
+    base += -base % _ALIGNMENT
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(encoded_header)))
+        f.write(encoded_header)
+        position = len(MAGIC) + 4 + len(encoded_header)
+        for start, data in blocks:
+            f.write(b'\0' * (base + start - position))
+            f.write(data)
+            position = base + start + len(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary, path)
+
+
+class Archive(object):
+    """ An archive opened for reading through mmap.
+
+    Fixed-width columns come back as NumPy arrays viewing the mapping
+    directly when NumPy is installed, else as copied arrays; text columns
+    as lists.  Close the archive (or use it as a context manager) once its
+    columns are no longer needed.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{0} is not a tournament archive.".format(path))
+        start = len(MAGIC) + 4
+        [length] = struct.unpack('<I', self._map[len(MAGIC):start])
+        self._header = json.loads(self._map[start:start + length].decode('utf-8'))
+        base = start + length
+        self._base = base + (-base % _ALIGNMENT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass        # NumPy views still use it; freed with them
+            self._map = None
+            self._file.close()
+
+    def rows(self, table):
+        """ Number of rows in a table. """
+        return self._header['tables'][table]['rows']
+
+    def column(self, table, name):
+        """ One column of a table. """
+        rows = self.rows(table)
+        described = self._header['tables'][table]['columns'][name]
+        kind = described['type']
+        start = self._base + described['data']
+        if kind == 'text':
+            offsets = self._base + described['offsets']
+            ends = from_bytes('i', self._map[offsets:offsets + 4 * (rows + 1)])
+            data = self._map[start:start + ends[-1]]
+            return [data[ends[i]:ends[i + 1]].decode('utf-8') for i in range(rows)]
+        if numpy is not None:
+            return numpy.frombuffer(self._map, dtype=_DTYPES[kind], count=rows, offset=start)
+        size = array(_TYPECODES[kind]).itemsize
+        return from_bytes(_TYPECODES[kind], self._map[start:start + size * rows])
+
+    def table(self, table):
+        """ dict of column name -> column for every column of a table. """
+        return dict((name, self.column(table, name)) for name, _ in SCHEMA[table])
+
+
+def remap(column, old_ids, new_ids):
+    """ Translate ids in a column; 0 (NULL) stays 0.
+
+    Args:
+      column: the ids to translate.
+      old_ids, new_ids: aligned sequences mapping each old id to its new one.
+
+    Returns:
+      A list (or NumPy array) of the new ids.
+
+    Raises:
+      ValueError: the column refers to an id not in old_ids.
+    """
+    if numpy is not None:
+        old_ids = numpy.asarray(old_ids, dtype=numpy.int64)
+        new_ids = numpy.asarray(new_ids, dtype=numpy.int64)
+        column = numpy.asarray(column, dtype=numpy.int64)
+        translated = numpy.zeros_like(column)
+        if len(old_ids):
+            order = numpy.argsort(old_ids)
+            sorted_ids = old_ids[order]
+            slots = numpy.searchsorted(sorted_ids, column).clip(0, len(old_ids) - 1)
+            translated = numpy.where(sorted_ids[slots] == column, new_ids[order][slots], 0)
+        unknown = (translated == 0) & (column != 0)
+        if unknown.any():
+            raise ValueError("Archive refers to unknown id {0}.".format(column[unknown][0]))
+        return translated
+    mapping = dict(zip(old_ids, new_ids))
+    mapping[0] = 0
+    try:
+        return [mapping[value] for value in column]
+    except KeyError as e:
+        raise ValueError("Archive refers to unknown id {0}.".format(e.args[0]))
+
+
+def split_results(ones, twos, draw_flags):
+    """ The matches table's result columns from an archive's.
+
+    Returns:
+      (winner_ids, loser_ids, draw_ids_one, draw_ids_two), with 0 for NULL.
+    """
+    if numpy is not None:
+        ones = numpy.asarray(ones, dtype=numpy.int64)
+        twos = numpy.asarray(twos, dtype=numpy.int64)
+        draw_flags = numpy.asarray(draw_flags, dtype=bool)
+        return (numpy.where(draw_flags, 0, ones), numpy.where(draw_flags, 0, twos),
+                numpy.where(draw_flags, ones, 0), numpy.where(draw_flags, twos, 0))
+    columns = ([], [], [], [])
+    for one, two, draw in zip(ones, twos, draw_flags):
+        row = (0, 0, one, two) if draw else (one, two, 0, 0)
+        for column, value in zip(columns, row):
+            column.append(value)
+    return columns
+
+
+# Header and trailer of COPY's binary format.
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+
+
+def binary_copy(columns):
+    """ Rows of integer columns in COPY's binary format; needs NumPy.
+
+    Parsing binary integers is much cheaper for the server than text, and
+    the stream is built without a Python loop over the rows.
+
+    Args:
+      columns: aligned integer columns; 0 is sent as NULL.
+
+    Returns:
+      The bytes to feed to COPY ... FROM STDIN WITH (FORMAT binary).
+    """
+    columns = [numpy.asarray(column, dtype=numpy.int64) for column in columns]
+    rows = len(columns[0]) if columns else 0
+    # A NULL field has no value bytes, so rows are laid out by which of
+    # their fields are NULL; every pattern is then a fixed-width record.
+    patterns = numpy.zeros(rows, dtype=numpy.int64)
+    for i, column in enumerate(columns):
+        patterns |= (column == 0).astype(numpy.int64) << i
+    parts = [_COPY_HEADER]
+    for pattern in numpy.unique(patterns).tolist():
+        selected = numpy.nonzero(patterns == pattern)[0]
+        null = [bool(pattern >> i & 1) for i in range(len(columns))]
+        fields = [('count', '>i2')]
+        for i in range(len(columns)):
+            fields.append(('length{0}'.format(i), '>i4'))
+            if not null[i]:
+                fields.append(('value{0}'.format(i), '>i4'))
+        records = numpy.empty(len(selected), dtype=fields)
+        records['count'] = len(columns)
+        for i, column in enumerate(columns):
+            if null[i]:
+                records['length{0}'.format(i)] = -1
+            else:
+                records['length{0}'.format(i)] = 4
+                records['value{0}'.format(i)] = column[selected]
+        parts.append(records.tobytes())
+    parts.append(_COPY_TRAILER)
+    return b''.join(parts)
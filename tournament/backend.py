@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# backend.py -- interface for alternative tournament storage engines
+#
+
+
+class Backend(object):
+    """ Storage engine behind the public tournament.py functions.
+
+    PostgreSQL is the default and is implemented directly in tournament.py.
+    Any other engine subclasses Backend and is activated with
+    tournament.set_backend(), or by passing the instance as the `db`
+    argument.  Methods take the same arguments as the public functions of
+    the same name, minus `db`, and must return the same row shapes in the
+    same order.
+    """
+
+    def transaction(self):
+        """ Context manager grouping several calls into one unit of work. """
+        raise NotImplementedError
+
+    def isolated(self):
+        """ Context manager undoing every call made in the block. """
+        raise NotImplementedError
+
+    def resetDatabase(self):
+        raise NotImplementedError
+
+    def deleteMatches(self):
+        raise NotImplementedError
+
+    def deletePlayers(self):
+        raise NotImplementedError
+
+    def deleteTournaments(self):
+        raise NotImplementedError
+
+    def deleteTournament(self, tournament_id):
+        raise NotImplementedError
+
+    def rebuildPlayerStats(self):
+        raise NotImplementedError
+
+    def verifyPlayerStats(self):
+        raise NotImplementedError
+
+    def countPlayers(self):
+        raise NotImplementedError
+
+    def getTournaments(self):
+        raise NotImplementedError
+
+    def getTournamentRoster(self, tournament_id):
+        raise NotImplementedError
+
+    def registerPlayer(self, name):
+        raise NotImplementedError
+
+    def registerPlayers(self, names, chunk_size=None, commit_chunks=False):
+        raise NotImplementedError
+
+    def registerTournament(self):
+        raise NotImplementedError
+
+    def playerStandings(self, tournament_id=None, tiebreaks=False):
+        raise NotImplementedError
+
+    def iterStandings(self, tournament_id=None, fetch_size=None, tiebreaks=False,
+                      by_score=False):
+        raise NotImplementedError
+
+    def subscribeStandings(self, tournament_id=None, tiebreaks=False, max_queue=None):
+        raise NotImplementedError
+
+    def leaderboard(self, tournament_id=None, limit=None, after=None):
+        raise NotImplementedError
+
+    def playerRank(self, player_id, tournament_id=None):
+        raise NotImplementedError
+
+    def updateTiebreaks(self, tournament_id=None):
+        raise NotImplementedError
+
+    def playerRatings(self, tournament_id=None):
+        raise NotImplementedError
+
+    def recomputeRatings(self, fetch_size=None):
+        raise NotImplementedError
+
+    def reportMatch(self, winner, loser, draw=False, tournament_id=None, pairing_id=None):
+        raise NotImplementedError
+
+    def reportMatches(self, results, tournament_id=None, chunk_size=None,
+                      commit_chunks=False):
+        raise NotImplementedError
+
+    def getMatchHistory(self, tournament_id=None):
+        raise NotImplementedError
+
+    def getPairingData(self, tournament_ids):
+        raise NotImplementedError
+
+    def createRound(self, pairings, tournament_id=None, checkpoint=False):
+        raise NotImplementedError
+
+    def getPairings(self, round_id):
+        raise NotImplementedError
+
+    def checkpointRound(self, tournament_id=None):
+        raise NotImplementedError
+
+    def resumeTournament(self, tournament_id=None):
+        raise NotImplementedError
+
+    def registerTournamentPlayer(self, tournament_id, player_id):
+        raise NotImplementedError
+
+    def registerTournamentPlayers(self, tournament_id, player_ids,
+                                  chunk_size=None, commit_chunks=False):
+        raise NotImplementedError
+
+    def exportTournament(self, tournament_id, path, fetch_size=None):
+        raise NotImplementedError
+
+    def importTournament(self, path):
+        raise NotImplementedError
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- timing harness for the public tournament.py functions
+#
+# Seeds fields of increasing size into a local PostgreSQL database, times
+# every public function against them and reports throughput, p50/p99
+# latency and SQL statements per call.  Results can be saved as JSON and compared
+# with a stored baseline:
+#
+#   python benchmark.py --sizes 16,1024,65536 --save baseline.json
+#   python benchmark.py --sizes 16,1024,65536 --baseline baseline.json
+#
+# --pair-all instead times pairAll over many small events with a growing
+# number of worker processes:
+#
+#   python benchmark.py --pair-all 500 --event-size 64
+#
+# --prepared times the small, frequent calls with the hot queries sent as
+# text and then as prepared statements:
+#
+#   python benchmark.py --prepared 1024
+#
+# WARNING: the benchmark deletes everything in the tournament database.
+#
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import sys
+import time
+
+import tournament
+from demo import calc_tournament_rounds
+from instrument import LoggingExporter
+from memory import MemoryBackend
+
+DEFAULT_SIZES = (16, 1024, 65536, 1048576)
+
+# Calls timed per function and field size; whole-field reads are capped
+# separately because each one is proportional to the field.
+DEFAULT_ITERATIONS = 200
+FIELD_ITERATIONS = 10
+
+# Allowed slowdown of p50 latency against the baseline before a result is
+# flagged as a regression.
+DEFAULT_THRESHOLD = 0.2
+
+
+def statements_run():
+    """ SQL statements timed by the instrumentation so far. """
+    stats = tournament.instrumentationStats()
+    if stats is None:
+        return 0
+    return sum(statement['count'] for statement in stats['statements'].values())
+
+
+def percentile(samples, fraction):
+    """ Nearest-rank percentile of a sorted list. """
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+def measure(function, iterations, args_for=None):
+    """ Time `iterations` calls of function(db, *args).
+
+    Args:
+      function: a public tournament.py function.
+      iterations: number of calls.
+      args_for: optional callable(i) returning the extra arguments of call i.
+
+    Returns:
+      A dict of iterations, total seconds, ops_per_sec, p50, p99 (seconds)
+      and queries_per_call.
+    """
+    samples = []
+    queries_before = statements_run()
+    for i in range(iterations):
+        args = args_for(i) if args_for is not None else ()
+        start = time.time()
+        function(None, *args)
+        samples.append(time.time() - start)
+    queries = statements_run() - queries_before
+    total = sum(samples)
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'total': total,
+        'ops_per_sec': iterations / total if total else 0.0,
+        'p50': percentile(samples, 0.50),
+        'p99': percentile(samples, 0.99),
+        'queries_per_call': queries / float(iterations) if iterations else 0.0,
+    }
+
+
+def seed(size, history_rounds, rng):
+    """ Register `size` players in one tournament and play some rounds.
+
+    Returns:
+      (tournament_id, player_ids)
+    """
+    tournament.resetDatabase(None)
+    tournament.registerTournament(None)
+    [tournament_id] = [row[0] for row in tournament.getTournaments(None)]
+    player_ids = tournament.registerPlayers(
+        None, ("Player {0}".format(i) for i in range(size)))
+    tournament.registerTournamentPlayers(None, tournament_id, player_ids)
+    for _ in range(history_rounds):
+        shuffled = list(player_ids)
+        rng.shuffle(shuffled)
+        results = ((one, two, rng.random() < 0.1)
+                   for one, two in zip(shuffled[::2], shuffled[1::2]))
+        tournament.reportMatches(None, results, tournament_id)
+    return tournament_id, player_ids
+
+
+def bench_size(size, iterations, history_rounds, rng):
+    """ Time every public function against a field of `size` players. """
+    tournament_id, player_ids = seed(size, history_rounds, rng)
+    field_iterations = max(1, min(iterations, FIELD_ITERATIONS))
+    results = {}
+
+    def random_pair(i):
+        one, two = rng.sample(player_ids, 2)
+        return (one, two, False, tournament_id)
+
+    results['countPlayers'] = measure(tournament.countPlayers, iterations)
+    results['playerStandings'] = measure(tournament.playerStandings, field_iterations,
+                                         lambda i: (tournament_id,))
+    results['swissPairings'] = measure(tournament.swissPairings, field_iterations,
+                                       lambda i: (tournament_id,))
+    results['reportMatch'] = measure(tournament.reportMatch, iterations, random_pair)
+    results['registerPlayer'] = measure(tournament.registerPlayer, iterations,
+                                        lambda i: ("Bench {0}".format(i),))
+
+    # Deletes empty the tables, so each is timed once on a fresh seed.
+    results['deleteTournament'] = measure(tournament.deleteTournament, 1,
+                                          lambda i: (tournament_id,))
+    seed(size, history_rounds, rng)
+    results['deleteTournaments'] = measure(tournament.deleteTournaments, 1)
+    results['deleteMatches'] = measure(tournament.deleteMatches, 1)
+    results['deletePlayers'] = measure(tournament.deletePlayers, 1)
+    seed(size, history_rounds, rng)
+    results['resetDatabase'] = measure(tournament.resetDatabase, 1)
+    return results
+
+
+def bench_pair_all(events, size, history_rounds, rng, max_processes):
+    """ Time pairAll over `events` tournaments of `size` players each.
+
+    Returns:
+      A list of (processes, seconds) with 1, 2, 4, ... up to max_processes
+      worker processes.
+    """
+    tournament.resetDatabase(None)
+    player_ids = tournament.registerPlayers(
+        None, ("Player {0}".format(i) for i in range(events * size)))
+    for _ in range(events):
+        tournament.registerTournament(None)
+    tournament_ids = [row[0] for row in tournament.getTournaments(None)]
+    for i, tournament_id in enumerate(tournament_ids):
+        roster = player_ids[i * size:(i + 1) * size]
+        tournament.registerTournamentPlayers(None, tournament_id, roster)
+        for _ in range(history_rounds):
+            shuffled = list(roster)
+            rng.shuffle(shuffled)
+            tournament.reportMatches(None, zip(shuffled[::2], shuffled[1::2]), tournament_id)
+
+    timings = []
+    processes = 1
+    while processes <= max_processes:
+        start = time.time()
+        pairings, errors = tournament.pairAll(None, tournament_ids, processes)
+        timings.append((processes, time.time() - start))
+        if errors:
+            raise ValueError("pairAll failed for {0} events.".format(len(errors)))
+        processes *= 2
+    return timings
+
+
+def bench_prepared(size, iterations, rng):
+    """ Time the small, frequent calls with and without prepared statements.
+
+    Returns:
+      A dict of function name -> {'text': result, 'prepared': result}, each
+      result as returned by measure().
+    """
+    tournament_id, player_ids = seed(size, 0, rng)
+    round_id, _ = tournament.createRound(None, tournament.swissPairings(None, tournament_id),
+                                         tournament_id)
+    pairings = tournament.getPairings(None, round_id)
+    for pairing_id, one, two, _ in pairings:
+        tournament.reportMatch(None, one, two, pairing_id=pairing_id)
+    tournament.updateTiebreaks(None, tournament_id)
+
+    def retried_report(i):
+        pairing_id, one, two, _ = pairings[i % len(pairings)]
+        return (one, two, False, None, pairing_id)
+
+    calls = [
+        ('countPlayers', tournament.countPlayers, None),
+        ('playerRank', tournament.playerRank,
+         lambda i: (rng.choice(player_ids), tournament_id)),
+        ('getPairings', tournament.getPairings, lambda i: (round_id,)),
+        ('reportMatch (retry)', tournament.reportMatch, retried_report),
+    ]
+    results = {}
+    for mode, enable in (('text', tournament.disable_prepared_statements),
+                         ('prepared', tournament.configure_prepared_statements)):
+        enable()
+        for name, function, args_for in calls:
+            measure(function, min(iterations, 10), args_for)    # prepare, warm up
+            results.setdefault(name, {})[mode] = measure(function, iterations, args_for)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Flag functions whose p50 latency grew by more than `threshold`.
+
+    Returns:
+      A list of (size, function, baseline_p50, p50) regressions.
+    """
+    regressions = []
+    for size, functions in sorted(results['results'].items(), key=lambda item: int(item[0])):
+        for name, result in sorted(functions.items()):
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if base is None or not base['p50']:
+                continue
+            if result['p50'] > base['p50'] * (1 + threshold):
+                regressions.append((size, name, base['p50'], result['p50']))
+    return regressions
+
+
+def report(results):
+    row = "{0:>9} {1:<20}{2:>12}{3:>12}{4:>12}{5:>10}"
+    print(row.format("size", "function", "ops/s", "p50 ms", "p99 ms", "queries"))
+    for size, functions in sorted(results['results'].items(), key=lambda item: int(item[0])):
+        for name, result in sorted(functions.items()):
+            print(row.format(size, name, "{0:.1f}".format(result['ops_per_sec']),
+                             "{0:.3f}".format(result['p50'] * 1000),
+                             "{0:.3f}".format(result['p99'] * 1000),
+                             "{0:.1f}".format(result['queries_per_call'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the public tournament.py functions.")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated field sizes")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--history-rounds', type=int, default=None,
+                        help="rounds of match history to seed "
+                             "(default: calc_tournament_rounds of the size)")
+    parser.add_argument('--memory', action='store_true',
+                        help="benchmark the in-memory backend instead")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="compare with results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed p50 slowdown, as a fraction")
+    parser.add_argument('--slow-query-ms', type=float, default=None,
+                        help="log statements slower than this, with their plans")
+    parser.add_argument('--pair-all', type=int, default=None, metavar='EVENTS',
+                        help="time pairAll over this many events instead")
+    parser.add_argument('--event-size', type=int, default=64,
+                        help="players per event with --pair-all")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help="most worker processes to try with --pair-all")
+    parser.add_argument('--prepared', type=int, default=None, metavar='PLAYERS',
+                        help="compare text and prepared statements on a field of "
+                             "this many players instead")
+    args = parser.parse_args()
+
+    if args.memory:
+        tournament.set_backend(MemoryBackend())
+    else:
+        exporters = ()
+        threshold = None
+        if args.slow_query_ms is not None:
+            logging.basicConfig()
+            exporters = (LoggingExporter(),)
+            threshold = args.slow_query_ms / 1000.0
+        tournament.configure_instrumentation(threshold, exporters=exporters)
+
+    rng = random.Random(args.seed)
+    if args.pair_all is not None:
+        history_rounds = args.history_rounds
+        if history_rounds is None:
+            history_rounds = calc_tournament_rounds(args.event_size) - 1
+        timings = bench_pair_all(args.pair_all, args.event_size, history_rounds, rng,
+                                 args.processes)
+        print("{0:>9}{1:>12}{2:>10}".format("processes", "seconds", "speedup"))
+        for processes, seconds in timings:
+            print("{0:>9}{1:>12.3f}{2:>9.2f}x".format(processes, seconds,
+                                                       timings[0][1] / seconds))
+        return
+
+    if args.prepared is not None:
+        results = bench_prepared(args.prepared, args.iterations, rng)
+        print("{0:<22}{1:>14}{2:>18}{3:>10}".format(
+            "function", "text p50 ms", "prepared p50 ms", "speedup"))
+        for name, modes in sorted(results.items()):
+            text, prepared = modes['text']['p50'], modes['prepared']['p50']
+            print("{0:<22}{1:>14.3f}{2:>18.3f}{3:>9.2f}x".format(
+                name, text * 1000, prepared * 1000, text / prepared if prepared else 0.0))
+        return
+
+    results = {
+        'meta': {
+            'backend': 'memory' if args.memory else 'postgresql',
+            'python': platform.python_version(),
+            'iterations': args.iterations,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        history_rounds = args.history_rounds
+        if history_rounds is None:
+            history_rounds = calc_tournament_rounds(size)
+        results['results'][str(size)] = bench_size(size, args.iterations,
+                                                   history_rounds, rng)
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for size, name, before, after in regressions:
+            print("REGRESSION {0} @ {1}: p50 {2:.3f}ms -> {3:.3f}ms".format(
+                name, size, before * 1000, after * 1000))
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond {0:.0%} of the baseline.".format(args.threshold))
+
+
+if __name__ == '__main__':
+    main()
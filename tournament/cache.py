@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#
+# cache.py -- read-through standings cache for tournament.py
+#
+# Standings are cached per scope: a tournament id, or None for the standings
+# across all matches.  Every write bumps the version of the scopes it
+# changes once it has committed, so a cached result is only served while
+# its scope's version is unchanged.  StandingsListener carries those bumps
+# between processes over PostgreSQL LISTEN/NOTIFY.
+#
+import collections
+import os
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+# Marks a change to every scope, e.g. after deleting all matches.
+ALL_SCOPES = '*'
+
+# Channel carrying invalidations between processes.
+NOTIFY_CHANNEL = 'standings_cache'
+
+
+class StandingsCache(object):
+    """ A bounded LRU cache of standings with a time-to-live.
+
+    Args:
+      maxsize: entries kept before the least recently used is evicted.
+      ttl: seconds an entry may be served for, however current it is.
+      clock: callable returning the time in seconds.
+    """
+    def __init__(self, maxsize=1024, ttl=5.0, clock=time.time):
+        if maxsize < 1:
+            raise ValueError("Cache needs maxsize >= 1.")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()   # (scope, key) -> (version, expires, value)
+        self._versions = {}                         # scope -> version
+        self._epoch = 0                             # bumped for ALL_SCOPES
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def _version(self, scope):
+        return (self._epoch, self._versions.get(scope, 0))
+
+    def version(self, scope):
+        """ The current version of a scope; pass it to put(). """
+        with self._lock:
+            return self._version(scope)
+
+    def get(self, scope, key):
+        """ The cached value for key in scope, or None if missing or stale. """
+        with self._lock:
+            entry = self._entries.pop((scope, key), None)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            version, expires, value = entry
+            if version != self._version(scope):
+                self._stats['misses'] += 1
+                return None
+            if self._clock() >= expires:
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries[(scope, key)] = entry
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, scope, key, version, value):
+        """ Cache a value read while scope was at `version`.
+
+        The value is dropped if the scope changed since, because the read
+        may have raced with the write.
+        """
+        with self._lock:
+            if version != self._version(scope):
+                return
+            self._entries.pop((scope, key), None)
+            self._entries[(scope, key)] = (version, self._clock() + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, scopes):
+        """ Bump the version of each scope, or of every scope for ALL_SCOPES. """
+        with self._lock:
+            for scope in scopes:
+                if scope == ALL_SCOPES:
+                    self._epoch += 1
+                    self._versions.clear()
+                    self._entries.clear()
+                else:
+                    self._versions[scope] = self._versions.get(scope, 0) + 1
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        """ Snapshot of cache counters.
+
+        Returns:
+          A dict with hits, misses, evictions, expirations and invalidations
+          counters plus the current size.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+
+def encode_scopes(scopes):
+    """ Scopes as text, for a notification payload. """
+    return ','.join(ALL_SCOPES if scope == ALL_SCOPES else
+                    '' if scope is None else str(scope) for scope in scopes)
+
+
+def decode_scopes(payload):
+    """ The scopes encode_scopes() turned into `payload`. """
+    return [ALL_SCOPES if scope == ALL_SCOPES else
+            None if scope == '' else int(scope) for scope in payload.split(',')]
+
+
+class StandingsListener(object):
+    """ Keeps a StandingsCache consistent with writes in other processes.
+
+    A background thread LISTENs on NOTIFY_CHANNEL and invalidates the scopes
+    other processes announce with publish().  If the listening connection
+    drops, everything is invalidated, since notifications may have been
+    missed, and the thread reconnects.
+
+    Args:
+      cache: the StandingsCache to invalidate.
+      dsn: libpq connection string of the database.
+      pool: ConnectionPool that publish() sends notifications through.
+      poll_interval: seconds between checks for a stop request.
+    """
+    def __init__(self, cache, dsn, pool, poll_interval=1.0,
+                 connect_func=psycopg2.connect):
+        self.cache = cache
+        self.dsn = dsn
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self._connect_func = connect_func
+        self._sender = "{0}:{1}".format(os.getpid(), id(self))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='standings-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, scopes):
+        """ Announce committed changes to scopes to the other processes. """
+        with self.pool.dedicated() as conn:
+            c = conn.cursor()
+            c.execute("SELECT pg_notify(%s, %s);",
+                      (NOTIFY_CHANNEL, "{0}|{1}".format(self._sender, encode_scopes(scopes))))
+            conn.commit()
+            c.close()
+
+    def _listen(self):
+        conn = self._connect_func(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute("LISTEN {0};".format(NOTIFY_CHANNEL))
+        return conn
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = self._listen()
+                    # Writes made while we weren't listening went unannounced.
+                    self.cache.invalidate([ALL_SCOPES])
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    sender, _, payload = notify.payload.partition('|')
+                    if sender != self._sender:
+                        self.cache.invalidate(decode_scopes(payload))
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, select.error):
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+                conn = None
+                self.cache.invalidate([ALL_SCOPES])
+                self._stop.wait(self.poll_interval)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        """ Stop listening and wait for the thread to finish. """
+        self._stop.set()
+        self._thread.join()
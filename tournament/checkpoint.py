@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#
+# checkpoint.py -- compact snapshots for resuming a running tournament
+#
+# A checkpoint holds what a coordinator needs to carry on with a round: the
+# standings (with their tie-breaks), who has played whom, and the round's
+# pairings.  It is stored as zlib-compressed little-endian arrays, about a
+# dozen bytes per player and four per game played, and the opponent graph
+# stays in those arrays once read (see GraphPairs), so resuming an event of
+# 100,000 players takes milliseconds where reading the match history back
+# takes seconds.
+#
+# Checkpoints are written with their round by createRound(...,
+# checkpoint=True) or later by checkpointRound(), and resumeTournament()
+# reads the latest one and applies the matches reported since.
+#
+import bisect
+import json
+import struct
+import zlib
+from array import array
+
+import pairing
+from archive import from_bytes, to_bytes
+
+
+MAGIC = b'TRNCKPT1'
+
+# Arrays of a checkpoint and their typecodes.  Standings columns are in
+# ranking order; the opponent graph lists the opponents of each player in
+# graph_ids (ascending) at opponents[graph_offsets[i]:graph_offsets[i + 1]].
+# 0 stands for NULL.
+COLUMNS = (
+    ('ids', 'i'), ('wins', 'i'), ('losses', 'i'), ('draws', 'i'),
+    ('buchholz', 'd'), ('sonneborn_berger', 'd'), ('opp_match_win_pct', 'd'),
+    ('name_ends', 'i'),
+    ('graph_ids', 'i'), ('graph_offsets', 'i'), ('opponents', 'i'), ('byes', 'i'),
+    ('pairing_ids', 'i'), ('pairing_one', 'i'), ('pairing_two', 'i'),
+    ('pairing_matches', 'i'),
+)
+
+
+class GraphPairs(object):
+    """ The pair_key()s of a checkpoint's opponent graph, as the `pairs` of a
+    pairing.History: membership is looked up in the arrays instead of a set
+    built from every game. """
+    __slots__ = ('_ids', '_offsets', '_opponents', '_added')
+
+    def __init__(self, ids, offsets, opponents, added=()):
+        self._ids = ids
+        self._offsets = offsets
+        self._opponents = opponents
+        self._added = set(added)
+
+    def __contains__(self, key):
+        if key in self._added:
+            return True
+        one, two = key >> 32, key & 0xFFFFFFFF
+        i = bisect.bisect_left(self._ids, one)
+        if i == len(self._ids) or self._ids[i] != one:
+            return False
+        end = self._offsets[i + 1]
+        j = bisect.bisect_left(self._opponents, two, self._offsets[i], end)
+        return j < end and self._opponents[j] == two
+
+    def add(self, key):
+        self._added.add(key)
+
+
+class Checkpoint(object):
+    """ A tournament's state as of a round.
+
+    Build one with from_rows() or decode(), and bring it up to date with
+    apply().  Tie-breaks are the ones stored when it was written; reported
+    results don't change them until updateTiebreaks() and a new checkpoint.
+
+    Attributes:
+      tournament_id: the tournament, or None for rounds outside tournaments
+        (whose standings and history span all matches, as swissPairings'
+        do).
+      round_id, round_number: the round it was written for.
+      last_match_id: the highest match id it includes.
+    """
+
+    def __init__(self, tournament_id, round_id, round_number, last_match_id, columns, names):
+        self.tournament_id = tournament_id
+        self.round_id = round_id
+        self.round_number = round_number
+        self.last_match_id = last_match_id
+        self._columns = columns
+        self._names = names
+        self._slots = None              # player id -> index, built on first apply()
+        self._pairing_slots = None
+        self._added_pairs = set()
+        self._added_byes = set()
+        self._reranked = False
+
+    @classmethod
+    def from_rows(cls, tournament_id, round_id, round_number, last_match_id,
+                  standings, history, pairings):
+        """ A checkpoint of rows as the API functions return them.
+
+        Args:
+          standings: playerStandings(..., tiebreaks=True) rows.
+          history: getMatchHistory rows.
+          pairings: getPairings rows of the round.
+        """
+        columns = dict((name, array(typecode)) for name, typecode in COLUMNS)
+        names = []
+        end = 0
+        columns['name_ends'].append(0)
+        for row in standings:
+            for name, value in zip(('ids', None, 'wins', 'losses', 'draws', None,
+                                    'buchholz', 'sonneborn_berger', 'opp_match_win_pct'),
+                                   row):
+                if name is not None:
+                    columns[name].append(value)
+            name = (row[1] or u'').encode('utf-8')
+            names.append(name)
+            end += len(name)
+            columns['name_ends'].append(end)
+        opponents = {}
+        for one, two in history:
+            if two is None:
+                columns['byes'].append(one)
+            else:
+                opponents.setdefault(one, []).append(two)
+                opponents.setdefault(two, []).append(one)
+        columns['graph_offsets'].append(0)
+        for player_id in sorted(opponents):
+            columns['graph_ids'].append(player_id)
+            columns['opponents'].extend(sorted(opponents[player_id]))
+            columns['graph_offsets'].append(len(columns['opponents']))
+        for pairing_id, one, two, match_id in pairings:
+            columns['pairing_ids'].append(pairing_id)
+            columns['pairing_one'].append(one)
+            columns['pairing_two'].append(two or 0)
+            columns['pairing_matches'].append(match_id or 0)
+        return cls(tournament_id, round_id, round_number, last_match_id, columns,
+                   b''.join(names))
+
+    def encode(self, level=6):
+        """ The checkpoint as bytes, for decode(). """
+        lengths = [[name, len(self._columns[name])] for name, _ in COLUMNS]
+        header = json.dumps({
+            'tournament_id': self.tournament_id,
+            'round_id': self.round_id,
+            'round_number': self.round_number,
+            'last_match_id': self.last_match_id,
+            'columns': lengths,
+        }).encode('utf-8')
+        parts = [struct.pack('<I', len(header)), header]
+        parts.extend(to_bytes(self._columns[name]) for name, _ in COLUMNS)
+        parts.append(self._names)
+        return MAGIC + zlib.compress(b''.join(parts), level)
+
+    def apply(self, match_id, one, two, draw, pairing_id=None):
+        """ Add a match reported after the checkpoint was written.
+
+        Args:
+          one, two: the winner and loser, or the drawing players; two is
+            None (or 0) for a bye.
+
+        Returns:
+          False, changing nothing, if a player isn't in the standings (e.g.
+          registered since): the checkpoint can't be brought up to date.
+        """
+        columns = self._columns
+        if self._slots is None:
+            self._slots = dict((player_id, i) for i, player_id in enumerate(columns['ids']))
+            self._pairing_slots = dict(
+                (pairing_id, i) for i, pairing_id in enumerate(columns['pairing_ids']))
+        one_slot = self._slots.get(one)
+        two_slot = self._slots.get(two) if two else None
+        if one_slot is None or (two and two_slot is None):
+            return False
+        if draw:
+            columns['draws'][one_slot] += 1
+            columns['draws'][two_slot] += 1
+        else:
+            columns['wins'][one_slot] += 1
+            if two:
+                columns['losses'][two_slot] += 1
+        if two:
+            self._added_pairs.add(pairing.pair_key(one, two))
+        else:
+            self._added_byes.add(one)
+        slot = self._pairing_slots.get(pairing_id)
+        if slot is not None:
+            columns['pairing_matches'][slot] = match_id
+        self.last_match_id = max(self.last_match_id, match_id)
+        self._reranked = True
+        return True
+
+    def standings(self, tiebreaks=False):
+        """ The standings, as playerStandings returns them. """
+        c = self._columns
+        ids, wins, losses, draws = c['ids'], c['wins'], c['losses'], c['draws']
+        buchholz, sonneborn_berger, pct = (c['buchholz'], c['sonneborn_berger'],
+                                           c['opp_match_win_pct'])
+        ends = c['name_ends']
+        slots = range(len(ids))
+        if self._reranked:
+            slots = sorted(slots, key=lambda i: (-wins[i], -draws[i], -buchholz[i],
+                                                 -sonneborn_berger[i], -pct[i], ids[i]))
+        rows = []
+        for i in slots:
+            row = (ids[i], self._names[ends[i]:ends[i + 1]].decode('utf-8'),
+                   wins[i], losses[i], draws[i], wins[i] + losses[i] + draws[i])
+            if tiebreaks:
+                row += (buchholz[i], sonneborn_berger[i], pct[i])
+            rows.append(row)
+        return rows
+
+    def history(self):
+        """ A pairing.History of every game up to now, for pairing the next
+        round without rematches. """
+        c = self._columns
+        history = pairing.History()
+        history.pairs = GraphPairs(c['graph_ids'], c['graph_offsets'], c['opponents'],
+                                   self._added_pairs)
+        history.byes = set(c['byes']) | self._added_byes
+        return history
+
+    def swiss_pairings(self):
+        """ The next round's pairings, as swissPairings would return them. """
+        standings = self.standings()
+        names = dict((row[0], row[1]) for row in standings)
+        scores = dict((row[0], pairing.score(row[2], row[4])) for row in standings)
+        pairs, bye = pairing.pair_players([row[0] for row in standings], scores,
+                                          self.history())
+        rows = [(one, names[one], two, names[two]) for one, two in pairs]
+        if bye is not None:
+            rows.append((bye, names[bye], None, None))
+        return rows
+
+    @property
+    def player_count(self):
+        return len(self._columns['ids'])
+
+    @property
+    def pairings(self):
+        """ The round's pairings, as getPairings returns them. """
+        c = self._columns
+        return [(pairing_id, one, two or None, match_id or None)
+                for pairing_id, one, two, match_id in zip(
+                    c['pairing_ids'], c['pairing_one'], c['pairing_two'],
+                    c['pairing_matches'])]
+
+
+def decode(data):
+    """ The Checkpoint encoded in `data`.
+
+    Raises:
+      ValueError: the data isn't a checkpoint.
+    """
+    data = bytes(data)
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a tournament checkpoint.")
+    raw = zlib.decompress(data[len(MAGIC):])
+    [length] = struct.unpack('<I', raw[:4])
+    header = json.loads(raw[4:4 + length].decode('utf-8'))
+    offset = 4 + length
+    columns = {}
+    typecodes = dict(COLUMNS)
+    for name, count in header['columns']:
+        size = array(typecodes[name]).itemsize * count
+        columns[name] = from_bytes(typecodes[name], raw[offset:offset + size])
+        offset += size
+    return Checkpoint(header['tournament_id'], header['round_id'], header['round_number'],
+                      header['last_match_id'], columns, raw[offset:])
+
+
+def catch_up(checkpoint, player_count, round_number, matches):
+    """ Bring a stored checkpoint up to date, if it can be.
+
+    Args:
+      checkpoint: the decoded checkpoint.
+      player_count: players in its scope now.
+      round_number: the scope's latest round now.
+      matches: (match_id, one, two, draw, pairing_id) of the scope's matches
+        reported since, as Checkpoint.apply takes them, in id order.
+
+    Returns:
+      False if players registered or rounds created since it was written
+      mean the standings must be read afresh; `checkpoint` is then left
+      half updated.
+    """
+    if checkpoint.player_count != player_count or checkpoint.round_number != round_number:
+        return False
+    for match in matches:
+        if not checkpoint.apply(*match):
+            return False
+    return True
@@ -8,9 +8,10 @@ import random
 import sys
 import time
 
-from tournament import deleteMatches, deletePlayers, deleteTournaments
+from tournament import resetDatabase
 from tournament import playerStandings, registerTournament, registerPlayer
 from tournament import swissPairings, reportMatch, connect, DB_NAME
+from tournament import updateTiebreaks
 
 
 def calc_tournament_matches(player_num):
@@ -30,11 +31,9 @@ def calc_standings_header_spacing(standings):
 def main():
     print("\n################  Welcome to the Tournament Demo!  ################\n")
 
-    # Start with a fresh db (order is important here)
+    # Start with a fresh db
     db = connect(DB_NAME)
-    deleteMatches(db)
-    deletePlayers(db)
-    deleteTournaments(db)
+    resetDatabase(db)
     
     # Get your tournament set up.
 
@@ -127,6 +126,7 @@ def main():
                     elif result is "draw":
                         reportMatch(db, match[-2], match[0], draw=True)
                         print("Draw!")
+                updateTiebreaks(db)
             else:
                 sys.exit(-1)
     finally:
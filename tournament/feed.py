@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+#
+# feed.py -- live standings pushed over PostgreSQL LISTEN/NOTIFY
+#
+# Every result is announced once, when it commits, on FEED_CHANNEL by the
+# matches trigger (see feed_result() in tournament.sql), with its players'
+# new records.  Writes that change standings in bulk (registrations,
+# deletes, tie-break updates, reportMatches) announce a resync of the
+# scopes they touch instead, and createRound announces the new round.
+#
+# A process LISTENs on one connection (FeedListener) and hands every event
+# to its subscribers through a FeedHub; each Subscription applies them to
+# its own LiveStandings, so viewers cost nothing on the server.  Events
+# carry records rather than increments, which makes applying one twice
+# harmless, and a subscription whose events were dropped (a full queue, a
+# lost connection) reads the standings afresh.  Subscriptions only start
+# once the listener is LISTENing, so no result committed after one starts
+# is missed.
+#
+import collections
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from cache import ALL_SCOPES, decode_scopes, encode_scopes
+
+
+# Channel carrying feed events.
+FEED_CHANNEL = 'standings_feed'
+
+# A result: the round it counts for (the pairing's, else the tournament's
+# latest, or None), and (player_id, wins, losses, draws) of its players in
+# the tournament, if any, and across all matches.
+Result = collections.namedtuple('Result', 'tournament_id round players totals')
+
+# A new round of a tournament (None for rounds outside tournaments).
+Round = collections.namedtuple('Round', 'tournament_id number')
+
+# Standings of these scopes changed in ways only a fresh read shows.
+Resync = collections.namedtuple('Resync', 'scopes')
+
+
+def _optional(value):
+    return None if value == '' else int(value)
+
+
+def _records(text):
+    return tuple(tuple(int(field) for field in record.split(':'))
+                 for record in text.split(';') if record)
+
+
+def encode(event):
+    """ The NOTIFY payload of an event; Result payloads are built by
+    feed_result() in tournament.sql. """
+    if isinstance(event, Result):
+        return 'M|{0}|{1}|{2}|{3}'.format(
+            '' if event.tournament_id is None else event.tournament_id,
+            '' if event.round is None else event.round,
+            ';'.join(':'.join(str(field) for field in record) for record in event.players),
+            ';'.join(':'.join(str(field) for field in record) for record in event.totals))
+    if isinstance(event, Round):
+        return 'R|{0}|{1}'.format(
+            '' if event.tournament_id is None else event.tournament_id, event.number)
+    return 'S|' + encode_scopes(event.scopes)
+
+
+def parse(payload):
+    """ The event a NOTIFY payload carries.
+
+    Raises:
+      ValueError: the payload isn't a feed event.
+    """
+    kind, _, rest = payload.partition('|')
+    if kind == 'M':
+        tournament_id, round_number, players, totals = rest.split('|')
+        return Result(_optional(tournament_id), _optional(round_number),
+                      _records(players), _records(totals))
+    if kind == 'R':
+        tournament_id, number = rest.split('|')
+        return Round(_optional(tournament_id), int(number))
+    if kind == 'S':
+        return Resync(decode_scopes(rest))
+    raise ValueError("Not a feed event: {0!r}.".format(payload))
+
+
+class LiveStandings(object):
+    """ A local copy of one scope's standings, kept current by events.
+
+    Rows are kept with their tie-breaks, which only updateTiebreaks changes
+    (and announces with a resync), so the copy ranks players exactly as
+    playerStandings does.  A result for a player the copy doesn't know, or
+    a resync of its scope, sets `stale`: the copy must be reloaded.
+
+    Args:
+      tournament_id: the tournament followed, or None for the standings
+        across all matches.
+    """
+    def __init__(self, tournament_id=None):
+        self.tournament_id = tournament_id
+        self.round = None
+        self.stale = True
+        self._rows = {}         # player id -> [id, name, wins, losses, draws, matches, ...]
+
+    def load(self, rows, round_number=None):
+        """ Replace the copy with playerStandings(..., tiebreaks=True) rows. """
+        self._rows = dict((row[0], list(row)) for row in rows)
+        self.round = round_number
+        self.stale = False
+
+    def apply(self, event):
+        """ Apply an event; True if it concerned this scope. """
+        if isinstance(event, Resync):
+            if ALL_SCOPES in event.scopes or self.tournament_id in event.scopes:
+                self.stale = True
+                return True
+            return False
+        if event.tournament_id != self.tournament_id and not (
+                self.tournament_id is None and isinstance(event, Result)):
+            return False
+        if event.tournament_id == self.tournament_id:
+            number = event.number if isinstance(event, Round) else event.round
+            if number is not None and number > (self.round or 0):
+                self.round = number
+        if isinstance(event, Round):
+            return True
+        records = event.totals if self.tournament_id is None else event.players
+        for player_id, wins, losses, draws in records:
+            row = self._rows.get(player_id)
+            if row is None:
+                self.stale = True
+            # Matches only go up between resyncs, so a record with fewer is
+            # older than the one already applied.
+            elif wins + losses + draws >= row[5]:
+                row[2:6] = [wins, losses, draws, wins + losses + draws]
+        return True
+
+    def standings(self, tiebreaks=False):
+        """ The rows in playerStandings order, as playerStandings returns them. """
+        rows = sorted(self._rows.values(), key=lambda row: (
+            -row[2], -row[4], -row[6], -row[7], -row[8], row[0]))
+        return [tuple(row) if tiebreaks else tuple(row[:6]) for row in rows]
+
+
+class FeedHub(object):
+    """ Hands every event to the subscriptions of one process. """
+
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # Shared by copies of the backend holding it (see MemoryBackend).
+        return self
+
+    def add(self, subscription):
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+
+    def remove(self, subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def publish(self, event):
+        for subscription in self._subscriptions:
+            subscription.put(event)
+
+
+class Subscription(object):
+    """ An iterator over a scope's standings as they change.
+
+    Each item is (event, standings): the event just applied, and the
+    standings after it, in playerStandings order.  After a resync the event
+    is a Resync of the scope.  Events for other scopes are skipped.
+
+    Events wait in a queue of `max_queue`; if a slow consumer lets it fill
+    up, later events are dropped and the standings read afresh instead.
+
+    Args:
+      hub: the FeedHub publishing events.
+      tournament_id: the tournament followed, or None for all matches.
+      snapshot: callable taking tournament_id and returning the current
+        (playerStandings(..., tiebreaks=True) rows, latest round number).
+      max_queue: events held for the consumer.
+      tiebreaks: yield the standings with their tie-break columns.
+    """
+    def __init__(self, hub, tournament_id, snapshot, max_queue=1000, tiebreaks=False):
+        self.standings = LiveStandings(tournament_id)
+        self.tiebreaks = tiebreaks
+        self.resyncs = 0
+        self._hub = hub
+        self._snapshot = snapshot
+        self._queue = queue.Queue(max_queue)
+        self._overflowed = False
+        hub.add(self)
+        self._resync()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    next = __next__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, event):
+        """ Queue an event; called by the hub. """
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflowed = True
+
+    def _resync(self, discard=False):
+        # Events queued after the snapshot may be covered by it too, which
+        # is harmless, and are still handed out.  After an overflow the
+        # queued events are older than the dropped ones, so they go.
+        self._overflowed = False
+        while discard:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        rows, round_number = self._snapshot(self.standings.tournament_id)
+        self.standings.load(rows, round_number)
+        self.resyncs += 1
+
+    def get(self, timeout=None):
+        """ The next (event, standings) pair.
+
+        Args:
+          timeout: seconds to wait for an event, or None to wait for ever.
+
+        Returns:
+          None if nothing changed within `timeout`.
+        """
+        while True:
+            if self._overflowed:
+                event = Resync([self.standings.tournament_id])
+            else:
+                try:
+                    event = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    return None
+                if not self.standings.apply(event):
+                    continue
+            if self._overflowed or self.standings.stale:
+                self._resync(discard=self._overflowed)
+            return event, self.standings.standings(self.tiebreaks)
+
+    def close(self):
+        """ Stop receiving events. """
+        self._hub.remove(self)
+
+
+class FeedListener(object):
+    """ Publishes the events on FEED_CHANNEL to a FeedHub.
+
+    A background thread LISTENs on its own connection.  Every
+    (re)connection publishes a resync of every scope, since events may have
+    been missed while it wasn't listening; wait() blocks until it is.
+
+    Args:
+      hub: the FeedHub to publish to.
+      dsn: libpq connection string of the database.
+      poll_interval: seconds between checks for a stop request.
+    """
+    def __init__(self, hub, dsn, poll_interval=1.0, connect_func=psycopg2.connect):
+        self.hub = hub
+        self.dsn = dsn
+        self.poll_interval = poll_interval
+        self._connect_func = connect_func
+        self._stop = threading.Event()
+        self._listening = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='standings-feed')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _listen(self):
+        conn = self._connect_func(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute("LISTEN {0};".format(FEED_CHANNEL))
+        return conn
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = self._listen()
+                    self.hub.publish(Resync([ALL_SCOPES]))
+                    self._listening.set()
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    try:
+                        event = parse(conn.notifies.pop(0).payload)
+                    except ValueError:
+                        continue        # not a feed event; someone else's NOTIFY
+                    self.hub.publish(event)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, select.error):
+                self._listening.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+                conn = None
+                self._stop.wait(self.poll_interval)
+        if conn is not None:
+            conn.close()
+
+    def wait(self, timeout=None):
+        """ Block until the listener is LISTENing.
+
+        Returns:
+          False if it still isn't after `timeout` seconds.
+        """
+        return self._listening.wait(timeout)
+
+    def close(self):
+        """ Stop listening and wait for the thread to finish. """
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+#
+# instrument.py -- timing and profiling of tournament.py database calls
+#
+# tournament.transaction_decorator reports every call to an Instruments
+# object while instrumentation is enabled (see
+# tournament.configure_instrumentation): the call's duration, the time spent
+# waiting for a pooled connection, each SQL statement's duration and row
+# count, and whether the call committed or rolled back.  Statements slower
+# than a threshold are kept with their EXPLAIN plan.
+#
+import collections
+import logging
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+# Histogram buckets double from HISTOGRAM_MIN seconds, HISTOGRAM_BUCKETS times.
+HISTOGRAM_MIN = 1e-6
+HISTOGRAM_BUCKETS = 28
+
+# Slow statements kept for slowQueries().
+SLOW_QUERY_LOG_SIZE = 100
+
+# Statements that EXPLAIN accepts without running them.
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'EXECUTE')
+
+# Counter bumped for each call outcome.
+_OUTCOME_COUNTERS = {
+    'commit': 'commits',
+    'rollback': 'rollbacks',
+    'joined': 'joined',
+    'error': 'errors',
+}
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """ Latency histogram with exponentially growing buckets.
+
+    Constant memory and O(1) per sample; percentiles are accurate to a
+    factor of two, which is enough to see where time goes.
+    """
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (HISTOGRAM_BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        bound = HISTOGRAM_MIN
+        index = 0
+        while seconds > bound and index < HISTOGRAM_BUCKETS:
+            bound *= 2
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """ Upper bound of the bucket holding the given fraction of samples. """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(fraction * self.count)))
+        seen = 0
+        bound = HISTOGRAM_MIN
+        for count in self.buckets:
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+            bound *= 2
+        return self.max
+
+    def summary(self):
+        """ A dict of count, total, mean, min, p50, p99 and max. """
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min or 0.0,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'max': self.max or 0.0,
+        }
+
+
+class Exporter(object):
+    """ Receives instrumentation events as they happen.
+
+    Subclass and override the events of interest; they are called on the
+    thread making the database call, so they should be quick.
+    """
+    def call(self, name, seconds, acquire_seconds, statements, rows, outcome):
+        """ A tournament.py call finished.
+
+        outcome is 'commit' or 'rollback' for a call that ended its own
+        transaction, 'joined' for one left for an enclosing transaction to
+        commit, and 'error' for one that failed inside such a transaction.
+        """
+
+    def statement(self, name, query, seconds, rows):
+        """ A SQL statement ran as part of call `name`. """
+
+    def slow_query(self, record):
+        """ A statement exceeded the slow query threshold; see slowQueries(). """
+
+
+class LoggingExporter(Exporter):
+    """ Logs slow queries, with their plans, to the `instrument` logger. """
+    def __init__(self, logger=log, level=logging.WARNING):
+        self.logger = logger
+        self.level = level
+
+    def slow_query(self, record):
+        self.logger.log(self.level, "Slow query in %s (%.1f ms): %s\n%s",
+                        record['call'], record['seconds'] * 1000, record['query'],
+                        record['plan'] or '')
+
+
+class Instruments(object):
+    """ Aggregates call and statement timings in process.
+
+    Args:
+      slow_query_threshold: seconds above which a statement is logged as
+        slow (None disables slow query logging).
+      explain: capture the EXPLAIN plan of slow statements.
+      exporters: Exporter instances receiving every event.
+    """
+    def __init__(self, slow_query_threshold=None, explain=True, exporters=()):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain = explain
+        self.exporters = list(exporters)
+        self._lock = threading.Lock()
+        self._calls = collections.defaultdict(Histogram)
+        self._statements = collections.defaultdict(Histogram)
+        self._acquire = Histogram()
+        self._rows = collections.defaultdict(int)
+        self._counters = {'commits': 0, 'rollbacks': 0, 'joined': 0, 'errors': 0}
+        self._slow = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def call(self, name):
+        """ Start timing a call; returns its Call. """
+        return Call(self, name)
+
+    def _record_statement(self, call, cursor, query, params, seconds, rows):
+        key = query if isinstance(query, str) else repr(query)
+        with self._lock:
+            self._statements[key].add(seconds)
+        for exporter in self.exporters:
+            exporter.statement(call.name, key, seconds, rows)
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+            record = {
+                'call': call.name,
+                'query': key,
+                'params': params,
+                'seconds': seconds,
+                'rows': rows,
+                'time': time.time(),
+                'plan': self._explain(cursor, query, params) if self.explain else None,
+            }
+            with self._lock:
+                self._slow.append(record)
+            for exporter in self.exporters:
+                exporter.slow_query(record)
+
+    @staticmethod
+    def _explain(cursor, query, params):
+        """ The plan of a statement, or None if it can't be explained. """
+        if not isinstance(query, str) or not query.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        conn = cursor.connection
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return None
+        # A savepoint keeps a failed EXPLAIN from aborting the caller's
+        # transaction.
+        c = conn.cursor()
+        try:
+            c.execute("SAVEPOINT instrument_explain;")
+            try:
+                c.execute("EXPLAIN " + query, params)
+                plan = "\n".join(row[0] for row in c.fetchall())
+            except psycopg2.Error:
+                c.execute("ROLLBACK TO SAVEPOINT instrument_explain;")
+                plan = None
+            c.execute("RELEASE SAVEPOINT instrument_explain;")
+            return plan
+        finally:
+            c.close()
+
+    def _record_call(self, call, seconds):
+        with self._lock:
+            self._calls[call.name].add(seconds)
+            if call.acquire_seconds is not None:
+                self._acquire.add(call.acquire_seconds)
+            self._rows[call.name] += call.rows
+            self._counters[_OUTCOME_COUNTERS[call.outcome]] += 1
+        for exporter in self.exporters:
+            exporter.call(call.name, seconds, call.acquire_seconds, call.statements,
+                          call.rows, call.outcome)
+
+    def stats(self):
+        """ Snapshot of everything recorded so far.
+
+        Returns:
+          A dict with:
+            calls: function name -> histogram summary plus total rows
+            statements: SQL text -> histogram summary
+            acquire: histogram summary of connection checkout times
+            commits, rollbacks, joined, errors: call outcome counters
+            slow_queries: number of slow statements recorded
+        """
+        with self._lock:
+            calls = {}
+            for name, histogram in self._calls.items():
+                calls[name] = histogram.summary()
+                calls[name]['rows'] = self._rows[name]
+            stats = {
+                'calls': calls,
+                'statements': dict((query, histogram.summary())
+                                   for query, histogram in self._statements.items()),
+                'acquire': self._acquire.summary(),
+                'slow_queries': len(self._slow),
+            }
+            stats.update(self._counters)
+        return stats
+
+    def slow_queries(self):
+        """ The most recent slow statements, oldest first.
+
+        Returns:
+          A list of dicts with call, query, params, seconds, rows, time and
+          plan (the EXPLAIN output, or None).
+        """
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        """ Forget everything recorded so far. """
+        with self._lock:
+            self._calls.clear()
+            self._statements.clear()
+            self._acquire = Histogram()
+            self._rows.clear()
+            for counter in self._counters:
+                self._counters[counter] = 0
+            self._slow.clear()
+
+
+class Call(object):
+    """ Timing of one tournament.py call, filled in by transaction_decorator. """
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+        self.acquire_seconds = None
+        self.statements = 0
+        self.rows = 0
+        self.outcome = 'joined'
+        self._start = time.time()
+
+    def cursor(self, cursor):
+        """ Wrap a cursor so its statements are timed against this call. """
+        return InstrumentedCursor(cursor, self)
+
+    def acquired(self, start):
+        """ A pooled connection was checked out; start is when we asked. """
+        self.acquire_seconds = time.time() - start
+
+    def finish(self, outcome):
+        """ Record the call; see Exporter.call for the outcomes. """
+        self.outcome = outcome
+        self.instruments._record_call(self, time.time() - self._start)
+
+    def _statement(self, cursor, query, params, seconds):
+        rows = max(cursor.rowcount, 0)
+        self.statements += 1
+        self.rows += rows
+        self.instruments._record_statement(self, cursor, query, params, seconds, rows)
+
+
+class InstrumentedCursor(object):
+    """ Cursor proxy timing each statement sent through it. """
+    def __init__(self, cursor, call):
+        self._cursor = cursor
+        self._call = call
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, method, query, params, *args, **kwargs):
+        start = time.time()
+        result = method(*args, **kwargs)
+        self._call._statement(self._cursor, query, params, time.time() - start)
+        return result
+
+    def execute(self, query, params=None):
+        return self._timed(self._cursor.execute, query, params, query, params)
+
+    def executemany(self, query, params_seq):
+        return self._timed(self._cursor.executemany, query, None, query, params_seq)
+
+    def copy_from(self, f, table, *args, **kwargs):
+        return self._timed(self._cursor.copy_from, "COPY {0} FROM STDIN".format(table),
+                           None, f, table, *args, **kwargs)
+
+    def copy_expert(self, sql, f, *args, **kwargs):
+        return self._timed(self._cursor.copy_expert, sql, None, sql, f, *args, **kwargs)
@@ -0,0 +1,727 @@
+#!/usr/bin/env python
+#
+# memory.py -- in-memory tournament backend, for simulations and tests
+#
+import copy
+import itertools
+from array import array
+from contextlib import contextmanager
+
+import archive
+import checkpoint
+import feed
+import ratings
+from backend import Backend
+from cache import ALL_SCOPES
+from tiebreaks import compute_tiebreaks
+
+
+class _Stats(object):
+    """ Win/loss/draw counters and tie-breaks for one scope, stored as
+    parallel arrays. """
+    __slots__ = ('slots', 'player_ids', 'wins', 'losses', 'draws',
+                 'buchholz', 'sonneborn_berger', 'opp_match_win_pct', 'ranks')
+
+    def __init__(self):
+        self.slots = {}                 # player id -> index into the arrays
+        self.player_ids = array('l')
+        self.wins = array('l')
+        self.losses = array('l')
+        self.draws = array('l')
+        self.buchholz = array('d')
+        self.sonneborn_berger = array('d')
+        self.opp_match_win_pct = array('d')
+        self.ranks = array('l')         # 0 stands for NULL
+
+    def add(self, player_id):
+        """ Index of a player's counters, adding a zeroed row if needed. """
+        slot = self.slots.get(player_id)
+        if slot is None:
+            slot = self.slots[player_id] = len(self.player_ids)
+            self.player_ids.append(player_id)
+            self.wins.append(0)
+            self.losses.append(0)
+            self.draws.append(0)
+            self.buchholz.append(0.0)
+            self.sonneborn_berger.append(0.0)
+            self.opp_match_win_pct.append(0.0)
+            self.ranks.append(0)
+        return slot
+
+    def bump(self, player_id, wins, losses, draws):
+        slot = self.add(player_id)
+        self.wins[slot] += wins
+        self.losses[slot] += losses
+        self.draws[slot] += draws
+
+    def rows(self):
+        """ (player_id, wins, losses, draws, matches) for every player. """
+        wins, losses, draws = self.wins, self.losses, self.draws
+        return [(player_id, wins[i], losses[i], draws[i],
+                 wins[i] + losses[i] + draws[i])
+                for i, player_id in enumerate(self.player_ids)]
+
+
+class MemoryBackend(Backend):
+    """ Non-durable Backend keeping everything in Python arrays.
+
+    Mirrors the PostgreSQL schema closely enough to be a drop-in
+    replacement: ids are assigned like serial columns (never reused after a
+    delete), foreign keys are enforced with ValueError, and standings come
+    back in exactly the order the total_matches view produces.
+    """
+
+    def __init__(self):
+        self._next_player_id = 1
+        self._next_tournament_id = 1
+        self._next_match_id = 1
+        self._next_round_id = 1
+        self._next_pairing_id = 1
+
+        # players, as parallel arrays indexed by slot
+        self._player_ids = array('l')
+        self._player_names = []
+        self._player_ratings = array('d')
+        self._player_slots = {}
+
+        self._tournament_ids = array('l')
+        self._rosters = {}              # tournament id -> array of player ids
+
+        # matches, as parallel arrays; 0 stands for NULL
+        self._match_ids = array('l')
+        self._match_one = array('l')    # winner, or first drawing player
+        self._match_two = array('l')    # loser, or second drawing player
+        self._match_draw = array('b')
+        self._match_tournaments = array('l')
+        self._match_pairings = array('l')
+
+        # rounds and their pairings; 0 stands for NULL
+        self._round_ids = array('l')
+        self._round_tournaments = array('l')
+        self._round_numbers = array('l')
+        self._pairing_ids = array('l')
+        self._pairing_rounds = array('l')
+        self._pairing_one = array('l')
+        self._pairing_two = array('l')
+        self._pairing_matches = {}      # pairing id -> match id
+
+        # scope 0 is every match; other keys are tournament ids
+        self._stats = {0: _Stats()}
+
+        # scope -> (round_id, round number, encoded checkpoint)
+        self._checkpoints = {}
+
+        # Feed subscriptions; kept by resetDatabase, which runs __init__.
+        if not hasattr(self, '_feed'):
+            self._feed = feed.FeedHub()
+
+    @contextmanager
+    def transaction(self):
+        """ Group calls so they are all undone if the block raises. """
+        state = copy.deepcopy(self.__dict__)
+        try:
+            yield self
+        except:
+            self.__dict__.clear()
+            self.__dict__.update(state)
+            # Subscribers have seen the events of the undone calls.
+            self._feed.publish(feed.Resync([ALL_SCOPES]))
+            raise
+
+    @contextmanager
+    def isolated(self):
+        """ Undo every call made in the block when it ends. """
+        state = copy.deepcopy(self.__dict__)
+        try:
+            yield self
+        finally:
+            self.__dict__.clear()
+            self.__dict__.update(state)
+            self._feed.publish(feed.Resync([ALL_SCOPES]))
+
+    def _check_player(self, player_id):
+        if player_id not in self._player_slots:
+            raise ValueError("Unknown player id {0}.".format(player_id))
+
+    def _check_tournament(self, tournament_id):
+        if tournament_id is not None and tournament_id not in self._rosters:
+            raise ValueError("Unknown tournament id {0}.".format(tournament_id))
+
+    def _apply_match(self, one, two, draw, tournament_id, sign):
+        scopes = [self._stats[0]]
+        if tournament_id:
+            scopes.append(self._stats.setdefault(tournament_id, _Stats()))
+        for stats in scopes:
+            if draw:
+                stats.bump(one, 0, 0, sign)
+                stats.bump(two, 0, 0, sign)
+            else:
+                stats.bump(one, sign, 0, 0)
+                if two:
+                    stats.bump(two, 0, sign, 0)
+
+    def _announce_result(self, winner, loser, tournament_id, round_number):
+        """ Publish a feed event for a match just applied, like feed_result(). """
+        players = sorted(set([winner, loser]) - set([0]))
+
+        def records(stats):
+            return tuple((player_id, stats.wins[slot], stats.losses[slot], stats.draws[slot])
+                         for player_id, slot in ((p, stats.slots[p]) for p in players))
+
+        self._feed.publish(feed.Result(
+            tournament_id, round_number,
+            records(self._stats[tournament_id]) if tournament_id else (),
+            records(self._stats[0])))
+
+    def _latest_round(self, tournament_id):
+        numbers = [number for t, number in zip(self._round_tournaments, self._round_numbers)
+                   if t == (tournament_id or 0)]
+        return max(numbers) if numbers else None
+
+    def _expected_stats(self):
+        """ Stats recomputed from the match history, like player_stats_expected. """
+        expected = {0: _Stats()}
+        for player_id in self._player_ids:
+            expected[0].add(player_id)
+        for tournament_id, roster in self._rosters.items():
+            stats = expected[tournament_id] = _Stats()
+            for player_id in roster:
+                stats.add(player_id)
+        saved, self._stats = self._stats, expected
+        try:
+            for i in range(len(self._match_ids)):
+                self._apply_match(self._match_one[i], self._match_two[i],
+                                  self._match_draw[i], self._match_tournaments[i], 1)
+        finally:
+            self._stats = saved
+        return expected
+
+    def resetDatabase(self):
+        self.__init__()
+        self._feed.publish(feed.Resync([ALL_SCOPES]))
+
+    def deleteMatches(self):
+        self._match_ids = array('l')
+        self._match_one = array('l')
+        self._match_two = array('l')
+        self._match_draw = array('b')
+        self._match_tournaments = array('l')
+        self._match_pairings = array('l')
+        self._pairing_matches = {}
+        self._checkpoints = {}
+        for tournament_id in list(self._stats):
+            self._zero_stats(tournament_id)
+        self._reset_ratings()
+        self._feed.publish(feed.Resync([ALL_SCOPES]))
+
+    def _zero_stats(self, tournament_id):
+        fresh = _Stats()
+        for player_id in self._stats[tournament_id].player_ids:
+            fresh.add(player_id)
+        self._stats[tournament_id] = fresh
+
+    def _reset_ratings(self):
+        self._player_ratings = array('d', [ratings.INITIAL_RATING] * len(self._player_ids))
+
+    def deletePlayers(self):
+        if len(self._match_ids):
+            raise ValueError("Players can't be deleted while matches reference them.")
+        for tournament_id in self._rosters:
+            self._rosters[tournament_id] = array('l')
+        self._keep_pairings([])
+        self._player_ids = array('l')
+        self._player_names = []
+        self._player_ratings = array('d')
+        self._player_slots = {}
+        self._stats = dict((tournament_id, _Stats()) for tournament_id in self._stats)
+        self._checkpoints = {}
+        self._feed.publish(feed.Resync([ALL_SCOPES]))
+
+    def deleteTournaments(self):
+        # Like the TRUNCATE path of tournament.deleteTournaments.
+        everything = 0 not in self._match_tournaments and 0 not in self._round_tournaments
+        for tournament_id in list(self._rosters):
+            self.deleteTournament(tournament_id)
+        if everything:
+            self._zero_stats(0)
+            self._reset_ratings()
+        self._feed.publish(feed.Resync([ALL_SCOPES]))
+
+    def deleteTournament(self, tournament_id):
+        if tournament_id not in self._rosters:
+            return
+        keep = [i for i, t in enumerate(self._match_tournaments) if t != tournament_id]
+        if len(keep) != len(self._match_ids):
+            for i in range(len(self._match_ids)):
+                if self._match_tournaments[i] == tournament_id:
+                    self._apply_match(self._match_one[i], self._match_two[i],
+                                      self._match_draw[i], 0, -1)
+            for i in range(len(self._match_ids)):
+                if self._match_tournaments[i] == tournament_id and self._match_pairings[i]:
+                    del self._pairing_matches[self._match_pairings[i]]
+            self._keep_rows(('_match_ids', '_match_one', '_match_two', '_match_draw',
+                             '_match_tournaments', '_match_pairings'), keep)
+        rounds = set(round_id for round_id, t in zip(self._round_ids, self._round_tournaments)
+                     if t == tournament_id)
+        if rounds:
+            self._keep_pairings([i for i, round_id in enumerate(self._pairing_rounds)
+                                 if round_id not in rounds])
+            self._keep_rows(('_round_ids', '_round_tournaments', '_round_numbers'),
+                            [i for i, round_id in enumerate(self._round_ids)
+                             if round_id not in rounds])
+        del self._rosters[tournament_id]
+        self._stats.pop(tournament_id, None)
+        # The totals checkpoint goes too, as in tournament.deleteTournament.
+        self._checkpoints.pop(tournament_id, None)
+        self._checkpoints.pop(0, None)
+        self._tournament_ids = array('l', [t for t in self._tournament_ids
+                                           if t != tournament_id])
+        self._feed.publish(feed.Resync([tournament_id, None]))
+
+    def _keep_rows(self, names, keep):
+        """ Keep only the rows at indexes `keep` of parallel arrays. """
+        for name in names:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[i] for i in keep]))
+
+    def _keep_pairings(self, keep):
+        self._keep_rows(('_pairing_ids', '_pairing_rounds', '_pairing_one',
+                         '_pairing_two'), keep)
+
+    def rebuildPlayerStats(self):
+        self._stats = self._expected_stats()
+        self._checkpoints = {}
+        for tournament_id in self._stats:
+            self.updateTiebreaks(tournament_id)
+        self._feed.publish(feed.Resync([ALL_SCOPES]))
+
+    def verifyPlayerStats(self):
+        expected = self._expected_stats()
+        mismatches = []
+        for source, theirs, ours in (('expected', expected, self._stats),
+                                     ('actual', self._stats, expected)):
+            for tournament_id, stats in theirs.items():
+                other = ours.get(tournament_id, _Stats())
+                other_rows = set(other.rows())
+                for row in stats.rows():
+                    if row not in other_rows:
+                        mismatches.append((source, tournament_id) + row)
+        return mismatches
+
+    def countPlayers(self):
+        return len(self._player_ids)
+
+    def getTournaments(self):
+        return [(tournament_id,) for tournament_id in self._tournament_ids]
+
+    def getTournamentRoster(self, tournament_id):
+        return [(tournament_id, player_id)
+                for player_id in self._rosters.get(tournament_id, ())]
+
+    def registerPlayer(self, name):
+        self.registerPlayers([name])
+
+    def registerPlayers(self, names, chunk_size=None, commit_chunks=False):
+        ids = []
+        stats = self._stats[0]
+        for name in names:
+            player_id = self._next_player_id
+            self._next_player_id += 1
+            self._player_slots[player_id] = len(self._player_ids)
+            self._player_ids.append(player_id)
+            self._player_names.append(name)
+            self._player_ratings.append(ratings.INITIAL_RATING)
+            stats.add(player_id)
+            ids.append(player_id)
+        self._feed.publish(feed.Resync([None]))
+        return ids
+
+    def registerTournament(self):
+        tournament_id = self._next_tournament_id
+        self._next_tournament_id += 1
+        self._tournament_ids.append(tournament_id)
+        self._rosters[tournament_id] = array('l')
+
+    def playerStandings(self, tournament_id=None, tiebreaks=False):
+        if tournament_id is None:
+            stats = self._stats[0]
+            player_ids = stats.player_ids
+        else:
+            stats = self._stats.get(tournament_id, _Stats())
+            player_ids = self._rosters.get(tournament_id, ())
+        slots = [stats.add(player_id) for player_id in player_ids]
+        wins, losses, draws = stats.wins, stats.losses, stats.draws
+        buchholz, sonneborn_berger = stats.buchholz, stats.sonneborn_berger
+        pct = stats.opp_match_win_pct
+        ids = stats.player_ids
+        slots.sort(key=lambda i: (-wins[i], -draws[i], -buchholz[i],
+                                  -sonneborn_berger[i], -pct[i], ids[i]))
+        names, name_slots = self._player_names, self._player_slots
+        rows = [(ids[i], names[name_slots[ids[i]]], wins[i], losses[i], draws[i],
+                 wins[i] + losses[i] + draws[i])
+                for i in slots]
+        if tiebreaks:
+            rows = [row + (buchholz[i], sonneborn_berger[i], pct[i])
+                    for row, i in zip(rows, slots)]
+        return rows
+
+    def iterStandings(self, tournament_id=None, fetch_size=None, tiebreaks=False,
+                      by_score=False):
+        from tournament import StandingsRow, TiebreakStandingsRow
+        row_type = TiebreakStandingsRow if tiebreaks else StandingsRow
+        rows = self.playerStandings(tournament_id, tiebreaks)
+        if by_score:
+            rows.sort(key=lambda row: -(2 * row[2] + row[4]))
+        for row in rows:
+            yield row_type._make(row)
+
+    def updateTiebreaks(self, tournament_id=None):
+        stats = self._stats.get(tournament_id or 0)
+        if stats is None:
+            return
+        ones, twos, flags = self._match_one, self._match_two, self._match_draw
+        if tournament_id:
+            games = [i for i, t in enumerate(self._match_tournaments) if t == tournament_id]
+            ones = [ones[i] for i in games]
+            twos = [twos[i] for i in games]
+            flags = [flags[i] for i in games]
+        matches = [w + l + d for w, l, d in zip(stats.wins, stats.losses, stats.draws)]
+        buchholz, sonneborn_berger, pct = compute_tiebreaks(
+            stats.player_ids, stats.wins, stats.draws, matches, ones, twos, flags)
+        stats.buchholz = array('d', buchholz)
+        stats.sonneborn_berger = array('d', sonneborn_berger)
+        stats.opp_match_win_pct = array('d', pct)
+        wins, draws = stats.wins, stats.draws
+        ids = stats.player_ids
+        ranking = sorted(range(len(ids)), key=lambda i: (
+            -(2 * wins[i] + draws[i]), -wins[i], -draws[i], -buchholz[i],
+            -sonneborn_berger[i], -pct[i], ids[i]))
+        stats.ranks = array('l', [0] * len(ids))
+        for rank, i in enumerate(ranking, 1):
+            stats.ranks[i] = rank
+        if (tournament_id or 0) in self._checkpoints:
+            round_id, number, _ = self._checkpoints[tournament_id or 0]
+            self._write_checkpoint(tournament_id, round_id, number)
+        self._feed.publish(feed.Resync([tournament_id or None]))
+
+    def leaderboard(self, tournament_id=None, limit=None, after=None):
+        from tournament import LEADERBOARD_PAGE_SIZE, TiebreakStandingsRow
+        if limit is None:
+            limit = LEADERBOARD_PAGE_SIZE
+
+        def key(row):
+            return (-(2 * row[2] + row[4]), -row[2], -row[4], -row[6], -row[7], -row[8],
+                    row[0])
+
+        rows = self.iterStandings(tournament_id, tiebreaks=True, by_score=True)
+        if after is not None:
+            start = key(after)
+            rows = (row for row in rows if key(row) > start)
+        return [TiebreakStandingsRow._make(row) for row in itertools.islice(rows, limit)]
+
+    def playerRank(self, player_id, tournament_id=None):
+        stats = self._stats.get(tournament_id or 0)
+        slot = stats.slots.get(player_id) if stats is not None else None
+        if slot is None:
+            return None
+        return stats.ranks[slot] or None
+
+    def playerRatings(self, tournament_id=None):
+        if tournament_id is None:
+            player_ids = self._player_ids
+        else:
+            player_ids = self._rosters.get(tournament_id, ())
+        slots, names, rated = self._player_slots, self._player_names, self._player_ratings
+        rows = [(player_id, names[slots[player_id]], rated[slots[player_id]])
+                for player_id in player_ids]
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return rows
+
+    def recomputeRatings(self, fetch_size=None):
+        replayed = ratings.replay(self._player_ids, self._match_one, self._match_two,
+                                  self._match_draw)
+        changed = sum(1 for new, old in zip(replayed, self._player_ratings) if new != old)
+        self._player_ratings = array('d', replayed)
+        return changed
+
+    def _rate_match(self, one, two, draw):
+        if not two or one == two:
+            return
+        a, b = self._player_slots[one], self._player_slots[two]
+        rated = self._player_ratings
+        rated[a], rated[b] = ratings.rate(rated[a], rated[b], draw)
+
+    def reportMatch(self, winner, loser, draw=False, tournament_id=None, pairing_id=None):
+        if pairing_id is None:
+            [match_id] = self._report([(winner, loser, draw)], tournament_id)
+            self._announce_result(winner, loser or 0, tournament_id,
+                                  self._latest_round(tournament_id))
+            return match_id
+        from tournament import ResultConflict
+        try:
+            slot = self._pairing_ids.index(pairing_id)
+        except ValueError:
+            raise ValueError("Unknown pairing id {0}.".format(pairing_id))
+        one, two = self._pairing_one[slot], self._pairing_two[slot] or None
+        if set([winner, loser]) != set([one, two]):
+            raise ValueError("Pairing {0} is between players {1} and {2}.".format(
+                pairing_id, one, two))
+        round_slot = self._round_ids.index(self._pairing_rounds[slot])
+        if tournament_id is None:
+            tournament_id = self._round_tournaments[round_slot] or None
+        match_id = self._pairing_matches.get(pairing_id)
+        if match_id is not None:
+            i = self._match_ids.index(match_id)
+            if bool(draw) != bool(self._match_draw[i]) or (
+                    not draw and self._match_one[i] != winner):
+                raise ResultConflict(
+                    "Pairing {0} already has a different result (match {1}).".format(
+                        pairing_id, match_id))
+            return match_id
+        [match_id] = self._report([(winner, loser, draw)], tournament_id)
+        self._match_pairings[-1] = pairing_id
+        self._pairing_matches[pairing_id] = match_id
+        self._announce_result(winner, loser or 0, tournament_id,
+                              self._round_numbers[round_slot])
+        return match_id
+
+    def reportMatches(self, results, tournament_id=None, chunk_size=None,
+                      commit_chunks=False):
+        ids = self._report(results, tournament_id)
+        self._feed.publish(feed.Resync([tournament_id, None]))
+        return ids
+
+    def _report(self, results, tournament_id):
+        """ Record results without announcing them on the feed. """
+        results = list(results)
+        self._check_tournament(tournament_id)
+        for result in results:
+            self._check_player(result[0])
+            if result[1] is not None or (len(result) > 2 and result[2]):
+                self._check_player(result[1])
+        ids = []
+        for result in results:
+            winner, loser = result[0], result[1]
+            draw = len(result) > 2 and bool(result[2])
+            match_id = self._next_match_id
+            self._next_match_id += 1
+            self._match_ids.append(match_id)
+            self._match_one.append(winner)
+            self._match_two.append(loser or 0)
+            self._match_draw.append(draw)
+            self._match_tournaments.append(tournament_id or 0)
+            self._match_pairings.append(0)
+            self._apply_match(winner, loser or 0, draw, tournament_id, 1)
+            self._rate_match(winner, loser or 0, draw)
+            ids.append(match_id)
+        return ids
+
+    def getMatchHistory(self, tournament_id=None):
+        ones, twos, tournaments = self._match_one, self._match_two, self._match_tournaments
+        return [(ones[i], twos[i] or None) for i in range(len(ones))
+                if tournament_id is None or tournaments[i] == tournament_id]
+
+    def getPairingData(self, tournament_ids):
+        return dict((tournament_id, (self.playerStandings(tournament_id),
+                                     self.getMatchHistory(tournament_id)))
+                    for tournament_id in tournament_ids if tournament_id in self._rosters)
+
+    def createRound(self, pairings, tournament_id=None, checkpoint=False):
+        from tournament import _paired_ids
+        pairings = [_paired_ids(row) for row in pairings]
+        self._check_tournament(tournament_id)
+        for one, two in pairings:
+            self._check_player(one)
+            if two is not None:
+                self._check_player(two)
+        round_id = self._next_round_id
+        self._next_round_id += 1
+        number = (self._latest_round(tournament_id) or 0) + 1
+        self._round_ids.append(round_id)
+        self._round_tournaments.append(tournament_id or 0)
+        self._round_numbers.append(number)
+        pairing_ids = []
+        for one, two in pairings:
+            pairing_id = self._next_pairing_id
+            self._next_pairing_id += 1
+            self._pairing_ids.append(pairing_id)
+            self._pairing_rounds.append(round_id)
+            self._pairing_one.append(one)
+            self._pairing_two.append(two or 0)
+            pairing_ids.append(pairing_id)
+        self._feed.publish(feed.Round(tournament_id, number))
+        if checkpoint:
+            self._write_checkpoint(tournament_id, round_id, number)
+        return round_id, pairing_ids
+
+    def subscribeStandings(self, tournament_id=None, tiebreaks=False, max_queue=None):
+        from tournament import FEED_QUEUE_SIZE
+        return feed.Subscription(
+            self._feed, tournament_id,
+            lambda t: (self.playerStandings(t, True), self._latest_round(t)),
+            max_queue or FEED_QUEUE_SIZE, tiebreaks)
+
+    def getPairings(self, round_id):
+        return [(pairing_id, one, two or None, self._pairing_matches.get(pairing_id))
+                for pairing_id, round_, one, two in zip(self._pairing_ids, self._pairing_rounds,
+                                                        self._pairing_one, self._pairing_two)
+                if round_ == round_id]
+
+    def _last_round(self, tournament_id):
+        rounds = [(number, round_id) for round_id, t, number in zip(
+            self._round_ids, self._round_tournaments, self._round_numbers)
+            if t == (tournament_id or 0)]
+        if not rounds:
+            return None
+        number, round_id = max(rounds)
+        return round_id, number
+
+    def _read_checkpoint(self, tournament_id, round_id, number):
+        return checkpoint.Checkpoint.from_rows(
+            tournament_id, round_id, number, max(self._match_ids or [0]),
+            self.playerStandings(tournament_id, True), self.getMatchHistory(tournament_id),
+            self.getPairings(round_id))
+
+    def _write_checkpoint(self, tournament_id, round_id, number):
+        self._checkpoints[tournament_id or 0] = (
+            round_id, number, self._read_checkpoint(tournament_id, round_id, number).encode())
+
+    def checkpointRound(self, tournament_id=None):
+        latest = self._last_round(tournament_id)
+        if latest is None:
+            raise ValueError("Tournament {0} has no rounds.".format(tournament_id))
+        self._write_checkpoint(tournament_id, *latest)
+        return latest[0]
+
+    def resumeTournament(self, tournament_id=None):
+        stored = self._checkpoints.get(tournament_id or 0)
+        if stored is None:
+            return None
+        state = checkpoint.decode(stored[2])
+        if tournament_id is None:
+            player_count = len(self._player_ids)
+        else:
+            player_count = len(self._rosters[tournament_id])
+        matches = [(self._match_ids[i], self._match_one[i], self._match_two[i] or None,
+                    bool(self._match_draw[i]), self._match_pairings[i] or None)
+                   for i in range(len(self._match_ids))
+                   if self._match_ids[i] > state.last_match_id and (
+                       tournament_id is None or self._match_tournaments[i] == tournament_id)]
+        round_id, number = self._last_round(tournament_id)
+        if not checkpoint.catch_up(state, player_count, number, matches):
+            state = self._read_checkpoint(tournament_id, round_id, number)
+        return state
+
+    def registerTournamentPlayer(self, tournament_id, player_id):
+        self.registerTournamentPlayers(tournament_id, [player_id])
+
+    def registerTournamentPlayers(self, tournament_id, player_ids,
+                                  chunk_size=None, commit_chunks=False):
+        player_ids = list(player_ids)
+        self._check_tournament(tournament_id)
+        roster = self._rosters[tournament_id]
+        registered = set(roster)
+        for player_id in player_ids:
+            self._check_player(player_id)
+            if player_id in registered:
+                raise ValueError("Player {0} is already registered in tournament {1}.".format(
+                    player_id, tournament_id))
+            registered.add(player_id)
+        stats = self._stats.setdefault(tournament_id, _Stats())
+        for player_id in player_ids:
+            roster.append(player_id)
+            stats.add(player_id)
+        self._feed.publish(feed.Resync([tournament_id]))
+        return len(player_ids)
+
+    def exportTournament(self, tournament_id, path, fetch_size=None):
+        if tournament_id not in self._rosters:
+            raise ValueError("Unknown tournament id {0}.".format(tournament_id))
+        matches = [i for i, t in enumerate(self._match_tournaments) if t == tournament_id]
+        player_ids = set(self._rosters[tournament_id])
+        for i in matches:
+            player_ids.update([self._match_one[i], self._match_two[i]])
+        player_ids.discard(0)
+        round_ids = set(round_id for round_id, t in zip(self._round_ids, self._round_tournaments)
+                        if t == tournament_id)
+        slots = self._player_slots
+        rows = {
+            'players': [(player_id, self._player_names[slots[player_id]])
+                        for player_id in sorted(player_ids)],
+            'roster': [(player_id,) for player_id in sorted(self._rosters[tournament_id])],
+            'rounds': [(round_id, number) for round_id, t, number in
+                       zip(self._round_ids, self._round_tournaments, self._round_numbers)
+                       if t == tournament_id],
+            'pairings': [row for row in zip(self._pairing_ids, self._pairing_rounds,
+                                            self._pairing_one, self._pairing_two)
+                         if row[1] in round_ids],
+            'matches': [(self._match_ids[i], self._match_one[i], self._match_two[i],
+                         self._match_draw[i], self._match_pairings[i]) for i in matches],
+        }
+        tables = {}
+        for table, table_rows in rows.items():
+            columns = archive.new_table(table)
+            for row in table_rows:
+                for column, value in zip(columns.values(), row):
+                    column.append(value)
+            tables[table] = columns
+        archive.write_archive(path, tables)
+        return dict((table, len(table_rows)) for table, table_rows in rows.items())
+
+    def importTournament(self, path):
+        with archive.Archive(path) as source, self.transaction():
+            players = source.table('players')
+            roster = source.table('roster')
+            rounds = source.table('rounds')
+            pairings = source.table('pairings')
+            matches = source.table('matches')
+
+            self.registerTournament()
+            tournament_id = self._tournament_ids[-1]
+            player_ids = self.registerPlayers(players['name'])
+
+            def remap(column, old_ids, new_ids):
+                return [int(value) for value in archive.remap(column, old_ids, new_ids)]
+
+            self.registerTournamentPlayers(
+                tournament_id, remap(roster['player_id'], players['id'], player_ids))
+            round_ids = []
+            for number in rounds['number']:
+                round_ids.append(self._next_round_id)
+                self._next_round_id += 1
+                self._round_ids.append(round_ids[-1])
+                self._round_tournaments.append(tournament_id)
+                self._round_numbers.append(int(number))
+            pairing_ids = []
+            for round_id, one, two in zip(
+                    remap(pairings['round_id'], rounds['round_id'], round_ids),
+                    remap(pairings['player_one'], players['id'], player_ids),
+                    remap(pairings['player_two'], players['id'], player_ids)):
+                pairing_ids.append(self._next_pairing_id)
+                self._next_pairing_id += 1
+                self._pairing_ids.append(pairing_ids[-1])
+                self._pairing_rounds.append(round_id)
+                self._pairing_one.append(one)
+                self._pairing_two.append(two)
+            results = zip(remap(matches['one'], players['id'], player_ids),
+                          remap(matches['two'], players['id'], player_ids),
+                          [bool(draw) for draw in matches['draw']])
+            match_ids = self._report([(one, two or None, draw)
+                                      for one, two, draw in results], tournament_id)
+            first = len(self._match_ids) - len(match_ids)
+            for i, pairing_id in enumerate(
+                    remap(matches['pairing_id'], pairings['pairing_id'], pairing_ids)):
+                if pairing_id:
+                    self._match_pairings[first + i] = pairing_id
+                    self._pairing_matches[pairing_id] = match_ids[i]
+
+            # The players are new, so their totals' tie-breaks are these.
+            self.updateTiebreaks(tournament_id)
+            stats, totals = self._stats[tournament_id], self._stats[0]
+            for player_id, slot in stats.slots.items():
+                total = totals.slots[player_id]
+                totals.buchholz[total] = stats.buchholz[slot]
+                totals.sonneborn_berger[total] = stats.sonneborn_berger[slot]
+                totals.opp_match_win_pct[total] = stats.opp_match_win_pct[slot]
+        self._feed.publish(feed.Resync([None]))
+        return tournament_id
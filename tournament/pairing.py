@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+#
+# pairing.py -- Swiss pairing engine with rematch avoidance and byes
+#
+# Works on plain player ids so it can be fed from any backend.  Scores are
+# kept in half points (2 per win, 1 per draw) to stay in integers.
+#
+import collections
+import itertools
+
+# Search steps allowed per score group before settling for a greedy pairing.
+MAX_BACKTRACK_STEPS = 20000
+
+# How many already-made pairs at the bottom of the field may be reopened to
+# place players that could not be paired without a rematch (or to give a
+# bye to someone who hasn't had one).
+MAX_UNWIND_PAIRS = 8
+
+
+def pair_key(a, b):
+    """ Order-independent integer key for the pairing of two player ids. """
+    if a > b:
+        a, b = b, a
+    return (a << 32) | b
+
+
+class History(object):
+    """ Indexed record of who has played whom, and who has had a bye. """
+    __slots__ = ('pairs', 'byes')
+
+    def __init__(self, matches=()):
+        """ Build from (player_one, player_two) tuples; player_two is None
+        for a bye. """
+        pairs = set()
+        byes = set()
+        for one, two in matches:
+            if two is None:
+                byes.add(one)
+            else:
+                pairs.add(pair_key(one, two))
+        self.pairs = pairs
+        self.byes = byes
+
+    def played(self, a, b):
+        return pair_key(a, b) in self.pairs
+
+    def add(self, a, b):
+        if b is None:
+            self.byes.add(a)
+        else:
+            self.pairs.add(pair_key(a, b))
+
+
+def score(wins, draws):
+    """ A record's score in half points. """
+    return 2 * wins + draws
+
+
+def score_groups(players, scores):
+    """ Split ranked players into groups of equal score, best first.
+
+    Args:
+      players: player ids in ranking order.
+      scores: dict of player id -> score.
+
+    Returns:
+      A list of lists of player ids; ranking order is kept inside a group.
+    """
+    ordered = sorted(players, key=lambda player: -scores[player])
+    return [list(group) for _, group in
+            itertools.groupby(ordered, key=lambda player: scores[player])]
+
+
+def _greedy(players, pairs):
+    """ Pair each player with the next available one they haven't met.
+
+    Returns:
+      (pairs, leftovers), with leftovers in ranking order.
+    """
+    n = len(players)
+    used = bytearray(n)
+    made = []
+    leftovers = []
+    for i in range(n):
+        if used[i]:
+            continue
+        used[i] = 1
+        p = players[i]
+        j = i + 1
+        while j < n and (used[j] or pair_key(p, players[j]) in pairs):
+            j += 1
+        if j < n:
+            used[j] = 1
+            made.append((p, players[j]))
+        else:
+            leftovers.append(p)
+    return made, leftovers
+
+
+def _perfect(players, pairs, budget):
+    """ Pair every player without a rematch by depth-first search.
+
+    Partners are tried in ranking order, so the first solution found keeps
+    players as close to their neighbours as possible.
+
+    Returns:
+      A list of pairs, or None if there is no solution or the search used
+      up `budget` steps.
+    """
+    n = len(players)
+    if n % 2:
+        return None
+    partner = [-1] * n
+    stack = []              # (i, j) choices made so far
+    i, j = 0, None
+    steps = 0
+    while True:
+        while i < n and partner[i] != -1:
+            i += 1
+        if i == n:
+            return [(players[a], players[b]) for a, b in stack]
+        if j is None:
+            j = i + 1
+        p = players[i]
+        while j < n and (partner[j] != -1 or pair_key(p, players[j]) in pairs):
+            j += 1
+        steps += 1
+        if steps > budget:
+            return None
+        if j < n:
+            partner[i], partner[j] = j, i
+            stack.append((i, j))
+            i, j = i + 1, None
+            continue
+        # Dead end: undo the last choice and try its next partner.
+        if not stack:
+            return None
+        i, j = stack.pop()
+        partner[i] = partner[j] = -1
+        j += 1
+
+
+def _pair_group(players, pairs, budget):
+    """ Pair a score group, leaving as few (and as low ranked) floaters as
+    possible.
+
+    Returns:
+      (pairs, floaters)
+    """
+    made, leftovers = _greedy(players, pairs)
+    if len(leftovers) <= len(players) % 2:
+        return made, leftovers
+    if len(players) % 2 == 0:
+        found = _perfect(players, pairs, budget)
+        if found is not None:
+            return found, []
+    else:
+        # Float the lowest ranked player that lets the rest pair cleanly.
+        for k in range(len(players) - 1, -1, -1):
+            rest = players[:k] + players[k + 1:]
+            found = _perfect(rest, pairs, budget // len(players) + 1)
+            if found is not None:
+                return found, [players[k]]
+    return made, leftovers
+
+
+def _bye_candidates(players, byes):
+    """ Players who may get the bye, best choice first: the lowest ranked
+    who haven't had one yet, or everyone if all have. """
+    candidates = [player for player in reversed(players) if player not in byes]
+    return candidates or list(reversed(players))
+
+
+def _reopen(pending, floaters, rank, pairs, budget):
+    """ Pair the floaters by reopening the last pending pairs, twice as many
+    each time that fails, up to all of them.
+
+    Returns:
+      (pending, floaters): the floaters are left over, unpaired, if no
+      clean pairing exists.
+    """
+    unwind = min(1, len(pending))
+    while floaters:
+        start = len(pending) - unwind
+        pool = [player for pair in pending[start:] for player in pair] + floaters
+        pool.sort(key=rank.get)
+        found = _perfect(pool, pairs, budget)
+        if found is not None:
+            return pending[:start] + found, []
+        if unwind == len(pending):
+            break
+        unwind = min(unwind * 2, len(pending))
+    return pending, floaters
+
+
+class _Builder(object):
+    """ The state of iter_pairings() between score groups. """
+    def __init__(self, history, budget):
+        self.history = history
+        self.budget = budget
+        self.pending = collections.deque()
+        self.floaters = []
+        self.rank = {}      # ranking position of every player not yet returned
+        self.position = 0
+
+    def add_group(self, group):
+        """ Pair the next score group; returns the pairs now settled. """
+        rank = self.rank
+        for player in group:
+            rank[player] = self.position
+            self.position += 1
+        group_pairs, self.floaters = _pair_group(self.floaters + group,
+                                                 self.history.pairs, self.budget)
+        pending = self.pending
+        pending.extend(group_pairs)
+        settled = []
+        while len(pending) > MAX_UNWIND_PAIRS:
+            pair = pending.popleft()
+            del rank[pair[0]], rank[pair[1]]
+            settled.append(pair)
+        return settled
+
+    def finish(self):
+        """ Pair what is left once every group is in.
+
+        Returns:
+          The remaining pairs, then (player_id, None) for the bye, if any.
+        """
+        history, rank, floaters = self.history, self.rank, self.floaters
+        pending = list(self.pending)
+        bye = None
+        if len(floaters) % 2:
+            # Give the bye to the first candidate that leaves the others to
+            # pair cleanly, if any does.
+            candidates = sorted([player for pair in pending for player in pair] + floaters,
+                                key=rank.get)
+            best = None
+            for candidate in _bye_candidates(candidates, history.byes):
+                if candidate in floaters:
+                    rest = pending
+                    left = [player for player in floaters if player != candidate]
+                else:
+                    [pair] = [pair for pair in pending if candidate in pair]
+                    rest = [other for other in pending if other != pair]
+                    left = floaters + [pair[1] if pair[0] == candidate else pair[0]]
+                result = _reopen(rest, left, rank, history.pairs, self.budget)
+                if best is None or not result[1]:
+                    bye, best = candidate, result
+                if not result[1]:
+                    break
+            pending, floaters = best
+        elif floaters:
+            pending, floaters = _reopen(pending, floaters, rank, history.pairs, self.budget)
+
+        if floaters:
+            # No clean pairing exists: accept rematches for what's left.
+            floaters.sort(key=rank.get)
+            pending.extend(zip(floaters[::2], floaters[1::2]))
+
+        if bye is not None:
+            pending.append((bye, None))
+        return pending
+
+
+def iter_pairings(groups, history, budget=MAX_BACKTRACK_STEPS):
+    """ Pair score groups as they arrive, yielding pairs once settled.
+
+    Players are paired within their score group, top down.  A player who
+    can't be paired in their group without a rematch floats down into the
+    next one.  The last MAX_UNWIND_PAIRS pairs are held back so that, once
+    the field is exhausted, the players left over can be re-paired together
+    with them; rematches are only allowed if that fails too.  In an odd
+    field the bye goes to the lowest ranked of those players without one
+    whose absence lets the others pair cleanly.
+
+    Only the current group and the held back pairs are kept in memory, so
+    a field can be streamed straight from the database.
+
+    Args:
+      groups: iterable of lists of player ids, best score first and in
+        ranking order within a group (see score_groups()).
+      history: History of previous pairings.
+      budget: backtracking steps allowed per score group.
+
+    Yields:
+      (player_id, player_id) tuples in board order, then (player_id, None)
+      for the bye, if any.
+    """
+    builder = _Builder(history, budget)
+    for group in groups:
+        for pair in builder.add_group(group):
+            yield pair
+    for pair in builder.finish():
+        yield pair
+
+
+class IncrementalPairer(object):
+    """ Pairs the next round while the current one is still being played.
+
+    A player whose game is still outstanding can finish at most two half
+    points above their current score.  So while the best score among those
+    players is S, every score group above S + 2 is final and is paired
+    straight away, exactly as pair_players() would pair the completed
+    round.  A reported result costs O(1) besides pairing the groups it
+    releases.
+
+    Args:
+      ranking: (player_id, wins, draws, key) for every player, with their
+        record before the outstanding games.  Players of equal wins and
+        draws are ranked by ascending key (e.g. negated tie-breaks, then id).
+      outstanding: (player_id, player_id) pairs of the current round still
+        to be reported, with None as the second player of a bye.
+      history: History of previous pairings, without the outstanding games;
+        they are added to it.
+      budget: backtracking steps allowed per score group.
+    """
+    def __init__(self, ranking, outstanding, history, budget=MAX_BACKTRACK_STEPS):
+        self.released = []
+        self._builder = _Builder(history, budget)
+        self._wins = {}
+        self._draws = {}
+        self._keys = {}
+        self._opponents = {}                            # outstanding games, both ways
+        self._waiting = collections.defaultdict(int)    # score -> players still playing
+        self._groups = collections.defaultdict(list)    # score -> players done
+        self._finished = False
+        for player, wins, draws, key in ranking:
+            self._wins[player] = wins
+            self._draws[player] = draws
+            self._keys[player] = key
+        for one, two in outstanding:
+            history.add(one, two)
+            for player, opponent in ((one, two), (two, one)):
+                if player is not None:
+                    self._opponents[player] = opponent
+                    self._waiting[self._score(player)] += 1
+        for player in self._wins:
+            if player not in self._opponents:
+                self._groups[self._score(player)].append(player)
+        # Highest score group not yet paired.
+        self._next = max(list(self._groups) + list(self._waiting) + [0]) + 2
+        self._release()
+
+    @property
+    def complete(self):
+        """ True once the whole next round has been released. """
+        return self._finished
+
+    def _score(self, player):
+        return score(self._wins[player], self._draws[player])
+
+    def expects(self, winner, loser=None):
+        """ True if winner and loser (None for a bye) have a game outstanding. """
+        return (winner in self._opponents and self._opponents[winner] == loser and
+                (loser is None or self._opponents.get(loser) == winner))
+
+    def report(self, winner, loser=None, draw=False):
+        """ Record the result of an outstanding game.
+
+        Args:
+          winner, loser, draw: as for tournament.reportMatch; loser is None
+            for a bye.
+
+        Returns:
+          The next round's pairings this result released: (player_id,
+          player_id) tuples in board order, ending with (player_id, None)
+          for the bye once the whole round is paired.
+        """
+        if not self.expects(winner, loser):
+            raise ValueError(
+                "No outstanding game between {0} and {1}.".format(winner, loser))
+        players = [winner] if loser is None else [winner, loser]
+        for player in players:
+            del self._opponents[player]
+            self._waiting[self._score(player)] -= 1
+        if draw:
+            self._draws[winner] += 1
+            self._draws[loser] += 1
+        else:
+            self._wins[winner] += 1
+        for player in players:
+            self._groups[self._score(player)].append(player)
+        return self._release()
+
+    def _release(self):
+        """ Pair every score group that can no longer change. """
+        waiting = [group_score for group_score, count in self._waiting.items() if count]
+        floor = max(waiting) + 2 if waiting else -1
+        released = []
+        while self._next > floor:
+            group = self._groups.pop(self._next, None)
+            self._waiting.pop(self._next, None)
+            if group:
+                group.sort(key=self._rank_key)
+                released.extend(self._builder.add_group(group))
+            self._next -= 1
+        if not waiting and not self._finished:
+            released.extend(self._builder.finish())
+            self._finished = True
+        self.released.extend(released)
+        return released
+
+    def _rank_key(self, player):
+        return (-self._wins[player], -self._draws[player], self._keys[player])
+
+
+def pair_players(players, scores, history, budget=MAX_BACKTRACK_STEPS):
+    """ Pair a field for the next Swiss round; see iter_pairings().
+
+    Args:
+      players: player ids in ranking order.
+      scores: dict of player id -> score (see score()).
+      history: History of previous pairings.
+      budget: backtracking steps allowed per score group.
+
+    Returns:
+      (pairs, bye): a list of (player_id, player_id) tuples in board order,
+      and the id of the player who gets a bye (None for an even field).
+    """
+    pairs = list(iter_pairings(score_groups(players, scores), history, budget))
+    bye = None
+    if pairs and pairs[-1][1] is None:
+        bye = pairs.pop()[0]
+    return pairs, bye
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+#
+# pool.py -- thread-aware PostgreSQL connection pool for tournament.py
+#
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolError(Exception):
+    """ Raised when the pool cannot hand out a connection. """
+
+
+class PoolTimeout(PoolError):
+    """ Raised when no connection became available within the timeout. """
+
+
+class Transaction(object):
+    """ A unit of work on one pooled connection.
+
+    Passing a Transaction as the `db` argument of any tournament.py function
+    runs that function inside it, so several API calls can share a single
+    commit.  The pool commits or rolls back when the transaction ends.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self._on_commit = []
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def on_commit(self, callback):
+        """ Call callback() once the transaction has committed. """
+        self._on_commit.append(callback)
+
+    def _committed(self):
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
+            callback()
+
+
+class ConnectionPool(object):
+    """ A bounded pool of reusable psycopg2 connections.
+
+    Connections are checked out per thread: a thread that already holds a
+    connection gets the same one back until it releases every checkout.
+    Idle connections are health checked before reuse and replaced when the
+    server has gone away.
+
+    Args:
+      dsn: libpq connection string.
+      minconn: connections opened up front and kept idle.
+      maxconn: upper bound on open connections.
+      timeout: seconds to wait for a free connection (None waits forever).
+      health_check_interval: idle seconds after which a connection is
+        pinged with `SELECT 1` before being handed out.
+      connect_func: callable used to open new connections.
+    """
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=None,
+                 health_check_interval=30, connect_func=psycopg2.connect,
+                 **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool needs 0 <= minconn <= maxconn and maxconn >= 1.")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._connect_func = connect_func
+        self._connect_kwargs = connect_kwargs
+        self._idle = []            # [(conn, released_at), ...]
+        self._in_use = set()       # id() of every checked-out connection
+        self._size = 0             # idle + in use + being opened
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._savepoints = itertools.count(1)
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'created': 0,
+            'reconnects': 0,
+            'discarded': 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.time()))
+            self._size += 1
+
+    def _open(self):
+        conn = self._connect_func(self.dsn, **self._connect_kwargs)
+        self._stats['created'] += 1
+        return conn
+
+    def _healthy(self, conn, released_at):
+        """ Cheap liveness check for an idle connection. """
+        if conn.closed:
+            return False
+        if time.time() - released_at < self.health_check_interval:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1;")
+            c.close()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+        return True
+
+    def _acquire(self):
+        """ Take an idle connection or open a new one, waiting if full. """
+        start = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed.")
+                if self._idle or self._size < self.maxconn:
+                    break
+                if start is None:
+                    start = time.time()
+                    self._stats['waits'] += 1
+                remaining = None
+                if self.timeout is not None:
+                    remaining = self.timeout - (time.time() - start)
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            "No connection available after {0}s.".format(self.timeout))
+                self._cond.wait(remaining)
+            if start is not None:
+                waited = time.time() - start
+                self._stats['wait_time'] += waited
+                self._stats['max_wait_time'] = max(self._stats['max_wait_time'], waited)
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+            self._size += 1 if conn is None else 0
+            self._stats['checkouts'] += 1
+
+        # Connecting and pinging happen outside the lock.
+        try:
+            if conn is not None and not self._healthy(conn, released_at):
+                self._close_quietly(conn)
+                conn = None
+                with self._cond:
+                    self._stats['reconnects'] += 1
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use.add(id(conn))
+        return conn
+
+    def _release(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    discard = True
+        with self._cond:
+            self._in_use.discard(id(conn))
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                drop = True
+            else:
+                self._idle.append((conn, time.time()))
+                drop = False
+            self._cond.notify()
+        if drop:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """ Check out this thread's connection, opening or waiting if needed. """
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            local.depth += 1
+            return local.conn
+        local.conn = self._acquire()
+        local.depth = 1
+        return local.conn
+
+    def putconn(self, conn, discard=False):
+        """ Give back a connection obtained from getconn().
+
+        Args:
+          conn: the connection to return.
+          discard: close the connection instead of keeping it idle, e.g.
+            after a network error.
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is not conn:
+            raise PoolError("Connection was not checked out by this thread.")
+        if discard:
+            local.depth = 1
+        local.depth -= 1
+        if local.depth == 0:
+            local.conn = None
+            self._release(conn, discard)
+
+    @contextmanager
+    def connection(self):
+        """ Context manager around getconn()/putconn(). """
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard)
+
+    @contextmanager
+    def dedicated(self):
+        """ Check out a connection that is not bound to this thread.
+
+        For long-lived work such as streaming a server-side cursor, which
+        must not be committed by API calls the thread makes meanwhile.
+        """
+        conn = self._acquire()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self._release(conn, discard)
+
+    def current_transaction(self):
+        """ The transaction this thread has open on the pool, if any. """
+        return getattr(self._local, 'transaction', None)
+
+    @contextmanager
+    def transaction(self):
+        """ Open a transaction that tournament.py calls will join.
+
+        Re-entrant: a nested transaction() on the same thread yields the
+        outer Transaction and leaves commit to the outermost block; if the
+        nested block raises, only its own work is rolled back, through a
+        savepoint.  The on_commit() callbacks run after the connection has
+        been returned.
+        """
+        current = self.current_transaction()
+        if current is not None:
+            with self._savepoint(current, release=True):
+                yield current
+            return
+        with self.connection() as conn:
+            tx = Transaction(conn)
+            self._local.transaction = tx
+            try:
+                yield tx
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._local.transaction = None
+        tx._committed()
+
+    @contextmanager
+    def isolated(self):
+        """ Like transaction(), but everything done in the block is rolled
+        back when it ends.
+
+        Nested inside a transaction it rolls back to a savepoint, so a
+        test suite can run each test in isolated() within one outer
+        isolated() block and never has to delete anything.
+        """
+        current = self.current_transaction()
+        if current is not None:
+            with self._savepoint(current, release=False):
+                yield current
+            return
+        with self.connection() as conn:
+            tx = Transaction(conn)
+            self._local.transaction = tx
+            try:
+                yield tx
+            finally:
+                self._local.transaction = None
+                if not conn.closed:
+                    conn.rollback()
+
+    @contextmanager
+    def _savepoint(self, tx, release):
+        """ Roll back to a savepoint if the block raises, or always unless
+        `release`. """
+        name = "pool_savepoint_{0}".format(next(self._savepoints))
+        c = tx.cursor()
+        c.execute("SAVEPOINT {0};".format(name))
+        try:
+            yield
+        except:
+            if not tx.conn.closed:
+                c.execute("ROLLBACK TO SAVEPOINT {0};".format(name))
+            raise
+        else:
+            if release:
+                c.execute("RELEASE SAVEPOINT {0};".format(name))
+            else:
+                c.execute("ROLLBACK TO SAVEPOINT {0};".format(name))
+        finally:
+            c.close()
+
+    def closeall(self):
+        """ Close idle connections and refuse further checkouts. """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """ Snapshot of pool counters.
+
+        Returns:
+          A dict with checkouts, waits, wait_time, max_wait_time, created,
+          reconnects and discarded counters plus the current in_use, idle
+          and size gauges.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['in_use'] = len(self._in_use)
+            stats['idle'] = len(self._idle)
+            stats['size'] = self._size
+        return stats
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# ratings.py -- Elo ratings, updated match by match or replayed in bulk
+#
+# Mirrors the rate_match() SQL function for backends that keep their data
+# in Python, and replays whole match histories for recomputeRatings.  Uses
+# NumPy when it is installed.
+#
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Rating of a player who hasn't played; players.rating's default in
+# tournament.sql.
+INITIAL_RATING = 1500.0
+
+# Most a rating can move in one match.  Must match rate_match().
+K_FACTOR = 32.0
+
+# A rating difference of this much means odds of 10 to 1.
+SCALE = 400.0
+
+
+def expected_score(rating, opponent_rating):
+    """ Expected points (1 per win, 1/2 per draw) against an opponent. """
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / SCALE))
+
+
+def rate(one, two, draw=False):
+    """ Ratings after one match.
+
+    Args:
+      one: rating of the winner (or of a drawing player).
+      two: rating of the loser (or of the other drawing player).
+      draw: True if the match was drawn.
+
+    Returns:
+      (one, two), the new ratings.  Their sum is unchanged.
+    """
+    delta = K_FACTOR * ((0.5 if draw else 1.0) - expected_score(one, two))
+    return one + delta, two - delta
+
+
+def _waves(ones, twos, size):
+    """ Split a match sequence into waves that can be rated at once.
+
+    A match goes in the wave after the latest one holding either of its
+    players, so no player appears twice in a wave and every player meets
+    their opponents in the original order.  Rating the waves one after the
+    other therefore gives exactly the sequential result; a Swiss history
+    has one wave per round.
+
+    Args:
+      ones, twos: the players of each match, as positions below `size`.
+
+    Returns:
+      A list of wave numbers, from 0, aligned with the matches.
+    """
+    last = [-1] * size
+    numbers = []
+    for one, two in zip(ones, twos):
+        number = max(last[one], last[two]) + 1
+        last[one] = last[two] = number
+        numbers.append(number)
+    return numbers
+
+
+def replay(player_ids, ones, twos, draw_flags):
+    """ Ratings after playing a match history from scratch.
+
+    Args:
+      player_ids: every player to rate; they all start at INITIAL_RATING.
+      ones, twos, draw_flags: per-match sequences, aligned and in the order
+        the matches were played.  ones holds the winner (or a drawing
+        player), twos the loser (or the other drawing player, or 0 for a
+        bye), draw_flags is true for draws.  Byes and matches with players
+        outside player_ids are not rated.
+
+    Returns:
+      A list of ratings aligned with player_ids.
+    """
+    if not len(player_ids):
+        return []
+    if numpy is not None:
+        return _replay_numpy(player_ids, ones, twos, draw_flags)
+    return _replay_python(player_ids, ones, twos, draw_flags)
+
+
+def _replay_numpy(player_ids, ones, twos, draw_flags):
+    n = len(player_ids)
+    ids = numpy.asarray(player_ids, dtype=numpy.int64)
+    ones = numpy.asarray(ones, dtype=numpy.int64)
+    twos = numpy.asarray(twos, dtype=numpy.int64)
+    draw_flags = numpy.asarray(draw_flags, dtype=bool)
+
+    # Map ids to positions; byes and unknown players are dropped.
+    order = numpy.argsort(ids)
+    sorted_ids = ids[order]
+    a = numpy.searchsorted(sorted_ids, ones).clip(0, n - 1)
+    b = numpy.searchsorted(sorted_ids, twos).clip(0, n - 1)
+    known = (sorted_ids[a] == ones) & (sorted_ids[b] == twos) & (ones != twos)
+    a, b, draw_flags = order[a[known]], order[b[known]], draw_flags[known]
+    scores = numpy.where(draw_flags, 0.5, 1.0)
+
+    # Rate a wave at a time; the players of a wave are all distinct, so the
+    # fancy-indexed updates don't collide.
+    numbers = numpy.asarray(_waves(a.tolist(), b.tolist(), n), dtype=numpy.int64)
+    by_wave = numpy.argsort(numbers, kind='mergesort')
+    bounds = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(numbers))])
+    ratings = numpy.full(n, INITIAL_RATING)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        games = by_wave[start:stop]
+        one, two = a[games], b[games]
+        delta = K_FACTOR * (scores[games] - 1.0 /
+                            (1.0 + 10.0 ** ((ratings[two] - ratings[one]) / SCALE)))
+        ratings[one] += delta
+        ratings[two] -= delta
+    return ratings.tolist()
+
+
+def _replay_python(player_ids, ones, twos, draw_flags):
+    slots = dict((player_id, i) for i, player_id in enumerate(player_ids))
+    ratings = [INITIAL_RATING] * len(player_ids)
+    for one, two, draw in zip(ones, twos, draw_flags):
+        a = slots.get(one)
+        b = slots.get(two)
+        if a is None or b is None or a == b:
+            continue
+        ratings[a], ratings[b] = rate(ratings[a], ratings[b], draw)
+    return ratings
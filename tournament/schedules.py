@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# schedules.py -- round-robin and elimination schedules for large fields
+#
+# Like pairing.py, works on plain player ids.  Rounds are produced one at
+# a time and nothing is kept beyond the round being played, so a round
+# robin of 20,000 players (200 million games) costs memory for one round of
+# 10,000 pairs.  Store each round with createRound, which loads its
+# pairings with COPY:
+#
+#     for pairs in round_robin(player_ids):
+#         round_id, pairing_ids = createRound(db, pairs, tournament_id)
+#
+# Pairs are (player_id, player_id) tuples in board order, with a bye as
+# (player_id, None) last, as swissPairings lists them.
+#
+
+
+def round_robin_rounds(player_num):
+    """ Rounds in a round robin: everyone plays everyone once. """
+    if player_num < 2:
+        return 0
+    return player_num - 1 if player_num % 2 == 0 else player_num
+
+
+def round_robin_matches(player_num):
+    """ Games in a round robin, not counting byes. """
+    return player_num * (player_num - 1) // 2
+
+
+def round_robin_round(players, number):
+    """ One round of a round robin by the circle method.
+
+    The last player stays put while the others rotate around a circle;
+    round `number` pairs the players at equal distances either side of
+    position number - 1.  Any round is computed directly, in O(n).
+
+    Args:
+      players: the player ids, in a fixed order.
+      number: the round, from 1 to round_robin_rounds(len(players)).
+
+    Returns:
+      The round's pairs.  The player at position number - 1 plays the last
+      player, taking turns at being listed first, or with an odd number of
+      players has the bye.
+    """
+    players = list(players)
+    if not 1 <= number <= round_robin_rounds(len(players)):
+        raise ValueError("No round {0} in a round robin of {1} players.".format(
+            number, len(players)))
+    odd = len(players) % 2
+    circle = len(players) - 1 + odd     # players around the circle
+    fixed = None if odd else players[-1]
+    r = number - 1
+    pairs = []
+    if fixed is not None:
+        pairs.append((fixed, players[r]) if r % 2 else (players[r], fixed))
+    for i in range(1, (circle + 1) // 2):
+        pairs.append((players[(r + i) % circle], players[(r - i) % circle]))
+    if fixed is None:
+        pairs.append((players[r], None))
+    return pairs
+
+
+def round_robin(players, start=1):
+    """ Yield the rounds of a round robin, from round `start` on; see
+    round_robin_round(). """
+    players = list(players)
+    for number in range(start, round_robin_rounds(len(players)) + 1):
+        yield round_robin_round(players, number)
+
+
+def seed_order(size):
+    """ Seeds in bracket order for a bracket of `size` (a power of two).
+
+    Seeds 1 and 2 can only meet in the final, 1 to 4 in the semi-finals,
+    and so on: each round pairs seeds adding up to one more than the
+    bracket's size at that point.
+    """
+    order = [1]
+    while len(order) < size:
+        total = 2 * len(order) + 1
+        order = [seed for top in order for seed in (top, total - top)]
+    return order
+
+
+def elimination_rounds(player_num, double=False):
+    """ Most rounds in a single or double elimination bracket.
+
+    A double elimination bracket is one round shorter if the winners'
+    bracket champion wins the grand final, as no decider is needed.
+    """
+    if player_num < 2:
+        return 0
+    rounds = (player_num - 1).bit_length()
+    return 2 * rounds + 1 if double else rounds
+
+
+def elimination_matches(player_num, double=False):
+    """ Most games in a single or double elimination bracket, not counting
+    byes: everyone but the champion loses once, or twice, plus the grand
+    final decider. """
+    if player_num < 2:
+        return 0
+    return 2 * player_num - 1 if double else player_num - 1
+
+
+class Bracket(object):
+    """ A seeded single or double elimination bracket, played round by round.
+
+    Iterating over a bracket yields its rounds; report every game of a
+    round before asking for the next.  The field is padded to a power of
+    two with byes for the top seeds, which advance without playing.
+
+        bracket = Bracket(seeded_player_ids, double=True)
+        for pairs in bracket:
+            for one, two in pairs:
+                bracket.report(winner, loser)
+        print bracket.champion
+
+    In a double elimination bracket, a player's first loss drops them into
+    the losers' bracket, which alternates between rounds among its own
+    players and rounds against the losers dropping in from the winners'
+    bracket, in reverse order every other time to keep rematches apart.
+    Its rounds are played alongside the winners' bracket, one behind.  The
+    two champions meet in the grand final, replayed if the losers' bracket
+    champion wins it.  Only the players still in each bracket are kept.
+
+    Args:
+      players: the player ids, best seed first.
+      double: double elimination instead of single.
+    """
+    def __init__(self, players, double=False):
+        players = list(players)
+        if len(players) < 2:
+            raise ValueError("A bracket needs at least two players.")
+        self.double = double
+        self.number = 0                 # rounds handed out
+        self.champion = None
+        size = 1 << (len(players) - 1).bit_length()
+        self._winners = [players[seed - 1] if seed <= len(players) else None
+                         for seed in seed_order(size)]
+        self._losers = None             # losers' bracket, once it has started
+        self._drops = []                # lists of winners' bracket losers waiting
+        self._drop_rounds = 0
+        self._final = None              # (winners' champion, losers' champion)
+        self._decider = False
+        self._outstanding = {}          # frozenset of the pair -> (bracket, index)
+        self._results = None            # bracket -> winners, losers of the round
+
+    def __iter__(self):
+        while True:
+            pairs = self.next_round()
+            if not pairs:
+                return
+            yield pairs
+
+    @property
+    def complete(self):
+        return self.champion is not None
+
+    def report(self, winner, loser):
+        """ Record the result of a game of the current round. """
+        match = self._outstanding.pop(frozenset([winner, loser]), None)
+        if match is None:
+            raise ValueError("No outstanding game between {0} and {1}.".format(
+                winner, loser))
+        bracket, index = match
+        self._results[bracket][0][index] = winner
+        self._results[bracket][1][index] = loser
+
+    def next_round(self):
+        """ The next round's pairs, once the current one is complete.
+
+        Returns:
+          [] once the bracket has a champion.
+
+        Raises:
+          ValueError: games of the current round are still outstanding.
+        """
+        if self._outstanding:
+            raise ValueError("Round {0} still has {1} games outstanding.".format(
+                self.number, len(self._outstanding)))
+        while True:
+            if self._results is not None:
+                self._advance()
+            if self.complete:
+                return []
+            pairs = self._pair()
+            if pairs:
+                self.number += 1
+                return pairs
+
+    def _pair(self):
+        """ Set up the games of the next round; returns those to be played. """
+        games = {}
+        if self._final is not None:
+            games['final'] = [self._final]
+        else:
+            if len(self._winners) > 1:
+                games['winners'] = list(zip(self._winners[::2], self._winners[1::2]))
+            losers = self._losers
+            if losers is not None and len(losers) > 1 and len(losers) > len(
+                    self._drops[0] if self._drops else ()):
+                games['losers'] = list(zip(losers[::2], losers[1::2]))
+            elif losers is not None and self._drops:
+                drops = self._drops.pop(0)
+                self._drop_rounds += 1
+                if self._drop_rounds % 2:
+                    drops.reverse()
+                games['losers'] = list(zip(losers, drops))
+        self._results = {}
+        pairs = []
+        for bracket in ('winners', 'losers', 'final'):
+            if bracket not in games:
+                continue
+            winners = [None] * len(games[bracket])
+            losers = [None] * len(games[bracket])
+            self._results[bracket] = (winners, losers)
+            for index, (one, two) in enumerate(games[bracket]):
+                if one is None or two is None:
+                    winners[index] = two if one is None else one
+                else:
+                    self._outstanding[frozenset([one, two])] = (bracket, index)
+                    pairs.append((one, two))
+        return pairs
+
+    def _advance(self):
+        """ Move the players on after a round. """
+        results, self._results = self._results, None
+        if 'final' in results:
+            winner = results['final'][0][0]
+            if self._decider or winner == self._final[0]:
+                self.champion = winner
+            else:
+                self._decider = True
+            return
+        if 'winners' in results:
+            winners, losers = results['winners']
+            self._winners = winners
+            if self.double:
+                if self._losers is None:
+                    self._losers = losers
+                else:
+                    self._drops.append(losers)
+        if 'losers' in results:
+            self._losers = results['losers'][0]
+        if len(self._winners) > 1:
+            return
+        if not self.double:
+            self.champion = self._winners[0]
+        elif len(self._losers) == 1 and not self._drops:
+            self._final = (self._winners[0], self._losers[0])
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# simulate.py -- Monte Carlo simulation of complete Swiss tournaments
+#
+# Plays the demo's tournament flow thousands of times against the in-memory
+# backend, spread over a process pool, and reports how often each player
+# wins and how well the number of rounds separates the field.
+#
+import argparse
+import multiprocessing
+import random
+
+from demo import calc_tournament_rounds
+from memory import MemoryBackend
+from tournament import registerPlayers, reportMatches, swissPairings
+from tournament import playerStandings, updateTiebreaks
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Tournaments played per task handed to a worker process.
+RUNS_PER_TASK = 50
+
+
+def play_round(pairs, strengths, draw_prob, rng):
+    """ Decide a round of matches at once.
+
+    The stronger player of a pair wins with the Elo expected score, after
+    setting aside `draw_prob` for draws.
+
+    Args:
+      pairs: list of (player_id, player_id) tuples.
+      strengths: dict of player id -> rating.
+      draw_prob: probability that any match is drawn.
+      rng: numpy.random.RandomState, or random.Random without NumPy.
+
+    Returns:
+      A list of (winner, loser, draw) tuples for reportMatches.
+    """
+    if not pairs:
+        return []
+    ones = [one for one, _ in pairs]
+    twos = [two for _, two in pairs]
+    if numpy is not None:
+        diff = (numpy.array([strengths[two] for two in twos], dtype=float) -
+                numpy.array([strengths[one] for one in ones], dtype=float))
+        one_wins = (1 - draw_prob) / (1 + 10 ** (diff / 400.0))
+        rolls = rng.random_sample(len(pairs))
+        draws = (rolls < draw_prob).tolist()
+        firsts = (rolls < draw_prob + one_wins).tolist()
+    else:
+        rolls = [rng.random() for _ in pairs]
+        draws = [roll < draw_prob for roll in rolls]
+        firsts = [roll < draw_prob + (1 - draw_prob) /
+                  (1 + 10 ** ((strengths[two] - strengths[one]) / 400.0))
+                  for roll, one, two in zip(rolls, ones, twos)]
+    return [(one, two, True) if draw else
+            (one, two, False) if first else
+            (two, one, False)
+            for one, two, draw, first in zip(ones, twos, draws, firsts)]
+
+
+def simulate_tournament(ratings, rounds, draw_prob, rng):
+    """ Play one Swiss tournament in memory.
+
+    Args:
+      ratings: player strengths, one per player; player i gets id i + 1.
+      rounds: number of Swiss rounds.
+      draw_prob: probability that any match is drawn.
+      rng: random source, see play_round.
+
+    Returns:
+      The final standings rows.
+    """
+    db = MemoryBackend()
+    ids = registerPlayers(db, ("Player {0}".format(i + 1) for i in range(len(ratings))))
+    strengths = dict(zip(ids, ratings))
+    for _ in range(rounds):
+        pairings = swissPairings(db)
+        pairs = [(row[0], row[2]) for row in pairings if row[2] is not None]
+        byes = [(row[0], None) for row in pairings if row[2] is None]
+        reportMatches(db, play_round(pairs, strengths, draw_prob, rng) + byes)
+        updateTiebreaks(db)
+    return playerStandings(db)
+
+
+def _spearman(order):
+    """ Rank correlation between finishing order and seed order (ids). """
+    n = len(order)
+    if n < 2:
+        return 1.0
+    d2 = sum((rank - (player_id - 1)) ** 2 for rank, player_id in enumerate(order))
+    return 1 - 6.0 * d2 / (n * (n * n - 1))
+
+
+def _run_batch(task):
+    """ Worker: play a batch of tournaments and return aggregate counts. """
+    ratings, rounds, draw_prob, runs, seed = task
+    rng = numpy.random.RandomState(seed) if numpy is not None else random.Random(seed)
+    firsts = [0] * len(ratings)
+    unique_leaders = 0
+    correlation = 0.0
+    for _ in range(runs):
+        standings = simulate_tournament(ratings, rounds, draw_prob, rng)
+        firsts[standings[0][0] - 1] += 1
+        top = (standings[0][2], standings[0][4])
+        if len(standings) < 2 or (standings[1][2], standings[1][4]) != top:
+            unique_leaders += 1
+        correlation += _spearman([row[0] for row in standings])
+    return firsts, unique_leaders, correlation
+
+
+def simulate(ratings, runs, rounds=None, draw_prob=0.1, processes=None, seed=None):
+    """ Play many tournaments and summarise the outcomes.
+
+    Args:
+      ratings: player strengths in seed order (best first is conventional).
+      runs: number of tournaments to play.
+      rounds: Swiss rounds per tournament; calc_tournament_rounds by default.
+      draw_prob: probability that any match is drawn.
+      processes: worker processes (all cores by default).
+      seed: base seed, for reproducible results.
+
+    Returns:
+      A dict with:
+        rounds: rounds played per tournament
+        win_probability: list, per player in seed order, of the share of
+          tournaments that player won (after tie-breaks)
+        unique_leader_rate: share of tournaments whose winner finished
+          clear of second place on wins and draws
+        mean_rank_correlation: mean Spearman correlation between seed and
+          finishing order; 1.0 means the rounds sorted the field perfectly
+    """
+    if rounds is None:
+        rounds = calc_tournament_rounds(len(ratings))
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    tasks = []
+    for start in range(0, runs, RUNS_PER_TASK):
+        batch = min(RUNS_PER_TASK, runs - start)
+        tasks.append((list(ratings), rounds, draw_prob, batch, seed + start))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_run_batch, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    firsts = [0] * len(ratings)
+    unique_leaders = 0
+    correlation = 0.0
+    for batch_firsts, batch_unique, batch_correlation in results:
+        firsts = [a + b for a, b in zip(firsts, batch_firsts)]
+        unique_leaders += batch_unique
+        correlation += batch_correlation
+
+    return {
+        'rounds': rounds,
+        'win_probability': [count / float(runs) for count in firsts],
+        'unique_leader_rate': unique_leaders / float(runs),
+        'mean_rank_correlation': correlation / runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo simulation of complete Swiss tournaments.")
+    parser.add_argument('--players', type=int, default=16)
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=None,
+                        help="Swiss rounds (default: calc_tournament_rounds)")
+    parser.add_argument('--draw-prob', type=float, default=0.1)
+    parser.add_argument('--spread', type=float, default=400.0,
+                        help="rating gap between the best and worst player")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    step = args.spread / max(args.players - 1, 1)
+    ratings = [1500 + args.spread / 2 - i * step for i in range(args.players)]
+    summary = simulate(ratings, args.runs, args.rounds, args.draw_prob,
+                       args.processes, args.seed)
+
+    print("{0} tournaments of {1} players, {2} rounds each\n".format(
+        args.runs, args.players, summary['rounds']))
+    print("{0:<12}{1:>8}{2:>10}".format("Player", "Rating", "Win %"))
+    for i, (rating, probability) in enumerate(zip(ratings, summary['win_probability'])):
+        print("{0:<12}{1:>8.0f}{2:>10.1f}".format("Player {0}".format(i + 1), rating,
+                                                  probability * 100))
+    print("\nClear winner in {0:.1f}% of tournaments".format(
+        summary['unique_leader_rate'] * 100))
+    print("Mean seed/finish rank correlation: {0:.3f}".format(
+        summary['mean_rank_correlation']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# statements.py -- server-side prepared statements for tournament.py
+#
+# The small statements run on every call of the hot API functions are
+# PREPAREd the first time a connection runs them and EXECUTEd by name from
+# then on, so PostgreSQL parses and plans each of them once per connection
+# instead of once per call.  Pooled connections live for many calls, which
+# is what makes this pay off.
+#
+# The server re-plans prepared statements by itself when the tables they
+# use change, but refuses to run one whose result columns would change,
+# and a connection reset (DISCARD ALL, a proxy reusing server sessions)
+# drops them.  Either error marks the connection's statements stale: they
+# are all DEALLOCATEd and prepared again on next use, and tournament.py
+# retries the call if it owned the transaction and wasn't given an
+# iterator it may have used up.
+#
+import threading
+import weakref
+
+import psycopg2.errorcodes
+
+
+# Errors meaning a connection's prepared statements are not what the cache
+# thinks they are.
+_STALE_CODES = frozenset([
+    psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME,    # dropped by a reset
+    psycopg2.errorcodes.DUPLICATE_PREPARED_STATEMENT,  # name taken on the connection
+])
+
+
+def is_stale(error):
+    """ True if a database error means prepared statements went stale. """
+    code = getattr(error, 'pgcode', None)
+    if code in _STALE_CODES:
+        return True
+    # "cached plan must not change result type", after a schema change.
+    return (code == psycopg2.errorcodes.FEATURE_NOT_SUPPORTED
+            and 'cached plan' in str(error))
+
+
+def numbered(query):
+    """ A psycopg2 query with its %s placeholders as PREPARE's $1, $2, ... """
+    parts = query.split('%s')
+    text = parts[0]
+    for i, part in enumerate(parts[1:], 1):
+        text += '${0}{1}'.format(i, part)
+    return text.replace('%%', '%')
+
+
+class PreparedStatements(object):
+    """ Tracks which statements each connection has prepared.
+
+    Connections are held weakly, so the bookkeeping goes away with them.
+
+    Args:
+      prefix: prepended to statement names, keeping them apart from any
+        other prepared statements on the same connections.
+    """
+    def __init__(self, prefix='prepared_'):
+        self.prefix = prefix
+        self._prepared = weakref.WeakKeyDictionary()   # conn -> set, or None if stale
+        self._lock = threading.Lock()
+        self._stats = {'prepares': 0, 'executes': 0, 'invalidations': 0}
+
+    def execute(self, cursor, name, query, params=()):
+        """ Run a query as a prepared statement on the cursor's connection.
+
+        Args:
+          cursor: the cursor to run it on.
+          name: the statement's name; one name per query text.
+          query: the SQL, with psycopg2 %s placeholders.
+          params: values for the placeholders.
+        """
+        conn = cursor.connection
+        with self._lock:
+            prepared = self._prepared.get(conn, ())
+            self._stats['executes'] += 1
+        statement = self.prefix + name
+        try:
+            if prepared is None:
+                cursor.execute("DEALLOCATE ALL;")
+                prepared = ()
+            if statement not in prepared:
+                cursor.execute("PREPARE {0} AS {1}".format(statement, numbered(query)))
+                with self._lock:
+                    self._prepared[conn] = set(prepared) | set([statement])
+                    self._stats['prepares'] += 1
+            if params:
+                cursor.execute("EXECUTE {0} ({1});".format(
+                    statement, ", ".join(["%s"] * len(params))), params)
+            else:
+                cursor.execute("EXECUTE {0};".format(statement))
+        except Exception as e:
+            if is_stale(e):
+                self.invalidate(conn)
+            raise
+
+    def invalidate(self, conn):
+        """ Deallocate and re-prepare a connection's statements on next use. """
+        with self._lock:
+            self._prepared[conn] = None
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        """ Snapshot of the prepares, executes and invalidations counters,
+        plus the number of connections with statements prepared. """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['connections'] = len(self._prepared)
+        return stats
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# stress_report.py -- exactly-once check of reportMatch under concurrency
+#
+# Several processes report the results of one large round at once.  Every
+# pairing is reported by more than one process, as retrying clients would,
+# and some reports deliberately disagree with the real result.  Afterwards
+# each pairing must have exactly one match, every process must have been
+# handed the same match id for it, and player_stats must be consistent:
+#
+#   python stress_report.py --players 20000 --processes 8 --duplicates 3
+#
+# WARNING: the stress test deletes everything in the tournament database.
+#
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+import tournament
+from tournament import ResultConflict
+
+
+def result_of(pairing_id, one, two):
+    """ The true (winner, loser, draw) of a pairing, the same in every process. """
+    if two is None:
+        return one, None, False
+    if pairing_id % 10 == 0:
+        return one, two, True
+    if pairing_id % 2:
+        return one, two, False
+    return two, one, False
+
+
+def _init_worker():
+    # Connections inherited from the parent must not be shared.
+    tournament.configure_pool()
+
+
+def _report(task):
+    """ Worker: report a share of the round, then some results wrongly.
+
+    Returns:
+      (pairing_id -> match_id, reports made, conflicts raised, wrong
+      reports accepted)
+    """
+    pairings, conflict_rate, seed = task
+    rng = random.Random(seed)
+    match_ids = {}
+    conflicts = 0
+    accepted_wrong = 0
+    for pairing_id, one, two in pairings:
+        winner, loser, draw = result_of(pairing_id, one, two)
+        match_ids[pairing_id] = tournament.reportMatch(None, winner, loser, draw,
+                                                       pairing_id=pairing_id)
+        if two is not None and rng.random() < conflict_rate:
+            try:
+                tournament.reportMatch(None, loser, winner, not draw, pairing_id=pairing_id)
+                accepted_wrong += 1
+            except ResultConflict:
+                conflicts += 1
+    return match_ids, len(pairings), conflicts, accepted_wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that concurrent, repeated reportMatch calls record "
+                    "each result exactly once.")
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--duplicates', type=int, default=2,
+                        help="processes reporting each pairing")
+    parser.add_argument('--conflict-rate', type=float, default=0.05,
+                        help="share of reports followed by a conflicting one")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tournament.resetDatabase(None)
+    tournament.registerTournament(None)
+    [tournament_id] = [row[0] for row in tournament.getTournaments(None)]
+    player_ids = tournament.registerPlayers(
+        None, ("Player {0}".format(i) for i in range(args.players)))
+    tournament.registerTournamentPlayers(None, tournament_id, player_ids)
+    round_id, _ = tournament.createRound(None, tournament.swissPairings(None, tournament_id),
+                                         tournament_id)
+    pairings = [row[:3] for row in tournament.getPairings(None, round_id)]
+    tournament.get_pool().closeall()
+
+    rng = random.Random(args.seed)
+    shares = [[] for _ in range(args.processes)]
+    for pairing in pairings:
+        for share in rng.sample(range(args.processes), min(args.duplicates, args.processes)):
+            shares[share].append(pairing)
+    for share in shares:
+        rng.shuffle(share)
+    tasks = [(share, args.conflict_rate, args.seed + i) for i, share in enumerate(shares)]
+
+    pool = multiprocessing.Pool(args.processes, _init_worker)
+    start = time.time()
+    try:
+        results = pool.map(_report, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    tournament.configure_pool()
+    failures = []
+    seen = {}
+    reports = conflicts = accepted_wrong = 0
+    for match_ids, share_reports, share_conflicts, share_wrong in results:
+        reports += share_reports
+        conflicts += share_conflicts
+        accepted_wrong += share_wrong
+        for pairing_id, match_id in match_ids.items():
+            if seen.setdefault(pairing_id, match_id) != match_id:
+                failures.append("pairing {0} got matches {1} and {2}".format(
+                    pairing_id, seen[pairing_id], match_id))
+    recorded = tournament.getPairings(None, round_id)
+    missing = [row[0] for row in recorded if row[3] is None]
+    if missing:
+        failures.append("{0} pairings have no result".format(len(missing)))
+    matches = len(tournament.getMatchHistory(None, tournament_id))
+    if matches != len(pairings):
+        failures.append("{0} matches recorded for {1} pairings".format(matches, len(pairings)))
+    if accepted_wrong:
+        failures.append("{0} conflicting results were accepted".format(accepted_wrong))
+    if tournament.verifyPlayerStats(None):
+        failures.append("player_stats disagrees with the matches")
+
+    print("{0} reports of {1} pairings by {2} processes in {3:.2f}s "
+          "({4:.0f} reports/s), {5} conflicts rejected".format(
+              reports, len(pairings), args.processes, elapsed, reports / elapsed, conflicts))
+    for failure in failures:
+        print("FAILED: " + failure)
+    if failures:
+        sys.exit(1)
+    print("Every result was recorded exactly once.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- Buchholz, Sonneborn-Berger and opponents' match-win %
+#
+# Mirrors the update_tiebreaks() SQL function for backends that keep their
+# data in Python.  Uses NumPy when it is installed.
+#
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Opponents' match-win percentages are floored at one third so a winless
+# opponent doesn't count for nothing.
+MIN_MATCH_WIN_PCT = 1.0 / 3
+
+# Decimal places kept for opponents' match-win percentage, so that backends
+# summing in different orders still rank identically.
+PCT_PRECISION = 4
+
+
+def compute_tiebreaks(player_ids, wins, draws, matches, ones, twos, draw_flags):
+    """ Tie-break scores for every player, in one pass over the matches.
+
+    Args:
+      player_ids, wins, draws, matches: per-player sequences, aligned.
+      ones, twos, draw_flags: per-match sequences, aligned.  ones holds the
+        winner (or a drawing player), twos the loser (or the other drawing
+        player, or 0 for a bye), draw_flags is true for draws.
+
+    Returns:
+      (buchholz, sonneborn_berger, opp_match_win_pct): lists aligned with
+      player_ids.
+        buchholz: sum of the opponents' points (1 per win, 1/2 per draw).
+        sonneborn_berger: sum of the points of beaten opponents plus half
+          the points of drawn ones.
+        opp_match_win_pct: average of the opponents' points per match,
+          each floored at MIN_MATCH_WIN_PCT.
+    """
+    if not len(player_ids):
+        return [], [], []
+    if numpy is not None:
+        return _compute_numpy(player_ids, wins, draws, matches, ones, twos, draw_flags)
+    return _compute_python(player_ids, wins, draws, matches, ones, twos, draw_flags)
+
+
+def _compute_numpy(player_ids, wins, draws, matches, ones, twos, draw_flags):
+    n = len(player_ids)
+    ids = numpy.asarray(player_ids, dtype=numpy.int64)
+    points = numpy.asarray(wins, dtype=numpy.float64) + 0.5 * numpy.asarray(draws)
+    played = numpy.asarray(matches, dtype=numpy.float64)
+    win_pct = numpy.maximum(points / numpy.maximum(played, 1), MIN_MATCH_WIN_PCT)
+
+    ones = numpy.asarray(ones, dtype=numpy.int64)
+    twos = numpy.asarray(twos, dtype=numpy.int64)
+    draw_flags = numpy.asarray(draw_flags, dtype=bool)
+    games = twos != 0               # byes have no opponent
+    ones, twos, draw_flags = ones[games], twos[games], draw_flags[games]
+
+    # Map ids to positions; players outside this scope are dropped.
+    order = numpy.argsort(ids)
+    sorted_ids = ids[order]
+    a = numpy.searchsorted(sorted_ids, ones).clip(0, n - 1)
+    b = numpy.searchsorted(sorted_ids, twos).clip(0, n - 1)
+    known = (sorted_ids[a] == ones) & (sorted_ids[b] == twos)
+    a, b, draw_flags = order[a[known]], order[b[known]], draw_flags[known]
+
+    one_result = numpy.where(draw_flags, 0.5, 1.0)
+    two_result = numpy.where(draw_flags, 0.5, 0.0)
+    players = numpy.concatenate([a, b])
+    opponents = numpy.concatenate([b, a])
+    results = numpy.concatenate([one_result, two_result])
+
+    buchholz = numpy.bincount(players, weights=points[opponents], minlength=n)
+    sonneborn_berger = numpy.bincount(players, weights=results * points[opponents],
+                                      minlength=n)
+    pct_sum = numpy.bincount(players, weights=win_pct[opponents], minlength=n)
+    pct_count = numpy.bincount(players, minlength=n)
+    pct = numpy.where(pct_count > 0, pct_sum / numpy.maximum(pct_count, 1), 0.0)
+
+    return (buchholz.tolist(), sonneborn_berger.tolist(),
+            [round(value, PCT_PRECISION) for value in pct.tolist()])
+
+
+def _compute_python(player_ids, wins, draws, matches, ones, twos, draw_flags):
+    n = len(player_ids)
+    slots = dict((player_id, i) for i, player_id in enumerate(player_ids))
+    points = [wins[i] + 0.5 * draws[i] for i in range(n)]
+    win_pct = [max(points[i] / matches[i], MIN_MATCH_WIN_PCT) if matches[i]
+               else MIN_MATCH_WIN_PCT for i in range(n)]
+
+    buchholz = [0.0] * n
+    sonneborn_berger = [0.0] * n
+    pct_sum = [0.0] * n
+    pct_count = [0] * n
+    for one, two, draw in zip(ones, twos, draw_flags):
+        a = slots.get(one)
+        b = slots.get(two)
+        if a is None or b is None:
+            continue
+        buchholz[a] += points[b]
+        buchholz[b] += points[a]
+        if draw:
+            sonneborn_berger[a] += 0.5 * points[b]
+            sonneborn_berger[b] += 0.5 * points[a]
+        else:
+            sonneborn_berger[a] += points[b]
+        pct_sum[a] += win_pct[b]
+        pct_sum[b] += win_pct[a]
+        pct_count[a] += 1
+        pct_count[b] += 1
+
+    pct = [round(pct_sum[i] / pct_count[i], PCT_PRECISION) if pct_count[i] else 0.0
+           for i in range(n)]
+    return buchholz, sonneborn_berger, pct
@@ -2,82 +2,890 @@
 # 
 # tournament.py -- implementation of a Swiss-system tournament
 #
+import collections
+import itertools
+import multiprocessing
+import threading
+import time
+from array import array
+from io import BytesIO
+
 import psycopg2
+import psycopg2.extensions
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+import archive
+import checkpoint
+import feed
+import pairing
+import ratings
+from backend import Backend
+from cache import ALL_SCOPES, StandingsCache, StandingsListener
+from instrument import Instruments
+from pool import ConnectionPool, Transaction
+from statements import PreparedStatements, is_stale
 
 
 DB_NAME = 'tournament'
 
+# Bounds for the connection pool that every API call draws from.
+POOL_MIN_CONN = 1
+POOL_MAX_CONN = 10
+
+# Standings columns and their ranking order (see the total_matches view).
+STANDINGS_COLUMNS = "id, name, wins, losses, draws, matches"
+STANDINGS_TIEBREAK_COLUMNS = STANDINGS_COLUMNS + ", buchholz, sonneborn_berger, opp_match_win_pct"
+STANDINGS_ORDER = ("wins DESC, draws DESC, buchholz DESC, sonneborn_berger DESC, "
+                   "opp_match_win_pct DESC, id")
+
+# Ranking order with players grouped by score, as iterPairings needs them.
+STANDINGS_SCORE_ORDER = "(2 * wins + draws) DESC, " + STANDINGS_ORDER
+
+# Rows fetched per round trip by the streaming functions.
+STREAM_FETCH_SIZE = 2000
+
+# Rows per leaderboard() page.
+LEADERBOARD_PAGE_SIZE = 100
+
+# Columns of player_stats_score_idx after tournament_id, all descending, so
+# that a row comparison on them is a single index seek.  The index ends
+# with player_id ascending, which breaks the remaining ties.
+_SCORE_KEY = ("(2 * s.wins + s.draws)", "s.wins", "s.draws", "s.buchholz",
+              "s.sonneborn_berger", "s.opp_match_win_pct")
+
+# Rows yielded by iterStandings and iterPairings.
+StandingsRow = collections.namedtuple(
+    'StandingsRow', 'id name wins losses draws matches')
+TiebreakStandingsRow = collections.namedtuple(
+    'TiebreakStandingsRow', StandingsRow._fields +
+    ('buchholz', 'sonneborn_berger', 'opp_match_win_pct'))
+Pairing = collections.namedtuple('Pairing', 'id1 name1 id2 name2')
+
+# Rows sent per COPY by the bulk registration/reporting functions.
+BULK_CHUNK_SIZE = 10000
+
+# Defaults for the standings cache; see configure_cache().
+CACHE_MAXSIZE = 1024
+CACHE_TTL = 5.0
+
+# Events held for each feed subscriber; see subscribeStandings().
+FEED_QUEUE_SIZE = 1000
+
+# Seconds subscribeStandings() waits for the feed's connection.
+FEED_LISTEN_TIMEOUT = 10.0
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ResultConflict(ValueError):
+    """ Raised when a pairing's result is reported differently twice. """
+
+
+# Instruments timing every database call; None while instrumentation is off.
+_instruments = None
+
+# Standings cache, and the listener keeping it consistent across processes;
+# None while caching is disabled.
+_cache = None
+_cache_listener = None
+
+# Subscriptions to the live standings feed, and the thread LISTENing for
+# their events; None until the first subscribeStandings() call.
+_feed_hub = feed.FeedHub()
+_feed_listener = None
+_feed_lock = threading.Lock()
+
+# Alternative Backend serving the public API; None means PostgreSQL.
+_backend = None
+
+# What each connection has prepared, kept even while prepared statements
+# are off so that turning them back on doesn't prepare any twice.
+_statements = PreparedStatements()
+_use_prepared_statements = True
+
+
+def set_backend(backend):
+    """ Serve the public API from `backend` (None restores PostgreSQL). """
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    """ The Backend currently serving the public API, or None for PostgreSQL. """
+    return _backend
+
+
+def configure_pool(db_name=DB_NAME, **kwargs):
+    """ (Re)create the connection pool for a database.
+
+    Keyword arguments are passed to ConnectionPool (minconn, maxconn,
+    timeout, health_check_interval, ...).  Any existing pool for the
+    database is closed.
+    """
+    kwargs.setdefault('minconn', POOL_MIN_CONN)
+    kwargs.setdefault('maxconn', POOL_MAX_CONN)
+    pool = ConnectionPool("dbname={0}".format(db_name), **kwargs)
+    with _pools_lock:
+        old_pool = _pools.get(db_name)
+        _pools[db_name] = pool
+    if old_pool is not None:
+        old_pool.closeall()
+    return pool
+
+
+def get_pool(db_name=DB_NAME):
+    """ Return the connection pool for a database, creating it on first use. """
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_name)
+            if pool is None:
+                pool = ConnectionPool("dbname={0}".format(db_name),
+                                      minconn=POOL_MIN_CONN,
+                                      maxconn=POOL_MAX_CONN)
+                _pools[db_name] = pool
+    return pool
+
+
+def poolStats(db_name=DB_NAME):
+    """ Returns the checkout/wait/in-use counters of a database's pool. """
+    return get_pool(db_name).stats()
+
+
+def connect(db_name=DB_NAME):
+    """ Check a connection out of the pool.  Returns a database connection.
+
+    The connection stays with the calling thread until it is handed back
+    with release().
+    """
+    return get_pool(db_name).getconn()
+
+
+def release(db, db_name=DB_NAME):
+    """ Return a connection obtained from connect() to the pool. """
+    get_pool(db_name).putconn(db)
+
+
+def configure_instrumentation(slow_query_threshold=None, explain=True, exporters=()):
+    """ Time every database call and the SQL statements it runs.
+
+    Args:
+      slow_query_threshold: seconds above which a statement is kept (and
+        passed to the exporters) as a slow query; None keeps none.
+      explain: capture the EXPLAIN plan of slow statements.
+      exporters: instrument.Exporter instances receiving every event.
+
+    Returns:
+      The Instruments object aggregating the timings.
+    """
+    global _instruments
+    _instruments = Instruments(slow_query_threshold, explain, exporters)
+    return _instruments
+
+
+def disable_instrumentation():
+    """ Stop timing database calls. """
+    global _instruments
+    _instruments = None
+
+
+def instrumentationStats():
+    """ Returns call/statement histograms and commit/rollback counts (see
+    instrument.Instruments.stats), or None while instrumentation is off. """
+    instruments = _instruments
+    return instruments.stats() if instruments is not None else None
+
+
+def slowQueries():
+    """ Returns the most recent slow statements with their plans, or an
+    empty list while instrumentation is off. """
+    instruments = _instruments
+    return instruments.slow_queries() if instruments is not None else []
+
+
+def configure_cache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, listen=False, db_name=DB_NAME):
+    """ Serve playerStandings from a read-through cache.
+
+    Cached standings are dropped once a write to the same tournament (or to
+    the standings across all matches) commits, and are never served for
+    longer than `ttl` seconds.  Calls inside a transaction bypass the cache
+    so they see their own writes.
+
+    Args:
+      maxsize: standings results kept, least recently used evicted first.
+      ttl: seconds a result may be served for.
+      listen: also invalidate on writes made by other processes, through
+        PostgreSQL LISTEN/NOTIFY.  Every process writing to the database
+        must enable it for the others to stay consistent.
+      db_name: database whose pool notifications are sent through.
+    """
+    global _cache, _cache_listener
+    disable_cache()
+    cache = StandingsCache(maxsize, ttl)
+    if listen:
+        _cache_listener = StandingsListener(cache, "dbname={0}".format(db_name),
+                                            get_pool(db_name))
+    _cache = cache
+    return cache
+
+
+def disable_cache():
+    """ Stop caching standings. """
+    global _cache, _cache_listener
+    listener, _cache_listener = _cache_listener, None
+    _cache = None
+    if listener is not None:
+        listener.close()
+
+
+def cacheStats():
+    """ Returns the hit/miss/eviction counters of the standings cache, or
+    None while caching is disabled. """
+    cache = _cache
+    return cache.stats() if cache is not None else None
+
+
+def configure_prepared_statements():
+    """ Run the hot queries as server-side prepared statements (the default).
+
+    Each pooled connection prepares a statement the first time it runs it
+    and only executes it after that.  Statements invalidated by a schema
+    change or a connection reset are prepared again, and the call retried.
+
+    Returns:
+      The PreparedStatements object tracking them.
+    """
+    global _use_prepared_statements
+    _use_prepared_statements = True
+    return _statements
+
+
+def disable_prepared_statements():
+    """ Send every query as text, e.g. behind a proxy such as PgBouncer in
+    transaction mode, which moves calls between server connections. """
+    global _use_prepared_statements
+    _use_prepared_statements = False
+
+
+def preparedStatementStats():
+    """ Returns the prepare/execute/invalidation counters of the prepared
+    statements, or None while they are off. """
+    return _statements.stats() if _use_prepared_statements else None
+
+
+def disable_feed():
+    """ Stop listening for live standings events; existing subscriptions
+    stop receiving them.  The next subscribeStandings() call listens again. """
+    global _feed_listener
+    with _feed_lock:
+        listener, _feed_listener = _feed_listener, None
+    if listener is not None:
+        listener.close()
+
+
+def _standings_changed(scopes):
+    cache = _cache
+    if cache is None:
+        return
+    cache.invalidate(scopes)
+    listener = _cache_listener
+    if listener is not None:
+        listener.publish(scopes)
+
+
+def _in_transaction(db):
+    return isinstance(db, Transaction) or get_pool().current_transaction() is not None
+
+
+def cached_standings(function):
+    """ Decorator serving a standings read from the cache, if enabled.
+
+    The wrapped function takes (db, tournament_id=None, ...); its result is
+    cached per tournament, function and the remaining arguments.
+    """
+    def decorated_function(db, tournament_id=None, *args, **kwargs):
+        cache = _cache
+        if cache is None or _in_transaction(db):
+            return function(db, tournament_id, *args, **kwargs)
+        key = (function.__name__, args, tuple(sorted(kwargs.items())))
+        results = cache.get(tournament_id, key)
+        if results is None:
+            version = cache.version(tournament_id)
+            results = function(db, tournament_id, *args, **kwargs)
+            cache.put(tournament_id, key, version, results)
+        return list(results)
+
+    decorated_function.__name__ = function.__name__
+    decorated_function.__doc__ = function.__doc__
+
+    return decorated_function
+
+
+def invalidates_standings(scopes):
+    """ Decorator marking a write that changes cached standings.
+
+    Args:
+      scopes: callable taking the wrapped function's arguments (without
+        `db`) and returning the tournament ids whose standings the call
+        changes, with None for the standings across all matches, or
+        [ALL_SCOPES]; nothing is invalidated if it returns [].
+
+    The cache is invalidated once the write has committed: straight after
+    the call, or when the transaction it joined commits.  A call that
+    raises is treated alike, as it may have committed part of its work
+    (see commit_chunks).
+    """
+    def decorator(function):
+        def decorated_function(db, *args, **kwargs):
+            try:
+                return function(db, *args, **kwargs)
+            finally:
+                changed = scopes(*args, **kwargs) if _cache is not None else None
+                if changed:
+                    tx = db if isinstance(db, Transaction) else get_pool().current_transaction()
+                    if tx is not None:
+                        tx.on_commit(lambda: _standings_changed(changed))
+                    else:
+                        _standings_changed(changed)
+
+        decorated_function.__name__ = function.__name__
+        decorated_function.__doc__ = function.__doc__
+
+        return decorated_function
+    return decorator
+
+
+def _announce(c, event):
+    """ Publish a feed event once c's transaction commits, if the feed is on. """
+    c.execute("SELECT pg_notify(%s, %s) WHERE current_setting('tournament.feed') = 'on';",
+              (feed.FEED_CHANNEL, feed.encode(event)))
+
+
+def _quiet_feed(c):
+    """ Stop the matches trigger announcing results for the rest of c's
+    transaction.  Returns the setting it had. """
+    c.execute("SELECT current_setting('tournament.feed');")
+    previous = c.fetchone()[0]
+    c.execute("SELECT set_config('tournament.feed', 'off', true);")
+    return previous
+
+
+def _commit_chunk(c, scopes, quiet=False):
+    """ Commit a chunk of a bulk write (see commit_chunks), announcing a
+    resync of `scopes` with it so subscribers hear of it even if a later
+    chunk fails.
+
+    Args:
+      quiet: the call quietened the feed (see resyncs_feed); its SET LOCAL
+        keeps the announcement off too, so the chunk is committed first and
+        announced in a transaction of its own.
+    """
+    if quiet:
+        c.connection.commit()
+    _announce(c, feed.Resync(scopes))
+    c.connection.commit()
+    if quiet:
+        _quiet_feed(c)
+
+
+def resyncs_feed(scopes, quiet=False):
+    """ Decorator announcing a write on the live standings feed.
+
+    Subscribers to the scopes the call changes read them afresh once it
+    commits.  Goes below transaction_decorator, as it needs the cursor.
+
+    Args:
+      scopes: like invalidates_standings' scopes.
+      quiet: keep the matches trigger from announcing each result the call
+        inserts; for a batch, one resync is much cheaper.
+    """
+    def decorator(sql_function):
+        def decorated_function(c, *args, **kwargs):
+            previous = _quiet_feed(c) if quiet else None
+            retval = sql_function(c, *args, **kwargs)
+            if quiet:
+                c.execute("SELECT set_config('tournament.feed', %s, true);", (previous,))
+            _announce(c, feed.Resync(scopes(*args, **kwargs)))
+            return retval
+
+        decorated_function.__name__ = sql_function.__name__
+        decorated_function.__doc__ = sql_function.__doc__
+        decorated_function.__wrapped__ = getattr(sql_function, '__wrapped__', sql_function)
+
+        return decorated_function
+    return decorator
+
+
+def _every_scope(*args, **kwargs):
+    return [ALL_SCOPES]
+
+
+def _argument_reader(function, name):
+    """ A callable reading argument `name` of a call of `function` from its
+    arguments after `db`, by keyword or by position, else its default.
+
+    Decorators that set __wrapped__ (as transaction_decorator does) are
+    looked through to the signature of the function they wrap.
+    """
+    wrapped = getattr(function, '__wrapped__', function)
+    code = wrapped.__code__
+    names = code.co_varnames[1:code.co_argcount]
+    defaults = wrapped.__defaults__ or ()
+    position = names.index(name)
+    default = defaults[position - (len(names) - len(defaults))]
+
+    def read(args, kwargs):
+        if name in kwargs:
+            return kwargs[name]
+        return args[position] if position < len(args) else default
+    return read
+
+
+def commits_chunks(function):
+    """ Decorator for a bulk write that can commit part way through, when
+    its `commit_chunks` argument is true.
+
+    Such a call is refused inside a transaction it would join: the commits
+    would make the caller's earlier work permanent even if it rolls back,
+    and skip its on_commit() callbacks.
+
+    Raises:
+      ValueError: the call commits its chunks inside a transaction.
+    """
+    committing = _argument_reader(function, 'commit_chunks')
+
+    def decorated_function(db, *args, **kwargs):
+        if committing(args, kwargs) and _in_transaction(db):
+            raise ValueError("commit_chunks can't be used inside a transaction.")
+        return function(db, *args, **kwargs)
+
+    decorated_function.__name__ = function.__name__
+    decorated_function.__doc__ = function.__doc__
+
+    return decorated_function
+
+
+def _totals_scope(*args, **kwargs):
+    return [None]
+
+
+def _tournament_scope(tournament_id=None, *args, **kwargs):
+    return [tournament_id]
+
+
+def _tournament_and_totals_scopes(tournament_id, *args, **kwargs):
+    return [tournament_id, None]
+
+
+def transaction(db_name=DB_NAME):
+    """ Context manager that runs several API calls in one transaction.
+
+    Either pass the yielded Transaction as `db`, or call the API functions
+    from the same thread inside the block; both join the transaction.
+
+        with transaction() as tx:
+            registerPlayer(tx, "Twilight Sparkle")
+            registerPlayer(tx, "Fluttershy")
+    """
+    if _backend is not None:
+        return _backend.transaction()
+    return get_pool(db_name).transaction()
+
+
+def isolated(db_name=DB_NAME):
+    """ Context manager like transaction() that rolls everything back.
+
+    Inside a transaction (including another isolated() block) it rolls
+    back to a savepoint instead, so each test of a suite can start from the
+    same state without deleting anything:
+
+        with isolated():
+            resetDatabase(None)
+            for test in tests:
+                with isolated():
+                    test(None)
+    """
+    if _backend is not None:
+        return _backend.isolated()
+    return get_pool(db_name).isolated()
+
+
+def backend_function(function):
+    """ Decorator letting an alternative Backend serve a public function.
+
+    The call goes to the method of the same name on `db` if it is a Backend,
+    else on the backend chosen with set_backend(), else to `function`.
+    """
+    name = function.__name__
+
+    def decorated_function(db, *args, **kwargs):
+        backend = db if isinstance(db, Backend) else _backend
+        if backend is not None:
+            return getattr(backend, name)(*args, **kwargs)
+        return function(db, *args, **kwargs)
+
+    decorated_function.__name__ = name
+    decorated_function.__doc__ = function.__doc__
+
+    return decorated_function
 
-def connect(db_name):
-    """ Connect to a PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname={0}".format(db_name))
+
+def _replayable(args, kwargs):
+    """ False if an argument is a one-shot iterator (e.g. a generator), which
+    a failed attempt may have used up. """
+    for value in itertools.chain(args, kwargs.values()):
+        try:
+            if iter(value) is value:
+                return False
+        except TypeError:
+            pass
+    return True
+
+
+def _retry_stale(attempt, args, kwargs):
+    """ Run a call that owns its transaction, and run it again if it failed
+    only because prepared statements went stale.  The failed attempt was
+    rolled back, and the statements are prepared afresh the second time.
+    A call given an iterator can't be run again: its error is raised, and
+    the statements are prepared afresh on the next call.
+    """
+    if not _replayable(args, kwargs):
+        return attempt()
+    try:
+        return attempt()
+    except psycopg2.Error as e:
+        if not is_stale(e):
+            raise
+    return attempt()
 
 
 def transaction_decorator(sql_function, commit=True):
-    """ Decorator for handling cursor management on transaction calls. """
+    """ Decorator for handling cursor management on transaction calls.
+
+    The wrapped function receives a cursor in place of `db`:
+      - a Transaction (or one already open on this thread) is joined and
+        left for its owner to commit;
+      - a connection is used as-is and committed after the call;
+      - anything else (e.g. None) borrows a pooled connection for the call.
+
+    While instrumentation is enabled (see configure_instrumentation) the
+    call and every statement it runs are timed.
+    """
+    def run(db, args, kwargs, call):
+        if isinstance(db, Transaction):
+            c = db.cursor()
+            if call is not None:
+                c = call.cursor(c)
+            return sql_function(c, *args, **kwargs)
+
+        pool = get_pool()
+        current = pool.current_transaction()
+        if current is not None:
+            c = current.cursor()
+            if call is not None:
+                c = call.cursor(c)
+            return sql_function(c, *args, **kwargs)
+
+        if db is None or not hasattr(db, 'cursor'):
+            if call is None:
+                def attempt():
+                    with pool.transaction() as tx:
+                        return sql_function(tx.cursor(), *args, **kwargs)
+                return _retry_stale(attempt, args, kwargs)
+            start = time.time()
+
+            def attempt():
+                with pool.transaction() as tx:
+                    call.acquired(start)
+                    return sql_function(call.cursor(tx.cursor()), *args, **kwargs)
+            try:
+                retval = _retry_stale(attempt, args, kwargs)
+            except:
+                call.outcome = 'rollback'
+                raise
+            call.outcome = 'commit'
+            return retval
+
+        def attempt():
+            c = db.cursor()
+            try:
+                retval = sql_function(c if call is None else call.cursor(c), *args, **kwargs)
+                if commit:
+                    db.commit()
+                    if call is not None:
+                        call.outcome = 'commit'
+            except:
+                db.rollback()
+                if call is not None:
+                    call.outcome = 'rollback'
+                raise
+            finally:
+                c.close()
+            return retval
+
+        # Work the caller left uncommitted would be lost by a retry.
+        if commit and (db.get_transaction_status() ==
+                       psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            return _retry_stale(attempt, args, kwargs)
+        return attempt()
+
     def decorated_function(db, *args, **kwargs):
-        # Should already have db connection by now, but this was the only
-        # way I could figure out how to reuse conn between function calls.
-        db = connect(DB_NAME)
-        c = db.cursor()
+        instruments = _instruments
+        if instruments is None:
+            return run(db, args, kwargs, None)
+        call = instruments.call(sql_function.__name__)
         try:
-            retval = sql_function(c, *args, **kwargs)
-            db.commit()
+            retval = run(db, args, kwargs, call)
         except:
-            db.rollback()
+            if call.outcome == 'joined':
+                call.outcome = 'error'
+            call.finish(call.outcome)
             raise
-        finally:
-            db.close()
-
+        call.finish(call.outcome)
         return retval
 
     decorated_function.__name__ = sql_function.__name__
     decorated_function.__doc__ = sql_function.__doc__
+    decorated_function.__wrapped__ = getattr(sql_function, '__wrapped__', sql_function)
 
     return decorated_function
 
 
+def _chunks(iterable, size):
+    """ Yield lists of at most `size` items from any iterable. """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy_value(value):
+    """ Render a value in COPY's text format. """
+    if value is None:
+        return '\\N'
+    if not isinstance(value, _string_types):
+        value = str(value)
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_rows(c, table, columns, rows):
+    """ Stream rows into a table with COPY FROM STDIN. """
+    buf = StringIO()
+    for row in rows:
+        buf.write('\t'.join([_copy_value(value) for value in row]))
+        buf.write('\n')
+    buf.seek(0)
+    c.copy_from(buf, table, columns=columns)
+
+
+# The small statements behind the most frequent calls, by name; _execute
+# runs them as prepared statements.
+_STATEMENTS = {
+    'count_players': "SELECT COUNT(*) AS num FROM players;",
+    'tournament_roster': "SELECT * FROM tournament_roster WHERE tournament_id=(%s);",
+    'standings': "SELECT {0} FROM total_matches;".format(STANDINGS_COLUMNS),
+    'standings_tiebreaks': "SELECT {0} FROM total_matches;".format(
+        STANDINGS_TIEBREAK_COLUMNS),
+    'tournament_standings': "SELECT {0} FROM tournament_standings WHERE tournament_id = (%s) "
+                            "ORDER BY {1};".format(STANDINGS_COLUMNS, STANDINGS_ORDER),
+    'tournament_standings_tiebreaks': "SELECT {0} FROM tournament_standings "
+                                      "WHERE tournament_id = (%s) ORDER BY {1};".format(
+                                          STANDINGS_TIEBREAK_COLUMNS, STANDINGS_ORDER),
+    'player_rank': "SELECT rank FROM player_stats WHERE tournament_id = (%s) "
+                   "AND player_id = (%s);",
+    'lock_pairing': "SELECT p.player_one, p.player_two, r.tournament_id "
+                    "FROM pairings p JOIN rounds r ON r.round_id = p.round_id "
+                    "WHERE p.pairing_id = (%s) FOR UPDATE OF p;",
+    'pairing_match': "SELECT match_id, winner_id, draw_id_one IS NOT NULL FROM matches "
+                     "WHERE pairing_id = (%s);",
+    'insert_draw': "INSERT INTO matches (draw_id_one, draw_id_two, tournament_id, pairing_id) "
+                   "VALUES (%s, %s, %s, %s) RETURNING match_id;",
+    'insert_result': "INSERT INTO matches (winner_id, loser_id, tournament_id, pairing_id) "
+                     "VALUES (%s, %s, %s, %s) RETURNING match_id;",
+    'match_history': "SELECT COALESCE(winner_id, draw_id_one), "
+                     "COALESCE(loser_id, draw_id_two) FROM matches;",
+    'tournament_match_history': "SELECT COALESCE(winner_id, draw_id_one), "
+                                "COALESCE(loser_id, draw_id_two) FROM matches "
+                                "WHERE tournament_id = (%s);",
+    'pairings': "SELECT p.pairing_id, p.player_one, p.player_two, m.match_id "
+                "FROM pairings p LEFT JOIN matches m ON m.pairing_id = p.pairing_id "
+                "WHERE p.round_id = (%s) ORDER BY p.pairing_id;",
+}
+
+
+def _execute(c, name, params=()):
+    """ Run one of _STATEMENTS, prepared unless prepared statements are off. """
+    if _use_prepared_statements:
+        _statements.execute(c, name, _STATEMENTS[name], params)
+    else:
+        c.execute(_STATEMENTS[name], params or None)
+
+
+def _next_ids(c, sequence, count):
+    """ Reserve `count` values from a serial's sequence, in order. """
+    c.execute("SELECT nextval(%s) FROM generate_series(1, %s);", (sequence, count))
+    return [row[0] for row in c.fetchall()]
+
+
+def _reset_ratings(c):
+    """ Put every rating back to its starting value, skipping unrated players. """
+    c.execute("UPDATE players SET rating = %s WHERE rating <> %s;",
+              (ratings.INITIAL_RATING, ratings.INITIAL_RATING))
+
+
+def _delete_totals_checkpoint(c):
+    """ Drop the checkpoint of the rounds outside tournaments, whose
+    standings span every match, after matches were deleted. """
+    c.execute("DELETE FROM checkpoints WHERE round_id IN ("
+              "SELECT round_id FROM rounds WHERE tournament_id IS NULL);")
+
+
+def _zero_player_stats(c, scope_filter=""):
+    """ Reset player_stats counters without rewriting rows already zeroed. """
+    c.execute("UPDATE player_stats SET wins = 0, losses = 0, draws = 0, matches = 0, "
+              "buchholz = 0, sonneborn_berger = 0, opp_match_win_pct = 0, rank = NULL "
+              "WHERE (matches <> 0 OR buchholz <> 0 OR sonneborn_berger <> 0 "
+              "OR opp_match_win_pct <> 0 OR rank IS NOT NULL)" + scope_filter + ";")
+
+
+@backend_function
+@invalidates_standings(_every_scope)
+@transaction_decorator
+@resyncs_feed(_every_scope)
+def resetDatabase(c):
+    """ Empty every table and restart all ids from 1.
+
+    Much faster than the delete functions on large tables: TRUNCATE frees
+    the tables at once instead of deleting (and updating player_stats for)
+    every row, and leaves no dead rows behind.  It locks the tables
+    exclusively until the transaction ends.
+    """
+    c.execute("TRUNCATE matches, checkpoints, pairings, rounds, tournament_roster, "
+              "player_stats, tournaments, players RESTART IDENTITY;")
+
+
+@backend_function
+@invalidates_standings(_every_scope)
 @transaction_decorator
+@resyncs_feed(_every_scope)
 def deleteMatches(c):
     """ Remove all the match records from the database. """
-    c.execute("DELETE FROM matches;")
+    # TRUNCATE skips the per-row player_stats triggers, so the counters are
+    # zeroed in one statement instead.
+    c.execute("TRUNCATE matches, checkpoints;")
+    _zero_player_stats(c)
+    _reset_ratings(c)
     
 
+@backend_function
+@invalidates_standings(_every_scope)
 @transaction_decorator
+@resyncs_feed(_every_scope)
 def deletePlayers(c):
     """ Remove all the player records from the database. """
-    # We've defined a many-to-many relationship between tournament_roster
-    # and players so we must make sure no records exist in the child
-    # table before deleting players.
-    c.execute("DELETE FROM tournament_roster;")
-    c.execute("DELETE FROM players;")
+    c.execute("SELECT EXISTS (SELECT 1 FROM matches);")
+    if c.fetchone()[0]:
+        # Fails on the foreign keys of the remaining matches, as it should.
+        c.execute("DELETE FROM tournament_roster;")
+        c.execute("DELETE FROM pairings;")
+        c.execute("DELETE FROM players;")
+    else:
+        c.execute("TRUNCATE tournament_roster, pairings, player_stats, matches, players;")
+    c.execute("DELETE FROM checkpoints;")
     
 
+@backend_function
+@invalidates_standings(_every_scope)
 @transaction_decorator
+@resyncs_feed(_every_scope)
 def deleteTournaments(c):
     """ Remove all tournaments from the database. """
-    # We've defined a many-to-many relationship between tournament_roster
-    # and tournaments so we must make sure no records exist in the child
-    # table before deleting tournaments.
-    c.execute("DELETE FROM tournament_roster;")
-    c.execute("DELETE FROM tournaments;")
+    c.execute("SELECT EXISTS (SELECT 1 FROM matches WHERE tournament_id IS NULL) "
+              "OR EXISTS (SELECT 1 FROM rounds WHERE tournament_id IS NULL);")
+    if c.fetchone()[0]:
+        # Matches outside any tournament stay, so the totals have to be
+        # maintained match by match as the cascade deletes the rest.  Ratings
+        # keep the deleted matches until recomputeRatings().
+        c.execute("DELETE FROM tournaments;")
+        _delete_totals_checkpoint(c)
+    else:
+        c.execute("TRUNCATE matches, checkpoints, pairings, rounds, tournament_roster, "
+                  "tournaments;")
+        _zero_player_stats(c, " AND tournament_id = 0")
+        _reset_ratings(c)
+    c.execute("DELETE FROM player_stats WHERE tournament_id <> 0;")
     
 
+@backend_function
+@invalidates_standings(_tournament_and_totals_scopes)
 @transaction_decorator
+@resyncs_feed(_tournament_and_totals_scopes)
 def deleteTournament(c, tournament_id):
-    """ Remove a single tournament from the database. """
-    c.execute("DELETE FROM tournaments where tournament_id = (%s);", (tournament_id,))
+    """ Remove a single tournament, its roster, rounds and matches from the database.
+
+    Ratings keep the effect of the deleted matches until recomputeRatings().
+    """
+    # The roster, rounds (with their pairings) and matches go with the
+    # tournament through ON DELETE CASCADE, along indexes.
+    c.execute("DELETE FROM tournaments WHERE tournament_id = (%s);", (tournament_id,))
+    c.execute("DELETE FROM player_stats WHERE tournament_id = (%s);", (tournament_id,))
+    _delete_totals_checkpoint(c)
     
 
+@backend_function
+@invalidates_standings(_every_scope)
+@transaction_decorator
+@resyncs_feed(_every_scope)
+def rebuildPlayerStats(c):
+    """ Recompute the player_stats table from the full match history.
+
+    Checkpoints are dropped, as their tie-breaks may no longer match.
+    """
+    c.execute("SELECT rebuild_player_stats();")
+    c.execute("DELETE FROM checkpoints;")
+
+
+@backend_function
+@transaction_decorator
+def verifyPlayerStats(c):
+    """ Check player_stats against the match history.
+
+    Returns:
+      An empty list if player_stats is consistent, otherwise a list of
+      (source, tournament_id, player_id, wins, losses, draws, matches)
+      tuples, where source is 'expected' for the correct value of a row and
+      'actual' for the stale row that is stored.
+    """
+    c.execute("SELECT * FROM verify_player_stats();")
+    results = c.fetchall()
+
+    return results
+
+
+@backend_function
 @transaction_decorator
 def countPlayers(c):
     """ Returns the number of players currently registered. """
-    c.execute("SELECT COUNT(*) AS num FROM players;")
+    _execute(c, 'count_players')
     player_count = int(c.fetchone()[0])
     
     return player_count
 
 
+@backend_function
 @transaction_decorator
 def getTournaments(c):
     """ Get all tournments registered in the database. """
@@ -86,16 +894,20 @@ def getTournaments(c):
     
     return results
 
+@backend_function
 @transaction_decorator
 def getTournamentRoster(c, tournament_id):
     """ Get the players registered in a specific tournament. """
-    c.execute("SELECT * FROM tournament_roster WHERE tournament_id=(%s);", (tournament_id,))
+    _execute(c, 'tournament_roster', (tournament_id,))
     results = c.fetchall()
     
     return results
 
 
+@backend_function
+@invalidates_standings(_totals_scope)
 @transaction_decorator
+@resyncs_feed(_totals_scope)
 def registerPlayer(c, name):
     """ Adds a player to the tournament database.
   
@@ -106,86 +918,1141 @@ def registerPlayer(c, name):
       name: the player's full name (need not be unique).
     """
     c.execute("INSERT INTO players (name) VALUES (%s);", (name,))
+
+
+@backend_function
+@invalidates_standings(_totals_scope)
+@commits_chunks
+@transaction_decorator
+@resyncs_feed(_totals_scope)
+def registerPlayers(c, names, chunk_size=BULK_CHUNK_SIZE, commit_chunks=False):
+    """ Adds many players at once.
+
+    Names are consumed lazily (any iterable or generator works) and loaded
+    with COPY in chunks of `chunk_size`.  Ids are reserved from the players
+    sequence up front so they can be returned in input order.
+
+    Args:
+      names: iterable of player names.
+      chunk_size: rows per COPY.
+      commit_chunks: commit after every chunk instead of once for the whole
+        batch, so a failure keeps the chunks already loaded.  Not allowed
+        inside a transaction.
+
+    Returns:
+      A list of the new player ids, in the order the names were given.
+    """
+    ids = []
+    for chunk in _chunks(names, chunk_size):
+        chunk_ids = _next_ids(c, 'players_id_seq', len(chunk))
+        _copy_rows(c, 'players', ('id', 'name'), zip(chunk_ids, chunk))
+        ids.extend(chunk_ids)
+        if commit_chunks:
+            _commit_chunk(c, _totals_scope())
+
+    return ids
     
 
+@backend_function
 @transaction_decorator
 def registerTournament(c):
     """ Create a new tournament. """
     c.execute("INSERT INTO tournaments DEFAULT VALUES;")
     
 
+@backend_function
+@cached_standings
 @transaction_decorator
-def playerStandings(c):
+def playerStandings(c, tournament_id=None, tiebreaks=False):
     """ Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a player
-    tied for first place if there is currently a tie.
+    tied for first place if there is currently a tie.  Ties on wins and draws
+    are broken by Buchholz, Sonneborn-Berger and opponents' match-win
+    percentage, as of the last updateTiebreaks() call, then by id.
+
+    Args:
+      tournament_id: only rank the players on this tournament's roster, by
+        the matches reported for that tournament.  By default every player
+        is ranked across all matches.
+      tiebreaks: append the three tie-break columns to each row.
 
     Returns:
-      A list of tuples, each of which contains (id, name, wins, matches):
+      A list of tuples, each of which contains (id, name, wins, losses, draws, matches):
         id: the player's unique id (assigned by the database)
         name: the player's full name (as registered)
         wins: the number of matches the player has won
+        losses: the number of matches the player has lost
+        draws: the number of matches the player has drawn
         matches: the number of matches the player has played
+      followed, with tiebreaks=True, by (buchholz, sonneborn_berger,
+      opp_match_win_pct); see tiebreaks.compute_tiebreaks.
     """
-    c.execute('SELECT * FROM total_matches;')
+    suffix = '_tiebreaks' if tiebreaks else ''
+    if tournament_id is None:
+        _execute(c, 'standings' + suffix)
+    else:
+        _execute(c, 'tournament_standings' + suffix, (tournament_id,))
     results = c.fetchall()
     
     return results
 
 
+@backend_function
+@cached_standings
 @transaction_decorator
-def reportMatch(c, winner, loser, draw=False):
+def leaderboard(c, tournament_id=None, limit=LEADERBOARD_PAGE_SIZE, after=None):
+    """ Returns one page of the standings by score, best first.
+
+    Pages are read by keyset: pass the last row of a page as `after` to get
+    the next one.  Each page is an index range scan of player_stats, so
+    the top `limit` players, page 2 and page 10,000 cost the same in a
+    field of any size.  Rows are ranked like iterStandings(by_score=True):
+    results count as soon as they are reported, tie-breaks as of the last
+    updateTiebreaks() call.
+
+    Args:
+      tournament_id: rank this tournament's roster rather than every player.
+      limit: rows per page.
+      after: the last row of the previous page, or None for the first page.
+
+    Returns:
+      A list of up to `limit` TiebreakStandingsRow named tuples.
+    """
+    select = ("SELECT p.id, p.name, s.wins, s.losses, s.draws, s.matches, s.buchholz, "
+              "s.sonneborn_berger, s.opp_match_win_pct "
+              "FROM player_stats s JOIN players p ON p.id = s.player_id "
+              "WHERE s.tournament_id = %s")
+    if tournament_id is not None:
+        select += (" AND EXISTS (SELECT 1 FROM tournament_roster r "
+                   "WHERE r.tournament_id = s.tournament_id AND r.player_id = s.player_id)")
+    order = " ORDER BY {0} DESC, s.player_id LIMIT %s".format(" DESC, ".join(_SCORE_KEY))
+    scope = tournament_id or 0
+    if after is None:
+        c.execute(select + order + ";", (scope, limit))
+    else:
+        # Players tied with `after` on the whole key come next, by id; then
+        # everyone below it.  Each half is one seek in player_stats_score_idx.
+        row = TiebreakStandingsRow._make(after)
+        key = (2 * row.wins + row.draws, row.wins, row.draws, row.buchholz,
+               row.sonneborn_berger, row.opp_match_win_pct)
+        columns = ", ".join(_SCORE_KEY)
+        values = ", ".join(["%s"] * len(key))
+        c.execute("SELECT * FROM (({0} AND ({1}) = ({2}) AND s.player_id > %s{3}) "
+                  "UNION ALL ({0} AND ({1}) < ({2}){3})) AS page "
+                  "ORDER BY 2 * wins + draws DESC, wins DESC, draws DESC, buchholz DESC, "
+                  "sonneborn_berger DESC, opp_match_win_pct DESC, id "
+                  "LIMIT %s;".format(select, columns, values, order),
+                  (scope,) + key + (row.id, limit, scope) + key + (limit, limit))
+    results = [TiebreakStandingsRow._make(row) for row in c.fetchall()]
+
+    return results
+
+
+@backend_function
+@transaction_decorator
+def playerRank(c, player_id, tournament_id=None):
+    """ Returns a player's place in the standings by score.
+
+    Ranks are stored by updateTiebreaks(), once the tie-breaks they depend
+    on are known, so looking one up is a single index probe however large
+    the field.  Results reported since don't move anyone until the next
+    updateTiebreaks().
+
+    Args:
+      player_id: the player to look up.
+      tournament_id: rank within this tournament rather than overall.
+
+    Returns:
+      The player's rank, from 1, or None if they haven't been ranked yet.
+    """
+    _execute(c, 'player_rank', (tournament_id or 0, player_id))
+    row = c.fetchone()
+
+    return row[0] if row is not None else None
+
+
+_cursor_names = itertools.count(1)
+
+
+@backend_function
+def iterStandings(db, tournament_id=None, fetch_size=STREAM_FETCH_SIZE,
+                  tiebreaks=False, by_score=False):
+    """ Yields the standings one row at a time from a server-side cursor.
+
+    Like playerStandings, but only `fetch_size` rows are held in memory at
+    once, so it suits very large fields.  Without a Transaction (or a
+    connection) to run in, the stream gets a dedicated pooled connection
+    for as long as it is consumed; a shared transaction must not be
+    committed until the stream is exhausted.
+
+    Args:
+      tournament_id: as for playerStandings.
+      fetch_size: rows fetched from the server per round trip.
+      tiebreaks: yield TiebreakStandingsRow rows instead of StandingsRow.
+      by_score: order by score (2 per win, 1 per draw) first, then by the
+        usual ranking; this is the order iterPairings consumes.
+
+    Yields:
+      StandingsRow (or TiebreakStandingsRow) named tuples.
+    """
+    columns = STANDINGS_TIEBREAK_COLUMNS if tiebreaks else STANDINGS_COLUMNS
+    row_type = TiebreakStandingsRow if tiebreaks else StandingsRow
+    order = STANDINGS_SCORE_ORDER if by_score else STANDINGS_ORDER
+    if tournament_id is None:
+        query = "SELECT {0} FROM total_matches ORDER BY {1};".format(columns, order)
+        params = ()
+    else:
+        query = ("SELECT {0} FROM tournament_standings WHERE tournament_id = (%s) "
+                 "ORDER BY {1};".format(columns, order))
+        params = (tournament_id,)
+
+    def stream(conn):
+        c = conn.cursor("standings_{0}".format(next(_cursor_names)))
+        c.itersize = fetch_size
+        try:
+            c.execute(query, params)
+            for row in c:
+                yield row_type._make(row)
+        finally:
+            c.close()
+
+    pool = get_pool()
+    if isinstance(db, Transaction):
+        conn = db.conn
+    elif pool.current_transaction() is not None:
+        conn = pool.current_transaction().conn
+    elif db is not None and hasattr(db, 'cursor'):
+        conn = db
+    else:
+        with pool.dedicated() as conn:
+            for row in stream(conn):
+                yield row
+            conn.commit()
+        return
+    for row in stream(conn):
+        yield row
+
+
+def iterPairings(db, tournament_id=None, fetch_size=STREAM_FETCH_SIZE):
+    """ Yields the next round's pairings as they are produced.
+
+    Streams the standings grouped by score and pairs each score group as
+    soon as it has been read, so only the current group is held in memory
+    besides the match history.  Produces the same pairings as swissPairings.
+
+    Yields:
+      Pairing named tuples of (id1, name1, id2, name2); id2 and name2 are
+      None for a bye.
+    """
+    history = pairing.History(getMatchHistory(db, tournament_id))
+    names = {}
+
+    def groups():
+        rows = iterStandings(db, tournament_id, fetch_size, by_score=True)
+        for _, group in itertools.groupby(rows, key=lambda row: pairing.score(row.wins, row.draws)):
+            group = list(group)
+            for row in group:
+                names[row.id] = row.name
+            yield [row.id for row in group]
+
+    for one, two in pairing.iter_pairings(groups(), history):
+        yield Pairing(one, names.pop(one), two, names.pop(two) if two is not None else None)
+
+
+@backend_function
+def subscribeStandings(db, tournament_id=None, tiebreaks=False, max_queue=FEED_QUEUE_SIZE):
+    """ Follows the standings as results come in, without polling.
+
+    Every result reported is pushed to the subscribers once it commits, as
+    its players' new records, and applied to each subscription's own copy
+    of the standings.  The first call starts a thread LISTENing on a
+    connection of its own, which all the subscriptions of the process
+    share: however many viewers there are, a result costs the database one
+    notification.  Bulk writes make subscribers read the standings afresh,
+    through the pool.
+
+    Writes are only announced while the tournament.feed setting is on, which
+    it isn't by default (see tournament.sql): turn it on for the sessions
+    that write, e.g. with configure_pool(options="-c tournament.feed=on").
+
+        for event, standings in subscribeStandings(None, tournament_id):
+            print standings[0]
+
+    Args:
+      tournament_id: the tournament to follow; by default the standings
+        across all matches.
+      tiebreaks: include the tie-break columns in the standings.
+      max_queue: events held for a slow consumer; if more arrive, they are
+        dropped and the standings read afresh.
+
+    Returns:
+      A feed.Subscription yielding (event, standings) pairs, standings in
+      playerStandings order, and every result committed after it was
+      returned.  Close it to stop receiving events.
+
+    Raises:
+      psycopg2.OperationalError: the feed couldn't LISTEN within
+        FEED_LISTEN_TIMEOUT seconds.
+    """
+    global _feed_listener
+    with _feed_lock:
+        if _feed_listener is None:
+            _feed_listener = feed.FeedListener(_feed_hub, "dbname={0}".format(DB_NAME))
+        listener = _feed_listener
+    if not listener.wait(FEED_LISTEN_TIMEOUT):
+        raise psycopg2.OperationalError("Can't listen for the standings feed.")
+    return feed.Subscription(_feed_hub, tournament_id, _feed_snapshot, max_queue, tiebreaks)
+
+
+def _feed_snapshot(tournament_id):
+    """ A scope's standings and latest round, for a feed resync. """
+    # In a transaction, so the cache is bypassed: it may not have heard of
+    # the write the resync is for yet.
+    with transaction() as tx:
+        rows = playerStandings(tx, tournament_id, tiebreaks=True)
+        c = tx.cursor()
+        c.execute("SELECT MAX(number) FROM rounds WHERE tournament_id IS NOT DISTINCT FROM %s;",
+                  (tournament_id,))
+        return rows, c.fetchone()[0]
+
+
+@backend_function
+@invalidates_standings(_tournament_scope)
+@transaction_decorator
+@resyncs_feed(_tournament_scope)
+def updateTiebreaks(c, tournament_id=None):
+    """ Recompute every player's tie-break scores from the match history.
+
+    Call this once a round is complete; reportMatch does not update them.
+    The tournament's checkpoint, if it has one, is written again with the
+    new tie-breaks.
+
+    Args:
+      tournament_id: update this tournament's standings rather than the
+        standings across all matches.
+    """
+    c.execute("SELECT update_tiebreaks(%s);", (tournament_id or 0,))
+    c.execute("SELECT r.round_id, r.number FROM checkpoints k "
+              "JOIN rounds r ON r.round_id = k.round_id "
+              "WHERE r.tournament_id IS NOT DISTINCT FROM %s;", (tournament_id,))
+    row = c.fetchone()
+    if row is not None:
+        _write_checkpoint(c, tournament_id, *row)
+
+
+@backend_function
+@transaction_decorator
+def playerRatings(c, tournament_id=None):
+    """ Returns the players' Elo ratings, highest first.
+
+    Ratings are updated by every rated result as it is reported (see the
+    rate_match SQL function); byes don't count.
+
+    Args:
+      tournament_id: only include the players on this tournament's roster.
+        Ratings are always across every match.
+
+    Returns:
+      A list of (id, name, rating) tuples, ties in id order.
+    """
+    if tournament_id is None:
+        c.execute("SELECT id, name, rating FROM players ORDER BY rating DESC, id;")
+    else:
+        c.execute("SELECT p.id, p.name, p.rating FROM tournament_roster r "
+                  "JOIN players p ON p.id = r.player_id WHERE r.tournament_id = (%s) "
+                  "ORDER BY p.rating DESC, p.id;", (tournament_id,))
+    results = c.fetchall()
+
+    return results
+
+
+@backend_function
+@transaction_decorator
+def recomputeRatings(c, fetch_size=BULK_CHUNK_SIZE):
+    """ Recompute every rating by replaying the match history in id order.
+
+    Needed after matches are deleted (ratings are only ever applied
+    forwards) or loaded with the triggers disabled.  The history is
+    streamed into arrays and replayed a round at a time by
+    ratings.replay, with NumPy if it is installed; only ratings that
+    change are written back.  Reports wait until it is done.
+
+    Args:
+      fetch_size: matches fetched per round trip.
+
+    Returns:
+      The number of players whose rating changed.
+    """
+    c.execute("LOCK TABLE matches IN SHARE MODE;")
+    c.execute("SELECT id, rating FROM players ORDER BY id;")
+    player_ids = array('l')
+    current = array('d')
+    for player_id, rating in c.fetchall():
+        player_ids.append(player_id)
+        current.append(rating)
+
+    ones, twos, draws = array('l'), array('l'), array('b')
+    history = c.connection.cursor('ratings_{0}'.format(next(_cursor_names)))
+    try:
+        history.execute("SELECT COALESCE(winner_id, draw_id_one), "
+                        "COALESCE(loser_id, draw_id_two, 0), draw_id_one IS NOT NULL "
+                        "FROM matches ORDER BY match_id;")
+        while True:
+            rows = history.fetchmany(fetch_size)
+            if not rows:
+                break
+            for one, two, draw in rows:
+                ones.append(one)
+                twos.append(two)
+                draws.append(draw)
+    finally:
+        history.close()
+
+    replayed = ratings.replay(player_ids, ones, twos, draws)
+    changed = [(player_id, repr(rating))
+               for player_id, rating, old in zip(player_ids, replayed, current)
+               if rating != old]
+    if changed:
+        c.execute("CREATE TEMPORARY TABLE replayed_ratings "
+                  "(id integer PRIMARY KEY, rating double precision) ON COMMIT DROP;")
+        _copy_rows(c, 'replayed_ratings', ('id', 'rating'), changed)
+        c.execute("UPDATE players p SET rating = r.rating FROM replayed_ratings r "
+                  "WHERE p.id = r.id;")
+        c.execute("DROP TABLE replayed_ratings;")
+
+    return len(changed)
+
+
+# The scopes the last reportMatch call on this thread changed: only the
+# call learns a pairing's tournament, and that a replay changed nothing.
+_reported = threading.local()
+
+
+def _report_scopes(winner, loser, draw=False, tournament_id=None, pairing_id=None):
+    scopes, _reported.scopes = getattr(_reported, 'scopes', None), None
+    if scopes is not None:
+        return scopes
+    if pairing_id is not None and tournament_id is None:
+        return [ALL_SCOPES]     # it failed before reading the pairing
+    return [tournament_id, None]
+
+
+def _batch_scopes(results, tournament_id=None, *args, **kwargs):
+    return [tournament_id, None]
+
+
+@backend_function
+@invalidates_standings(_report_scopes)
+@transaction_decorator
+def reportMatch(c, winner, loser, draw=False, tournament_id=None, pairing_id=None):
     """ Records the outcome of a single match between two players.
 
+    Reported against a pairing (see createRound), the call is idempotent:
+    repeating it, e.g. when a client retries after a timeout, returns the
+    match already recorded.  Concurrent reports of the same pairing are
+    serialized by a lock on its row.  Once committed, the result is
+    announced to subscribeStandings() subscribers.
+
     Args:
       winner:  the id number of the player who won
-      loser:  the id number of the player who lost
+      loser:  the id number of the player who lost, or None for a bye
+      draw:  True if the match was drawn
+      tournament_id:  the tournament the match was played in, if any;
+        defaults to the pairing's tournament
+      pairing_id:  the pairing the match was played for, if any
+
+    Returns:
+      The match id.
+
+    Raises:
+      ValueError: the pairing doesn't exist or is between other players.
+      ResultConflict: a different result was already reported for the
+        pairing.
     """
-    if draw:
-        c.execute("INSERT INTO matches (draw_id_one, draw_id_two) VALUES (%s, %s);", (winner, loser,))
-    else:
-        c.execute("INSERT INTO matches (winner_id, loser_id) VALUES (%s, %s);", (winner, loser,)) 
+    _reported.scopes = None
+    if pairing_id is not None:
+        _execute(c, 'lock_pairing', (pairing_id,))
+        row = c.fetchone()
+        if row is None:
+            raise ValueError("Unknown pairing id {0}.".format(pairing_id))
+        if set([winner, loser]) != set(row[:2]):
+            raise ValueError("Pairing {0} is between players {1} and {2}.".format(
+                pairing_id, row[0], row[1]))
+        if tournament_id is None:
+            tournament_id = row[2]
+        _execute(c, 'pairing_match', (pairing_id,))
+        existing = c.fetchone()
+        if existing is not None:
+            match_id, recorded_winner, recorded_draw = existing
+            if bool(draw) != recorded_draw or (not draw and recorded_winner != winner):
+                raise ResultConflict(
+                    "Pairing {0} already has a different result (match {1}).".format(
+                        pairing_id, match_id))
+            _reported.scopes = []
+            return match_id
+
+    _execute(c, 'insert_draw' if draw else 'insert_result',
+             (winner, loser, tournament_id, pairing_id))
+    match_id = c.fetchone()[0]
+    _reported.scopes = [tournament_id, None]
+
+    return match_id
+
+
+@backend_function
+@invalidates_standings(_batch_scopes)
+@commits_chunks
+@transaction_decorator
+@resyncs_feed(_batch_scopes, quiet=True)
+def reportMatches(c, results, tournament_id=None, chunk_size=BULK_CHUNK_SIZE,
+                  commit_chunks=False):
+    """ Records the outcomes of many matches at once.
+
+    Args:
+      results: iterable of (winner, loser) or (winner, loser, draw) tuples,
+        with the same meaning as the reportMatch arguments.
+      tournament_id: the tournament every match was played in, if any.
+      chunk_size: rows per COPY.
+      commit_chunks: commit after every chunk instead of once for the whole
+        batch.  Not allowed inside a transaction.
+
+    Returns:
+      A list of the new match ids, in the order the results were given.
+    """
+    def match_row(match_id, result):
+        winner, loser = result[0], result[1]
+        if len(result) > 2 and result[2]:
+            return (match_id, None, None, winner, loser, tournament_id)
+        return (match_id, winner, loser, None, None, tournament_id)
+
+    ids = []
+    for chunk in _chunks(results, chunk_size):
+        # Held from before the ids are reserved, so that a checkpoint can't
+        # be written between their reservation and their rows.
+        c.execute("LOCK TABLE matches IN ROW EXCLUSIVE MODE;")
+        chunk_ids = _next_ids(c, 'matches_match_id_seq', len(chunk))
+        _copy_rows(c, 'matches',
+                   ('match_id', 'winner_id', 'loser_id', 'draw_id_one', 'draw_id_two',
+                    'tournament_id'),
+                   [match_row(match_id, result) for match_id, result in zip(chunk_ids, chunk)])
+        ids.extend(chunk_ids)
+        if commit_chunks:
+            _commit_chunk(c, _batch_scopes(results, tournament_id), quiet=True)
+
+    return ids
 
  
-def swissPairings(db):
+@backend_function
+@transaction_decorator
+def getMatchHistory(c, tournament_id=None):
+    """ Returns who played whom, for pairing without rematches.
+
+    Args:
+      tournament_id: only include matches of this tournament.
+
+    Returns:
+      A list of (player_one, player_two) tuples, one per match.  player_two
+      is None for a bye.
+    """
+    if tournament_id is None:
+        _execute(c, 'match_history')
+    else:
+        _execute(c, 'tournament_match_history', (tournament_id,))
+    results = c.fetchall()
+
+    return results
+
+
+def swissPairings(db, tournament_id=None, by_rating=False):
     """ Returns a list of pairs of players for the next round of a match.
   
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings.  Players are paired
+    within their score group (a win counts two, a draw one), in standings
+    order, and never with someone they have already played if it can be
+    avoided; see pairing.pair_players.  With an odd number of players the
+    lowest ranked player who hasn't had a bye gets one.  Record it with
+    reportMatch(db, player_id, None).
+
+    Args:
+      tournament_id: pair the players on this tournament's roster, using its
+        standings.  By default every registered player is paired.
+      by_rating: seed each score group by rating (see playerRatings)
+        instead of by standings.
   
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+        id2: the second player's unique id, or None for a bye
+        name2: the second player's name, or None for a bye
+    """
+    standings = playerStandings(db, tournament_id)
+    history = getMatchHistory(db, tournament_id)
+    rated = None
+    if by_rating:
+        rated = dict((row[0], row[2]) for row in playerRatings(db, tournament_id))
+
+    return _pair_standings(standings, history, rated)
+
+
+def _pair_standings(standings, history, rated=None):
+    """ swissPairings' result for the given standings and match history.
+
+    Args:
+      standings: rows as returned by playerStandings.
+      history: rows as returned by getMatchHistory.
+      rated: dict of player id -> rating to seed score groups by, if any.
+    """
+    history = pairing.History(history)
+    names = dict((row[0], row[1]) for row in standings)
+    scores = dict((row[0], pairing.score(row[2], row[4])) for row in standings)
+
+    ranking = [row[0] for row in standings]
+    if rated is not None:
+        # score_groups keeps this order inside each group.
+        ranking.sort(key=lambda player: -rated[player])
+
+    pairs, bye = pairing.pair_players(ranking, scores, history)
+    match_list = [(one, names[one], two, names[two]) for one, two in pairs]
+    if bye is not None:
+        match_list.append((bye, names[bye], None, None))
+
+    return match_list
+
+
+@backend_function
+@transaction_decorator
+def getPairingData(c, tournament_ids):
+    """ Reads what pairing needs for many tournaments at once.
+
+    One query fetches the standings of every tournament and one their
+    match histories, instead of two per tournament.
+
+    Args:
+      tournament_ids: the tournaments to read.
+
+    Returns:
+      A dict of tournament id -> (standings, history) for those that exist,
+      with the rows playerStandings and getMatchHistory would return.
     """
-    def make_matches(standings_iter, match_list=None):
-        """ Given a list of player tuples ranked from most wins to least,
-        return a new list of player tuples of the form:
+    tournament_ids = list(tournament_ids)
+    c.execute("SELECT tournament_id FROM tournaments WHERE tournament_id = ANY (%s);",
+              (tournament_ids,))
+    data = dict((row[0], ([], [])) for row in c.fetchall())
+    if not data:
+        return data
+    c.execute("SELECT tournament_id, {0} FROM tournament_standings "
+              "WHERE tournament_id = ANY (%s) ORDER BY tournament_id, {1};".format(
+                  STANDINGS_COLUMNS, STANDINGS_ORDER), (list(data),))
+    for row in c.fetchall():
+        data[row[0]][0].append(tuple(row[1:]))
+    c.execute("SELECT tournament_id, COALESCE(winner_id, draw_id_one), "
+              "COALESCE(loser_id, draw_id_two) FROM matches "
+              "WHERE tournament_id = ANY (%s);", (list(data),))
+    for row in c.fetchall():
+        data[row[0]][1].append(tuple(row[1:]))
 
-        [(p_one id, p_one name, p_two id, p_two name), ...]
+    return data
 
-        Each tuple represents a new match.
+
+def _pair_tournament(task):
+    """ pairAll worker: (tournament_id, standings, history) -> (tournament_id,
+    pairings, error), with error None on success. """
+    tournament_id, standings, history = task
+    try:
+        return tournament_id, _pair_standings(standings, history), None
+    except Exception as e:
+        return tournament_id, None, e
+
+
+def pairAll(db, tournament_ids, processes=None):
+    """ Pairs the next round of many tournaments at once.
+
+    The standings and histories of every tournament are read in one go
+    (see getPairingData), then the tournaments are paired by a pool of
+    worker processes.  Pairing is CPU bound and the tournaments are
+    independent, so with many events it speeds up with the number of
+    cores.  An event that fails to pair doesn't affect the others.
+
+    Args:
+      tournament_ids: the tournaments to pair.
+      processes: worker processes, one per CPU by default.  With 1, or a
+        single tournament, everything runs in this process.
+
+    Returns:
+      (pairings, errors): pairings maps the id of each tournament paired to
+      what swissPairings would return for it; errors maps the id of each
+      other tournament to the exception that stopped it.
+    """
+    tournament_ids = list(collections.OrderedDict.fromkeys(tournament_ids))
+    data = getPairingData(db, tournament_ids)
+    tasks = [(tournament_id,) + tuple(data[tournament_id])
+             for tournament_id in tournament_ids if tournament_id in data]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+    if processes <= 1:
+        results = [_pair_tournament(task) for task in tasks]
+    else:
+        workers = multiprocessing.Pool(processes)
+        try:
+            # Small chunks keep the workers evenly loaded when events differ
+            # in size.
+            chunk_size = max(1, len(tasks) // (processes * 4))
+            results = list(workers.imap_unordered(_pair_tournament, tasks, chunk_size))
+        finally:
+            workers.close()
+            workers.join()
+
+    pairings = {}
+    errors = dict((tournament_id,
+                   ValueError("Unknown tournament id {0}.".format(tournament_id)))
+                  for tournament_id in tournament_ids if tournament_id not in data)
+    for tournament_id, result, error in results:
+        if error is None:
+            pairings[tournament_id] = result
+        else:
+            errors[tournament_id] = error
+
+    return pairings, errors
+
+
+def _paired_ids(row):
+    """ The players of a swissPairings row or of a (player_one, player_two) pair. """
+    return (row[0], row[2]) if len(row) == 4 else (row[0], row[1])
+
+
+@backend_function
+@transaction_decorator
+def createRound(c, pairings, tournament_id=None, checkpoint=False):
+    """ Records the pairings of a new round.
+
+    Rounds are numbered 1, 2, ... within their tournament.  Report each
+    result with reportMatch(..., pairing_id=...) to make it idempotent.
+
+    Args:
+      pairings: the round's pairings, as returned by swissPairings, or
+        (player_one, player_two) pairs as the schedules.py generators
+        yield them.
+      tournament_id: the tournament the round belongs to, if any.
+      checkpoint: also store a checkpoint of the tournament as of the new
+        round, in the same transaction; see checkpointRound.
+
+    Returns:
+      (round_id, pairing_ids), with pairing_ids in the order of `pairings`.
+    """
+    c.execute("INSERT INTO rounds (tournament_id, number) "
+              "SELECT %s, COALESCE(MAX(number), 0) + 1 FROM rounds "
+              "WHERE tournament_id IS NOT DISTINCT FROM %s RETURNING round_id, number;",
+              (tournament_id, tournament_id))
+    round_id, number = c.fetchone()
+    _announce(c, feed.Round(tournament_id, number))
+    pairings = list(pairings)
+    pairing_ids = []
+    if pairings:
+        pairing_ids = _next_ids(c, 'pairings_pairing_id_seq', len(pairings))
+        _copy_rows(c, 'pairings', ('pairing_id', 'round_id', 'player_one', 'player_two'),
+                   [(pairing_id, round_id) + _paired_ids(row)
+                    for pairing_id, row in zip(pairing_ids, pairings)])
+    if checkpoint:
+        _write_checkpoint(c, tournament_id, round_id, number)
+
+    return round_id, pairing_ids
+
+
+@backend_function
+@transaction_decorator
+def getPairings(c, round_id):
+    """ Returns a round's pairings and their results.
+
+    Returns:
+      A list of (pairing_id, player_one, player_two, match_id) tuples in
+      board order; player_two is None for a bye and match_id is None until
+      the result is reported.
+    """
+    _execute(c, 'pairings', (round_id,))
+    results = c.fetchall()
+
+    return results
+
+
+def _read_checkpoint(c, tournament_id, round_id, number):
+    """ A Checkpoint of a scope as it is now, for its round `round_id`.
+
+    Results wait until the transaction ends, so that every match up to the
+    checkpoint's last_match_id is in it: reportMatch and reportMatches take
+    their lock on matches before they reserve an id.
+    """
+    c.execute("LOCK TABLE matches IN SHARE MODE;")
+    c.execute("SELECT COALESCE(MAX(match_id), 0) FROM matches;")
+    last_match_id = c.fetchone()[0]
+    if tournament_id is None:
+        _execute(c, 'standings_tiebreaks')
+        standings = c.fetchall()
+        _execute(c, 'match_history')
+    else:
+        _execute(c, 'tournament_standings_tiebreaks', (tournament_id,))
+        standings = c.fetchall()
+        _execute(c, 'tournament_match_history', (tournament_id,))
+    history = c.fetchall()
+    _execute(c, 'pairings', (round_id,))
+    return checkpoint.Checkpoint.from_rows(tournament_id, round_id, number, last_match_id,
+                                           standings, history, c.fetchall())
+
+
+def _write_checkpoint(c, tournament_id, round_id, number):
+    """ Store a scope's checkpoint for a round, replacing its older ones. """
+    data = _read_checkpoint(c, tournament_id, round_id, number).encode()
+    c.execute("DELETE FROM checkpoints WHERE round_id IN ("
+              "SELECT round_id FROM rounds WHERE tournament_id IS NOT DISTINCT FROM %s);",
+              (tournament_id,))
+    c.execute("INSERT INTO checkpoints (round_id, snapshot) VALUES (%s, %s);",
+              (round_id, psycopg2.Binary(data)))
+
+
+def _latest_round(c, tournament_id):
+    c.execute("SELECT round_id, number FROM rounds "
+              "WHERE tournament_id IS NOT DISTINCT FROM %s ORDER BY number DESC LIMIT 1;",
+              (tournament_id,))
+    return c.fetchone()
+
+
+@backend_function
+@transaction_decorator
+def checkpointRound(c, tournament_id=None):
+    """ Stores a checkpoint of a tournament as of its latest round.
+
+    The checkpoint is a compressed snapshot of the standings (with
+    tie-breaks), who has played whom, and the round's pairings; see
+    checkpoint.py.  It replaces the tournament's previous one, and is
+    written in one transaction, so a crash leaves either checkpoint whole.
+    Results wait while it is read.
+
+    Args:
+      tournament_id: the tournament, or None for rounds outside tournaments.
+
+    Returns:
+      The round's id.
+
+    Raises:
+      ValueError: the tournament has no rounds.
+    """
+    row = _latest_round(c, tournament_id)
+    if row is None:
+        raise ValueError("Tournament {0} has no rounds.".format(tournament_id))
+    _write_checkpoint(c, tournament_id, *row)
+
+    return row[0]
+
+
+@backend_function
+@transaction_decorator
+def resumeTournament(c, tournament_id=None):
+    """ Returns a tournament's state for a coordinator restarting mid-event.
+
+    Reads the tournament's checkpoint and applies the matches reported
+    since, which takes milliseconds even for 100,000 players, where reading
+    the standings and match history takes seconds.  If players were
+    registered or a round created since the checkpoint, the state is read
+    afresh instead.
+
+        state = resumeTournament(db, tournament_id)
+        for pairing_id, one, two, match_id in state.pairings:
+            ...  # the round's results still outstanding have match_id None
+
+    Args:
+      tournament_id: the tournament, or None for rounds outside tournaments.
+
+    Returns:
+      A checkpoint.Checkpoint, whose standings(), history() and
+      swiss_pairings() stand in for playerStandings, getMatchHistory and
+      swissPairings, or None if the tournament has no checkpoint.
+    """
+    c.execute("SELECT k.snapshot FROM checkpoints k JOIN rounds r ON r.round_id = k.round_id "
+              "WHERE r.tournament_id IS NOT DISTINCT FROM %s;", (tournament_id,))
+    row = c.fetchone()
+    if row is None:
+        return None
+    state = checkpoint.decode(row[0])
+    query = ("SELECT match_id, COALESCE(winner_id, draw_id_one), "
+             "COALESCE(loser_id, draw_id_two), draw_id_one IS NOT NULL, pairing_id "
+             "FROM matches WHERE match_id > %s")
+    if tournament_id is None:
+        c.execute("SELECT COUNT(*) FROM player_stats WHERE tournament_id = 0;")
+        player_count = c.fetchone()[0]
+        c.execute(query + " ORDER BY match_id;", (state.last_match_id,))
+    else:
+        c.execute("SELECT COUNT(*) FROM tournament_roster WHERE tournament_id = %s;",
+                  (tournament_id,))
+        player_count = c.fetchone()[0]
+        c.execute(query + " AND tournament_id = %s ORDER BY match_id;",
+                  (state.last_match_id, tournament_id))
+    matches = c.fetchall()
+    round_id, number = _latest_round(c, tournament_id)
+    if not checkpoint.catch_up(state, player_count, number, matches):
+        state = _read_checkpoint(c, tournament_id, round_id, number)
+
+    return state
+
+
+class IncrementalRound(object):
+    """ Reports a round's results and pairs the next round as they come in.
+
+    Score groups at the top of the field are paired as soon as no result
+    still outstanding can change them, so finished players needn't wait for
+    the slowest table.  The pairings released are the ones swissPairings
+    would return once the round is complete, as long as tie-breaks are not
+    updated in between.  Create it before reporting any of the round's
+    results, and report them all through it.
+
+        current = IncrementalRound(db, swissPairings(db, tournament_id), tournament_id)
+        for row in current.report(winner, loser):
+            ...  # seat the next round's (id1, name1, id2, name2) pairing
+
+    Args:
+      db: as for the other API functions.
+      round_pairings: the round's pairings, as returned by swissPairings.
+      tournament_id: the tournament being played, if any.
+    """
+    def __init__(self, db, round_pairings, tournament_id=None):
+        self.db = db
+        self.tournament_id = tournament_id
+        standings = playerStandings(db, tournament_id, tiebreaks=True)
+        history = pairing.History(getMatchHistory(db, tournament_id))
+        self._names = dict((row[0], row[1]) for row in standings)
+        ranking = [(row[0], row[2], row[4], (-row[6], -row[7], -row[8], row[0]))
+                   for row in standings]
+        self._pairer = pairing.IncrementalPairer(
+            ranking, [(row[0], row[2]) for row in round_pairings], history)
+        self.pairings = self._rows(self._pairer.released)
+
+    @property
+    def complete(self):
+        """ True once every pairing of the next round has been released. """
+        return self._pairer.complete
+
+    def _rows(self, pairs):
+        names = self._names
+        return [(one, names[one], two, names[two] if two is not None else None)
+                for one, two in pairs]
+
+    def report(self, winner, loser=None, draw=False):
+        """ Record an outstanding match, as reportMatch does.
+
+        Returns:
+          The next round's pairings this result released, as
+          (id1, name1, id2, name2) tuples; see swissPairings.  They are also
+          collected in `pairings`.
         """
-        if match_list is None:
-            match_list = []    
-        for player in standings_iter:
-            # Store info for next two players in rankings
-            p_one, p_two = player, standings_iter.next()
-            match_list.append((p_one[0], p_one[1], p_two[0], p_two[1]))
-
-        return match_list
-              
-    standings = (player for player in playerStandings(db))
-    
-    return make_matches(standings)
+        if not self._pairer.expects(winner, loser):
+            raise ValueError(
+                "No outstanding match between {0} and {1}.".format(winner, loser))
+        reportMatch(self.db, winner, loser, draw, self.tournament_id)
+        self._pairer.report(winner, loser, draw)
+        rows = self._rows(self._pairer.released[len(self.pairings):])
+        self.pairings.extend(rows)
+        return rows
 
 
+@backend_function
+@invalidates_standings(_tournament_scope)
 @transaction_decorator
+@resyncs_feed(_tournament_scope)
 def registerTournamentPlayer(c, tournament_id, player_id):
     """ Register a player in a specific tournament. """
     c.execute("INSERT INTO tournament_roster (tournament_id, player_id) VALUES (%s, %s);", (tournament_id, player_id))
+
+
+@backend_function
+@invalidates_standings(_tournament_scope)
+@commits_chunks
+@transaction_decorator
+@resyncs_feed(_tournament_scope)
+def registerTournamentPlayers(c, tournament_id, player_ids,
+                              chunk_size=BULK_CHUNK_SIZE, commit_chunks=False):
+    """ Register many players in a specific tournament.
+
+    Returns:
+      The number of roster rows written.
+    """
+    count = 0
+    for chunk in _chunks(player_ids, chunk_size):
+        _copy_rows(c, 'tournament_roster', ('tournament_id', 'player_id'),
+                   [(tournament_id, player_id) for player_id in chunk])
+        count += len(chunk)
+        if commit_chunks:
+            _commit_chunk(c, _tournament_scope(tournament_id))
+
+    return count
+
+
+# What exportTournament reads into each archive table, in archive.SCHEMA's
+# column order; every query takes the tournament id once per %s.
+_ARCHIVE_QUERIES = {
+    'players': "SELECT id, name FROM players WHERE id IN ("
+               "SELECT player_id FROM tournament_roster WHERE tournament_id = %s "
+               "UNION SELECT player_id FROM match_results WHERE tournament_id = %s) "
+               "ORDER BY id;",
+    'roster': "SELECT player_id FROM tournament_roster "
+              "WHERE tournament_id = %s AND player_id IS NOT NULL ORDER BY player_id;",
+    'rounds': "SELECT round_id, number FROM rounds WHERE tournament_id = %s "
+              "ORDER BY round_id;",
+    'pairings': "SELECT p.pairing_id, p.round_id, p.player_one, COALESCE(p.player_two, 0) "
+                "FROM rounds r JOIN pairings p ON p.round_id = r.round_id "
+                "WHERE r.tournament_id = %s ORDER BY p.pairing_id;",
+    'matches': "SELECT match_id, COALESCE(winner_id, draw_id_one), "
+               "COALESCE(loser_id, draw_id_two, 0), draw_id_one IS NOT NULL, "
+               "COALESCE(pairing_id, 0) FROM matches WHERE tournament_id = %s "
+               "ORDER BY match_id;",
+}
+
+
+@backend_function
+@transaction_decorator
+def exportTournament(c, tournament_id, path, fetch_size=BULK_CHUNK_SIZE):
+    """ Writes a tournament to an archive file (see archive.py).
+
+    The archive holds the tournament's roster, rounds, pairings and matches
+    and the players in them.  Every table is streamed through a server-side
+    cursor into compact arrays, so client memory stays at a few bytes per
+    row.  Results and new rounds wait until the export is done, so the
+    archive is consistent.
+
+    Args:
+      tournament_id: the tournament to export.
+      path: the file to write; replaced atomically.
+      fetch_size: rows fetched per round trip.
+
+    Returns:
+      A dict of archive table name -> rows written.
+
+    Raises:
+      ValueError: there is no such tournament.
+    """
+    c.execute("SELECT 1 FROM tournaments WHERE tournament_id = (%s);", (tournament_id,))
+    if c.fetchone() is None:
+        raise ValueError("Unknown tournament id {0}.".format(tournament_id))
+    c.execute("LOCK TABLE tournament_roster, rounds, pairings, matches IN SHARE MODE;")
+    tables = {}
+    for table in archive.SCHEMA:
+        query = _ARCHIVE_QUERIES[table]
+        columns = archive.new_table(table)
+        rows = c.connection.cursor('archive_{0}'.format(next(_cursor_names)))
+        try:
+            rows.execute(query, (tournament_id,) * query.count('%s'))
+            while True:
+                chunk = rows.fetchmany(fetch_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    for column, value in zip(columns.values(), row):
+                        column.append(value)
+        finally:
+            rows.close()
+        tables[table] = columns
+    archive.write_archive(path, tables)
+
+    return dict((table, len(list(columns.values())[0]))
+                for table, columns in tables.items())
+
+
+def _copy_columns(c, table, columns, values):
+    """ Load aligned integer columns into a table with COPY; 0 is NULL.
+
+    Uses COPY's binary format when NumPy is installed.
+    """
+    if not len(values[0]):
+        return
+    if archive.numpy is not None:
+        c.copy_expert("COPY {0} ({1}) FROM STDIN WITH (FORMAT binary);".format(
+            table, ", ".join(columns)), BytesIO(archive.binary_copy(values)))
+    else:
+        _copy_rows(c, table, columns, ([value or None for value in row]
+                                       for row in zip(*values)))
+
+
+@backend_function
+@invalidates_standings(_totals_scope)
+@transaction_decorator
+@resyncs_feed(_totals_scope)
+def importTournament(c, path):
+    """ Loads a tournament from an archive written by exportTournament.
+
+    The tournament and everything in it get new ids, so an archive can be
+    loaded into another database or next to the tournament it came from.
+    Its players are added as new players, rated by replaying the
+    archive's matches in order.  Rows go in with COPY while the per-row
+    triggers are switched off (see bulk_loading() in tournament.sql); the
+    standings are then computed in one statement and the tie-breaks
+    updated.
+
+    Args:
+      path: an archive file.
+
+    Returns:
+      The new tournament's id.
+
+    Raises:
+      ValueError: the file isn't an archive, or refers to rows it lacks.
+    """
+    with archive.Archive(path) as source:
+        players = source.table('players')
+        roster = source.table('roster')
+        rounds = source.table('rounds')
+        pairings = source.table('pairings')
+        matches = source.table('matches')
+
+        c.execute("INSERT INTO tournaments DEFAULT VALUES RETURNING tournament_id;")
+        tournament_id = c.fetchone()[0]
+        player_ids = _next_ids(c, 'players_id_seq', len(players['id']))
+        round_ids = _next_ids(c, 'rounds_round_id_seq', len(rounds['round_id']))
+        pairing_ids = _next_ids(c, 'pairings_pairing_id_seq', len(pairings['pairing_id']))
+        c.execute("LOCK TABLE matches IN ROW EXCLUSIVE MODE;")   # see reportMatches
+        match_ids = _next_ids(c, 'matches_match_id_seq', len(matches['match_id']))
+
+        def player(column):
+            return archive.remap(column, players['id'], player_ids)
+
+        ones, twos = player(matches['one']), player(matches['two'])
+        rated = ratings.replay(player_ids, ones, twos, matches['draw'])
+
+        c.execute("SET LOCAL tournament.bulk_load = 'on';")
+        _copy_rows(c, 'players', ('id', 'name', 'rating'),
+                   [(player_id, name, repr(rating))
+                    for player_id, name, rating in zip(player_ids, players['name'], rated)])
+        _copy_columns(c, 'tournament_roster', ('tournament_id', 'player_id'),
+                      [[tournament_id] * len(roster['player_id']), player(roster['player_id'])])
+        _copy_columns(c, 'rounds', ('round_id', 'tournament_id', 'number'),
+                      [round_ids, [tournament_id] * len(round_ids), rounds['number']])
+        _copy_columns(c, 'pairings', ('pairing_id', 'round_id', 'player_one', 'player_two'),
+                      [pairing_ids, archive.remap(pairings['round_id'], rounds['round_id'], round_ids),
+                       player(pairings['player_one']), player(pairings['player_two'])])
+        _copy_columns(c, 'matches', ('match_id', 'winner_id', 'loser_id', 'draw_id_one',
+                                     'draw_id_two', 'tournament_id', 'pairing_id'),
+                      [match_ids] + list(archive.split_results(ones, twos, matches['draw'])) +
+                      [[tournament_id] * len(match_ids),
+                       archive.remap(matches['pairing_id'], pairings['pairing_id'], pairing_ids)])
+        c.execute("SET LOCAL tournament.bulk_load = 'off';")
+
+    # Every imported player is new, so their totals are their results here.
+    c.execute("INSERT INTO player_stats (tournament_id, player_id, wins, losses, draws, matches) "
+              "SELECT scope, player_id, SUM(wins), SUM(losses), SUM(draws), "
+              "SUM(wins + losses + draws) FROM ("
+              "SELECT 0 AS scope, unnest(%s::integer[]) AS player_id, "
+              "0 AS wins, 0 AS losses, 0 AS draws "
+              "UNION ALL SELECT %s, player_id, 0, 0, 0 FROM tournament_roster "
+              "WHERE tournament_id = %s "
+              "UNION ALL SELECT scopes.scope, player_id, wins, losses, draws "
+              "FROM match_results CROSS JOIN (VALUES (0), (%s)) AS scopes (scope) "
+              "WHERE tournament_id = %s) AS results "
+              "GROUP BY scope, player_id;",
+              (player_ids, tournament_id, tournament_id, tournament_id, tournament_id))
+    c.execute("SELECT update_tiebreaks(%s);", (tournament_id,))
+    c.execute("UPDATE player_stats z SET buchholz = s.buchholz, "
+              "sonneborn_berger = s.sonneborn_berger, opp_match_win_pct = s.opp_match_win_pct "
+              "FROM player_stats s WHERE s.tournament_id = %s "
+              "AND z.tournament_id = 0 AND z.player_id = s.player_id;", (tournament_id,))
+
+    return tournament_id
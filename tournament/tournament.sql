@@ -12,63 +12,429 @@ DROP DATABASE IF EXISTS tournament;
 CREATE DATABASE tournament;
 \c tournament
 
+-- importTournament sets this to 'on' (with SET LOCAL) while it loads rows
+-- with COPY; the per-row triggers below then do nothing, and it fills in
+-- player_stats and ratings itself.  Custom settings can only be read once
+-- set, so every session starts with it off.
+ALTER DATABASE tournament SET tournament.bulk_load = 'off';
+
+-- Whether writes are announced on the live standings feed (see
+-- feed_result() below).  Off by default: a NOTIFY serializes commits on
+-- the server's notification queue, which only pays off with subscribers.
+-- Deployments serving subscribeStandings turn it on for every session,
+--     ALTER DATABASE tournament SET tournament.feed = 'on';
+-- or for the writers of one process, with configure_pool(options=
+-- "-c tournament.feed=on").  reportMatches turns it off with SET LOCAL and
+-- announces one resync for the whole batch instead.
+ALTER DATABASE tournament SET tournament.feed = 'off';
+
 -- Create tables
 CREATE TABLE players (
 	id serial PRIMARY KEY,
-	name text);
+	name text,
+	-- Elo rating, kept current by the matches_rating trigger below.
+	rating double precision NOT NULL DEFAULT 1500);
 
 CREATE TABLE tournaments (
 	tournament_id serial PRIMARY KEY);
 
+-- Rows that belong to a tournament are deleted along with it (see
+-- deleteTournament); every cascade follows an index.
 CREATE TABLE tournament_roster (
-	tournament_id integer REFERENCES tournaments (tournament_id) ON UPDATE CASCADE DEFAULT NULL,
+	tournament_id integer REFERENCES tournaments (tournament_id)
+		ON UPDATE CASCADE ON DELETE CASCADE DEFAULT NULL,
 	player_id integer REFERENCES players (id) ON UPDATE CASCADE);
 
+-- A round is numbered within its tournament; each of its pairings gets an
+-- id that the result is reported against.
+CREATE TABLE rounds (
+	round_id serial PRIMARY KEY,
+	tournament_id integer REFERENCES tournaments (tournament_id) ON DELETE CASCADE,
+	number integer NOT NULL,
+	UNIQUE (tournament_id, number));
+
+CREATE TABLE pairings (
+	pairing_id serial PRIMARY KEY,
+	round_id integer NOT NULL REFERENCES rounds (round_id) ON DELETE CASCADE,
+	player_one integer NOT NULL REFERENCES players (id),
+	player_two integer REFERENCES players (id));	-- NULL for a bye
+
 CREATE TABLE matches (
 	match_id serial PRIMARY KEY,
 	winner_id integer REFERENCES players (id),
 	loser_id integer REFERENCES players (id),
 	draw_id_one integer REFERENCES players (id),
 	draw_id_two integer REFERENCES players (id),
-	tournament_id integer REFERENCES tournaments (tournament_id));
-
-CREATE OR REPLACE VIEW games_won AS (
-    SELECT players.id, players.name, 
-    COUNT(matches.match_id) AS wins
-    FROM players
-    LEFT JOIN matches
-    ON players.id = matches.winner_id
-    GROUP BY players.id);
-
-CREATE OR REPLACE VIEW games_lost AS (
-	SELECT players.id, players.name,
-    COUNT(matches.match_id) AS losses
-    FROM players
-    LEFT JOIN matches
-    ON players.id = matches.loser_id
-    GROUP BY players.id);
-
-CREATE OR REPLACE VIEW games_draw AS (
-    SELECT players.id, players.name,
-    COUNT(matches.match_id) AS draws
-    FROM players
-    LEFT JOIN matches
-    ON players.id = matches.draw_id_one
-    OR players.id = matches.draw_id_two
-    GROUP BY players.id);
+	tournament_id integer REFERENCES tournaments (tournament_id) ON DELETE CASCADE,
+	-- At most one result per pairing, however often it is reported.
+	pairing_id integer UNIQUE REFERENCES pairings (pairing_id));
+
+-- Indexes for tournament-scoped lookups.
+CREATE UNIQUE INDEX tournament_roster_idx ON tournament_roster (tournament_id, player_id);
+CREATE INDEX tournament_roster_player_idx ON tournament_roster (player_id);
+CREATE INDEX matches_winner_idx ON matches (tournament_id, winner_id);
+CREATE INDEX matches_loser_idx ON matches (tournament_id, loser_id);
+CREATE INDEX matches_draw_one_idx ON matches (tournament_id, draw_id_one);
+CREATE INDEX matches_draw_two_idx ON matches (tournament_id, draw_id_two);
+CREATE INDEX pairings_round_idx ON pairings (round_id);
+
+-- A snapshot of a round's tournament (see checkpoint.py), from which a
+-- restarted coordinator resumes without reading the match history back.
+-- Only the latest round of each tournament keeps one.
+CREATE TABLE checkpoints (
+	round_id integer PRIMARY KEY REFERENCES rounds (round_id) ON DELETE CASCADE,
+	created timestamp NOT NULL DEFAULT now(),
+	snapshot bytea NOT NULL);
+
+-- Running win/loss/draw totals per player.  Rows with tournament_id 0 hold
+-- each player's totals across every match; other rows are scoped to one
+-- tournament.  Kept current by the triggers below, so standings reads never
+-- have to scan matches.
+CREATE TABLE player_stats (
+	tournament_id integer NOT NULL,
+	player_id integer REFERENCES players (id) ON DELETE CASCADE,
+	wins integer NOT NULL DEFAULT 0,
+	losses integer NOT NULL DEFAULT 0,
+	draws integer NOT NULL DEFAULT 0,
+	matches integer NOT NULL DEFAULT 0,
+	-- Tie-breaks, refreshed by update_tiebreaks() after each round.
+	buchholz double precision NOT NULL DEFAULT 0,
+	sonneborn_berger double precision NOT NULL DEFAULT 0,
+	opp_match_win_pct double precision NOT NULL DEFAULT 0,
+	-- Place in the standings by score, as of the last update_tiebreaks();
+	-- NULL for players added since.
+	rank integer,
+	PRIMARY KEY (tournament_id, player_id));
+
+CREATE INDEX player_stats_standings_idx
+	ON player_stats (tournament_id, wins DESC, draws DESC, buchholz DESC,
+	                 sonneborn_berger DESC, opp_match_win_pct DESC, player_id);
+
+-- Standings grouped by score (2 per win, 1 per draw), for streaming pairings
+-- and leaderboard pages.
+CREATE INDEX player_stats_score_idx
+	ON player_stats (tournament_id, (2 * wins + draws) DESC, wins DESC, draws DESC,
+	                 buchholz DESC, sonneborn_berger DESC, opp_match_win_pct DESC,
+	                 player_id);
+
+-- One row per player per match, from that player's point of view.
+CREATE OR REPLACE VIEW match_results AS (
+    SELECT match_id, tournament_id, winner_id AS player_id,
+    loser_id AS opponent_id, 1 AS wins, 0 AS losses, 0 AS draws
+    FROM matches WHERE winner_id IS NOT NULL
+    UNION ALL
+    SELECT match_id, tournament_id, loser_id, winner_id, 0, 1, 0
+    FROM matches WHERE loser_id IS NOT NULL
+    UNION ALL
+    SELECT match_id, tournament_id, draw_id_one, draw_id_two, 0, 0, 1
+    FROM matches WHERE draw_id_one IS NOT NULL
+    UNION ALL
+    SELECT match_id, tournament_id, draw_id_two, draw_id_one, 0, 0, 1
+    FROM matches WHERE draw_id_two IS NOT NULL);
+
+-- What player_stats should contain, computed from scratch.
+CREATE OR REPLACE VIEW player_stats_expected AS (
+    SELECT tournament_id, player_id,
+    SUM(wins)::integer AS wins, SUM(losses)::integer AS losses,
+    SUM(draws)::integer AS draws,
+    SUM(wins + losses + draws)::integer AS matches
+    FROM (
+        SELECT 0 AS tournament_id, id AS player_id, 0 AS wins, 0 AS losses, 0 AS draws
+        FROM players
+        UNION ALL
+        SELECT tournament_id, player_id, 0, 0, 0
+        FROM tournament_roster
+        WHERE tournament_id IS NOT NULL AND player_id IS NOT NULL
+        UNION ALL
+        SELECT 0, player_id, wins, losses, draws
+        FROM match_results
+        UNION ALL
+        SELECT tournament_id, player_id, wins, losses, draws
+        FROM match_results WHERE tournament_id IS NOT NULL) AS results
+    GROUP BY tournament_id, player_id);
+
+CREATE OR REPLACE FUNCTION bump_player_stats(t integer, p integer,
+        dw integer, dl integer, dd integer) RETURNS void AS $$
+BEGIN
+    -- One statement, so concurrent reports creating the same row can't
+    -- both find it missing and collide on the insert.
+    INSERT INTO player_stats AS s (tournament_id, player_id, wins, losses, draws, matches)
+        VALUES (t, p, dw, dl, dd, dw + dl + dd)
+        ON CONFLICT (tournament_id, player_id) DO UPDATE
+        SET wins = s.wins + dw, losses = s.losses + dl, draws = s.draws + dd,
+            matches = s.matches + dw + dl + dd;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Add (sign = 1) or remove (sign = -1) one match from player_stats.  Rows are
+-- touched in player id order so concurrent reports can't deadlock.
+CREATE OR REPLACE FUNCTION apply_match(m matches, sign integer) RETURNS void AS $$
+DECLARE
+    r record;
+    t integer;
+BEGIN
+    FOR r IN
+        SELECT * FROM (VALUES (m.winner_id, sign, 0, 0),
+                              (m.loser_id, 0, sign, 0),
+                              (m.draw_id_one, 0, 0, sign),
+                              (m.draw_id_two, 0, 0, sign)) AS v (player_id, dw, dl, dd)
+        WHERE player_id IS NOT NULL
+        ORDER BY player_id
+    LOOP
+        FOREACH t IN ARRAY ARRAY[0, m.tournament_id] LOOP
+            CONTINUE WHEN t IS NULL;
+            PERFORM bump_player_stats(t, r.player_id, r.dw, r.dl, r.dd);
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Announce a result on the standings_feed channel; NOTIFY is delivered
+-- when the transaction commits, and not at all if it rolls back.  The
+-- payload (parsed by feed.py) holds the round the result counts for (the
+-- pairing's, else the tournament's latest) and its players' new records in
+-- the tournament and across all matches:
+--   M|tournament|round|id:wins:losses:draws;...|id:wins:losses:draws;...
+CREATE OR REPLACE FUNCTION feed_result(m matches) RETURNS void AS $$
+DECLARE
+    round_number integer;
+    scoped text;
+    totals text;
+BEGIN
+    IF current_setting('tournament.feed') <> 'on' THEN
+        RETURN;
+    END IF;
+    SELECT r.number INTO round_number
+        FROM pairings p JOIN rounds r ON r.round_id = p.round_id
+        WHERE p.pairing_id = m.pairing_id;
+    -- Spelled out so that both cases can use the rounds unique index.
+    IF round_number IS NULL AND m.tournament_id IS NULL THEN
+        SELECT MAX(number) INTO round_number FROM rounds WHERE tournament_id IS NULL;
+    ELSIF round_number IS NULL THEN
+        SELECT MAX(number) INTO round_number FROM rounds WHERE tournament_id = m.tournament_id;
+    END IF;
+    SELECT string_agg(CASE WHEN tournament_id <> 0 THEN record END, ';'),
+           string_agg(CASE WHEN tournament_id = 0 THEN record END, ';')
+        INTO scoped, totals
+        FROM (SELECT tournament_id,
+                     player_id || ':' || wins || ':' || losses || ':' || draws AS record
+              FROM player_stats
+              WHERE tournament_id IN (0, m.tournament_id)
+              AND player_id IN (m.winner_id, m.loser_id, m.draw_id_one, m.draw_id_two))
+             AS records;
+    PERFORM pg_notify('standings_feed', 'M|' || COALESCE(m.tournament_id::text, '') ||
+                      '|' || COALESCE(round_number::text, '') ||
+                      '|' || COALESCE(scoped, '') || '|' || COALESCE(totals, ''));
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bulk_loading() RETURNS boolean AS $$
+    SELECT current_setting('tournament.bulk_load') = 'on';
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION matches_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF bulk_loading() THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_match(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_match(NEW, 1);
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        PERFORM feed_result(NEW);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_stats AFTER INSERT OR UPDATE OR DELETE ON matches
+    FOR EACH ROW EXECUTE PROCEDURE matches_stats_trigger();
+
+-- Elo ratings: each result moves both players' ratings by 32 times the
+-- difference between the points scored and the points expected, so the
+-- total never changes.  Byes are not rated.  Must match ratings.py.
+--
+-- Ratings depend on the order results come in, so they are only applied
+-- forwards; recomputeRatings() replays the history after matches are
+-- deleted or loaded with the triggers disabled.
+CREATE OR REPLACE FUNCTION rate_match(m matches) RETURNS void AS $$
+DECLARE
+    one integer := COALESCE(m.winner_id, m.draw_id_one);
+    two integer := COALESCE(m.loser_id, m.draw_id_two);
+    delta double precision;
+BEGIN
+    IF one IS NULL OR two IS NULL OR one = two THEN
+        RETURN;
+    END IF;
+    -- Lock both players in id order so concurrent reports can't deadlock.
+    -- NO KEY UPDATE doesn't wait on the key-share locks that the foreign
+    -- key checks of other reports hold.
+    PERFORM 1 FROM players WHERE id IN (one, two) ORDER BY id FOR NO KEY UPDATE;
+    SELECT 32 * (CASE WHEN m.winner_id IS NULL THEN 0.5 ELSE 1 END -
+                 1 / (1 + 10 ^ ((b.rating - a.rating) / 400)))
+        INTO delta
+        FROM players a, players b
+        WHERE a.id = one AND b.id = two;
+    UPDATE players SET rating = rating + CASE WHEN id = one THEN delta ELSE -delta END
+        WHERE id IN (one, two);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION matches_rating_trigger() RETURNS trigger AS $$
+BEGIN
+    IF bulk_loading() THEN
+        RETURN NULL;
+    END IF;
+    PERFORM rate_match(NEW);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_rating AFTER INSERT ON matches
+    FOR EACH ROW EXECUTE PROCEDURE matches_rating_trigger();
+
+-- Players and roster entries get a zeroed row so they show up in standings
+-- before their first match.
+CREATE OR REPLACE FUNCTION players_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF bulk_loading() THEN
+        RETURN NULL;
+    END IF;
+    PERFORM bump_player_stats(0, NEW.id, 0, 0, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_stats AFTER INSERT ON players
+    FOR EACH ROW EXECUTE PROCEDURE players_stats_trigger();
+
+CREATE OR REPLACE FUNCTION roster_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF bulk_loading() THEN
+        RETURN NULL;
+    END IF;
+    IF NEW.tournament_id IS NOT NULL AND NEW.player_id IS NOT NULL THEN
+        PERFORM bump_player_stats(NEW.tournament_id, NEW.player_id, 0, 0, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER roster_stats AFTER INSERT ON tournament_roster
+    FOR EACH ROW EXECUTE PROCEDURE roster_stats_trigger();
+
+-- Recompute the tie-breaks of one scope of player_stats (0 for all
+-- matches) in a single pass over its match history.  Points are 1 per win
+-- and 1/2 per draw:
+--   buchholz: sum of the opponents' points
+--   sonneborn_berger: points of beaten opponents plus half of drawn ones
+--   opp_match_win_pct: mean of the opponents' points per match, each
+--     floored at 1/3 and rounded to 4 places
+-- Then every player's rank by score is stored for playerRank().
+CREATE OR REPLACE FUNCTION update_tiebreaks(t integer) RETURNS void AS $$
+    WITH scores AS (
+        SELECT player_id,
+        (wins + 0.5 * draws)::double precision AS points,
+        matches
+        FROM player_stats
+        WHERE tournament_id = t),
+    opponents AS (
+        SELECT r.player_id,
+        SUM(o.points) AS buchholz,
+        SUM((r.wins + 0.5 * r.draws) * o.points) AS sonneborn_berger,
+        round(AVG(GREATEST(o.points / o.matches, 1.0 / 3))::numeric, 4)::double precision
+            AS opp_match_win_pct
+        FROM match_results r
+        JOIN scores o
+        ON o.player_id = r.opponent_id
+        WHERE t = 0 OR r.tournament_id = t
+        GROUP BY r.player_id)
+    UPDATE player_stats s
+    SET buchholz = COALESCE(opponents.buchholz, 0),
+    sonneborn_berger = COALESCE(opponents.sonneborn_berger, 0),
+    opp_match_win_pct = COALESCE(opponents.opp_match_win_pct, 0)
+    FROM player_stats p
+    LEFT JOIN opponents
+    ON opponents.player_id = p.player_id
+    WHERE p.tournament_id = t
+    AND s.tournament_id = t AND s.player_id = p.player_id;
+
+    UPDATE player_stats s
+    SET rank = ranked.rank
+    FROM (SELECT player_id,
+          row_number() OVER (ORDER BY 2 * wins + draws DESC, wins DESC, draws DESC,
+                             buchholz DESC, sonneborn_berger DESC,
+                             opp_match_win_pct DESC, player_id)::integer AS rank
+          FROM player_stats
+          WHERE tournament_id = t) AS ranked
+    WHERE s.tournament_id = t AND s.player_id = ranked.player_id
+    AND s.rank IS DISTINCT FROM ranked.rank;
+$$ LANGUAGE sql;
+
+-- Recompute player_stats from matches, e.g. after loading data with the
+-- triggers disabled.
+CREATE OR REPLACE FUNCTION rebuild_player_stats() RETURNS void AS $$
+BEGIN
+    LOCK TABLE matches IN SHARE MODE;
+    DELETE FROM player_stats;
+    INSERT INTO player_stats (tournament_id, player_id, wins, losses, draws, matches)
+        SELECT tournament_id, player_id, wins, losses, draws, matches
+        FROM player_stats_expected;
+    PERFORM update_tiebreaks(tournament_id)
+        FROM (SELECT DISTINCT tournament_id FROM player_stats) AS scopes;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rows where player_stats disagrees with the match history.  `source` is
+-- 'expected' for a correct row that is missing or different, 'actual' for
+-- the stale row currently stored.
+CREATE OR REPLACE FUNCTION verify_player_stats()
+        RETURNS TABLE (source text, tournament_id integer, player_id integer,
+                       wins integer, losses integer, draws integer,
+                       matches integer) AS $$
+    (SELECT 'expected', e.* FROM player_stats_expected e
+     EXCEPT
+     SELECT 'expected', s.tournament_id, s.player_id, s.wins, s.losses, s.draws, s.matches
+     FROM player_stats s)
+    UNION ALL
+    (SELECT 'actual', s.tournament_id, s.player_id, s.wins, s.losses, s.draws, s.matches
+     FROM player_stats s
+     EXCEPT
+     SELECT 'actual', e.* FROM player_stats_expected e);
+$$ LANGUAGE sql STABLE;
 
 CREATE OR REPLACE VIEW total_matches AS (
-    SELECT games_won.id, games_won.name,
-    games_won.wins, games_lost.losses,
-    games_draw.draws, (
-    	SELECT COALESCE(games_won.wins) + 
-    	COALESCE(games_lost.losses) +
-    	COALESCE(games_draw.draws) AS matches)
-    FROM games_won
-    JOIN games_draw
-    ON games_draw.id = games_won.id
-    JOIN games_lost
-    ON games_lost.id = games_draw.id
-    ORDER BY games_won.wins DESC,
-    games_draw.draws DESC);
+    SELECT players.id, players.name,
+    player_stats.wins, player_stats.losses,
+    player_stats.draws, player_stats.matches,
+    player_stats.buchholz, player_stats.sonneborn_berger,
+    player_stats.opp_match_win_pct
+    FROM player_stats
+    JOIN players
+    ON players.id = player_stats.player_id
+    WHERE player_stats.tournament_id = 0
+    ORDER BY player_stats.wins DESC,
+    player_stats.draws DESC,
+    player_stats.buchholz DESC,
+    player_stats.sonneborn_berger DESC,
+    player_stats.opp_match_win_pct DESC,
+    player_stats.player_id);
 
+-- Standings of every tournament, filtered through its roster.  Query with
+-- WHERE tournament_id = ... and the same ORDER BY as total_matches.
+CREATE OR REPLACE VIEW tournament_standings AS (
+    SELECT tournament_roster.tournament_id,
+    players.id, players.name,
+    player_stats.wins, player_stats.losses,
+    player_stats.draws, player_stats.matches,
+    player_stats.buchholz, player_stats.sonneborn_berger,
+    player_stats.opp_match_win_pct
+    FROM tournament_roster
+    JOIN player_stats
+    ON player_stats.tournament_id = tournament_roster.tournament_id
+    AND player_stats.player_id = tournament_roster.player_id
+    JOIN players
+    ON players.id = tournament_roster.player_id);
@@ -1,10 +1,23 @@
 #!/usr/bin/env python
 #
 # Test cases for tournament.py
+#
+# Runs against PostgreSQL by default; pass --memory to run the same
+# scenarios against the in-memory backend, and --isolated to run each test
+# in a savepoint that is rolled back instead of deleting data between tests.
+import os
+import shutil
+import sys
+import tempfile
+
+import feed
+import pairing
+import ratings
+import schedules
+from memory import MemoryBackend
 from tournament import *
 
 
-@transaction_decorator
 def testDeleteMatches(db):
     deleteMatches(db)
     print "1. Old matches can be deleted."
@@ -243,22 +256,699 @@ def testGetTournamentRoster(db):
                 "Players {0} and {1} should be registered in tournament {2}".format(p_id3, p_id4, t_id2))
     print "15. We can see the players registered in a specific tournament."
 
-    
+
+def testSharedTransaction(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    with transaction() as tx:
+        registerPlayer(tx, "Twilight Sparkle")
+        registerPlayer(tx, "Fluttershy")
+        if get_backend() is None:
+            with get_pool().connection() as conn:
+                if conn is not tx.conn:
+                    raise ValueError("Calls in a transaction should share its connection.")
+    if countPlayers(db) != 2:
+        raise ValueError(
+            "Calls sharing a committed transaction should all be applied.")
+    try:
+        with transaction() as tx:
+            registerPlayer(tx, "Applejack")
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    if countPlayers(db) != 2:
+        raise ValueError(
+            "Calls sharing a rolled back transaction should all be discarded.")
+    print "16. Several calls can share one pooled transaction."
+
+
+def testBulkRegistration(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    names = ("Player {0}".format(num) for num in range(25))
+    ids = registerPlayers(db, names, chunk_size=10)
+    if len(ids) != 25 or ids != sorted(ids):
+        raise ValueError("registerPlayers should return ids in input order.")
+    if countPlayers(db) != 25:
+        raise ValueError("registerPlayers should register every name.")
+    match_ids = reportMatches(db, [(ids[0], ids[1]), (ids[2], ids[3], True)])
+    if len(match_ids) != 2:
+        raise ValueError("reportMatches should return one id per result.")
+    if registerTournamentPlayers(db, t_id, iter(ids), chunk_size=7) != 25:
+        raise ValueError("registerTournamentPlayers should count roster rows.")
+    if len(getTournamentRoster(db, t_id)) != 25:
+        raise ValueError("Every bulk registered player should be on the roster.")
+    standings = dict((row[0], row) for row in playerStandings(db))
+    if standings[ids[0]][2] != 1 or standings[ids[2]][4] != 1:
+        raise ValueError("Bulk reported wins and draws should be counted.")
+    if get_backend() is None:
+        try:
+            with transaction() as tx:
+                registerPlayers(tx, ["Applejack"], commit_chunks=True)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("commit_chunks should be refused inside a transaction.")
+        if countPlayers(db) != 25:
+            raise ValueError("A refused bulk write shouldn't register anyone.")
+    print "17. Players, matches and rosters can be loaded in bulk."
+
+
+def testPlayerStatsMaintained(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    registerPlayer(db, "Twilight Sparkle")
+    registerPlayer(db, "Fluttershy")
+    registerPlayer(db, "Applejack")
+    [id1, id2, id3] = [row[0] for row in playerStandings(db)]
+    reportMatch(db, id1, id2)
+    reportMatch(db, id2, id3, draw=True)
+    if verifyPlayerStats(db):
+        raise ValueError("player_stats should match the recorded matches.")
+    deleteMatches(db)
+    if verifyPlayerStats(db):
+        raise ValueError("player_stats should follow deleted matches.")
+    rebuildPlayerStats(db)
+    if [row[5] for row in playerStandings(db)] != [0, 0, 0]:
+        raise ValueError("Rebuilt player_stats should have no matches.")
+    print "18. player_stats is kept current and can be verified and rebuilt."
+
+
+def testTournamentStandings(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    registerTournament(db)
+    registerTournament(db)
+    [t_id1, t_id2] = [row[0] for row in getTournaments(db)]
+    [p_id1, p_id2, p_id3, p_id4] = registerPlayers(
+        db, ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    registerTournamentPlayers(db, t_id1, [p_id1, p_id2])
+    registerTournamentPlayers(db, t_id2, [p_id3, p_id4])
+    reportMatch(db, p_id2, p_id1, tournament_id=t_id1)
+    reportMatch(db, p_id3, p_id4, tournament_id=t_id2)
+    standings = playerStandings(db, t_id1)
+    if [row[0] for row in standings] != [p_id2, p_id1]:
+        raise ValueError(
+            "Tournament standings should only rank that tournament's roster.")
+    if [row[5] for row in standings] != [1, 1]:
+        raise ValueError(
+            "Tournament standings should only count that tournament's matches.")
+    pairings = swissPairings(db, t_id2)
+    if len(pairings) != 1 or set([pairings[0][0], pairings[0][2]]) != set([p_id3, p_id4]):
+        raise ValueError(
+            "Tournament pairings should only pair that tournament's roster.")
+    print "19. Standings and pairings can be scoped to a single tournament."
+
+
+def testPairingsAvoidRematches(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    [id1, id2, id3, id4] = registerPlayers(
+        db, ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    reportMatch(db, id1, id2, draw=True)
+    reportMatch(db, id3, id4, draw=True)
+    pairings = swissPairings(db)
+    played = set([frozenset([id1, id2]), frozenset([id3, id4])])
+    for (pid1, pname1, pid2, pname2) in pairings:
+        if frozenset([pid1, pid2]) in played:
+            raise ValueError(
+                "swissPairings should not pair players who have already met.")
+    # Player 1 has met everyone but the leaders: only reopening their pair
+    # avoids a rematch.
+    scores = {1: 0, 2: 4, 3: 2, 4: 2, 5: 0, 6: 0, 7: 4, 8: 0}
+    history = pairing.History([(1, other) for other in (3, 4, 5, 6, 8)])
+    pairs, bye = pairing.pair_players([2, 7, 3, 4, 1, 5, 6, 8], scores, history)
+    if any(history.played(one, two) for one, two in pairs):
+        raise ValueError("Every pending pair should be reopened to avoid a rematch.")
+    # In an odd field, the bye goes where it lets the others pair cleanly.
+    pairs, bye = pairing.pair_players([1, 2, 3], {1: 2, 2: 2, 3: 0},
+                                      pairing.History([(1, 2)]))
+    if pairs != [(1, 3)] or bye != 2:
+        raise ValueError("The bye should go to a player whose absence avoids a rematch.")
+    print "20. Players who have already met are not paired again."
+
+
+def testPairingsOddField(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Twilight Sparkle", "Fluttershy", "Applejack"])
+    pairings = swissPairings(db)
+    byes = [row for row in pairings if row[2] is None]
+    if len(pairings) != 2 or len(byes) != 1:
+        raise ValueError(
+            "For three players, swissPairings should return one pair and a bye.")
+    bye_id = byes[0][0]
+    reportMatch(db, bye_id, None)
+    pairings = swissPairings(db)
+    if [row[0] for row in pairings if row[2] is None] == [bye_id]:
+        raise ValueError("A player should not get a second bye.")
+    print "21. With an odd number of players, one player gets a bye."
+
+
+def testTiebreaks(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    [id1, id2, id3, id4] = registerPlayers(
+        db, ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    reportMatches(db, [(id1, id2), (id3, id4), (id1, id4)])
+    updateTiebreaks(db)
+    standings = playerStandings(db, tiebreaks=True)
+    if len(standings[0]) != 9:
+        raise ValueError("With tiebreaks, each standings row should have nine columns.")
+    # id2 and id4 are both winless, but id4 met the stronger opponents.
+    if [row[0] for row in standings] != [id1, id3, id4, id2]:
+        raise ValueError("Players tied on wins should be ranked by Buchholz.")
+    buchholz = dict((row[0], row[6]) for row in standings)
+    if buchholz[id4] != 3 or buchholz[id2] != 2:
+        raise ValueError("Buchholz should sum the opponents' points.")
+    print "22. Players tied on wins are ranked by their tie-break scores."
+
+
+def testStreaming(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    [id1, id2, id3, id4, id5] = registerPlayers(
+        db, ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie", "Rarity"])
+    reportMatches(db, [(id1, id2), (id3, id4, True), (id5, None)])
+    if [tuple(row) for row in iterStandings(db, fetch_size=2)] != playerStandings(db):
+        raise ValueError("iterStandings should yield the same rows as playerStandings.")
+    row = next(iterStandings(db))
+    if (row.id, row.wins) != (playerStandings(db)[0][0], playerStandings(db)[0][2]):
+        raise ValueError("iterStandings rows should have named fields.")
+    if [tuple(row) for row in iterPairings(db, fetch_size=2)] != swissPairings(db):
+        raise ValueError("iterPairings should yield the same pairings as swissPairings.")
+    print "23. Standings and pairings can be streamed a few rows at a time."
+
+
+def testStandingsCache(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    [id1, id2] = registerPlayers(db, ["Twilight Sparkle", "Fluttershy"])
+    configure_cache()
+    try:
+        standings = playerStandings(db)
+        if playerStandings(db) != standings:
+            raise ValueError("Cached standings should match the database.")
+        cached = get_backend() is None and get_pool().current_transaction() is None
+        if cached and cacheStats()['hits'] != 1:
+            raise ValueError("A repeated playerStandings call should hit the cache.")
+        reportMatch(db, id2, id1)
+        if [row[0] for row in playerStandings(db)] != [id2, id1]:
+            raise ValueError("reportMatch should invalidate cached standings.")
+        deleteMatches(db)
+        if [row[2] for row in playerStandings(db)] != [0, 0]:
+            raise ValueError("deleteMatches should invalidate cached standings.")
+        if cached:
+            def names():
+                for num in range(5):
+                    yield "Player {0}".format(num)
+                raise RuntimeError("abort")
+            try:
+                registerPlayers(db, names(), chunk_size=2, commit_chunks=True)
+            except RuntimeError:
+                pass
+            if len(playerStandings(db)) != countPlayers(db):
+                raise ValueError("A failed bulk write should invalidate what it committed.")
+            # A result reported against a pairing only invalidates its own
+            # tournament, and a replay nothing.
+            registerTournament(db)
+            registerTournament(db)
+            [t_id1, t_id2] = sorted(row[0] for row in getTournaments(db))
+            registerTournamentPlayers(db, t_id1, [id1, id2])
+            round_id, [pairing_id] = createRound(db, [(id1, id2)], t_id1)
+            playerStandings(db, t_id2)
+            reportMatch(db, id1, id2, pairing_id=pairing_id)
+            hits = cacheStats()['hits']
+            playerStandings(db, t_id2)
+            reportMatch(db, id1, id2, pairing_id=pairing_id)
+            playerStandings(db, t_id2)
+            if cacheStats()['hits'] != hits + 2:
+                raise ValueError("A result should only invalidate its tournament's standings.")
+            if playerStandings(db, t_id1)[0][2] != 1:
+                raise ValueError("A result should invalidate its tournament's standings.")
+    finally:
+        disable_cache()
+    print "24. Standings are cached until a write changes them."
+
+
+def testInstrumentation(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    configure_instrumentation(slow_query_threshold=0)
+    try:
+        registerPlayer(db, "Twilight Sparkle")
+        countPlayers(db)
+        stats = instrumentationStats()
+        if get_backend() is None:
+            if sorted(stats['calls']) != ['countPlayers', 'registerPlayer']:
+                raise ValueError("Every database call should be timed.")
+            if stats['commits'] + stats['joined'] != 2 or stats['rollbacks'] != 0:
+                raise ValueError("Instrumentation should count commits.")
+            if not [query for query in slowQueries() if query['plan']]:
+                raise ValueError("Slow queries should be kept with their plan.")
+    finally:
+        disable_instrumentation()
+    if instrumentationStats() is not None:
+        raise ValueError("Disabled instrumentation should report nothing.")
+    print "25. Database calls and statements can be timed and profiled."
+
+
+def testIncrementalPairing(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    registerPlayers(db, ["Player {0}".format(i) for i in range(80)])
+    reportMatches(db, [(row[0], row[2]) for row in swissPairings(db)])
+    pairings = swissPairings(db)
+    current = IncrementalRound(db, pairings)
+    released_early = False
+    # Boards are in score order: finish the leaders' games first.
+    for (id1, name1, id2, name2) in pairings:
+        if current.report(id1, id2) and not current.complete:
+            released_early = True
+    if not current.complete or not released_early:
+        raise ValueError("Top score groups should be paired before the round ends.")
+    if current.pairings != swissPairings(db):
+        raise ValueError("Incremental pairings should match swissPairings.")
+    print "26. The next round is paired top down as results come in."
+
+
+def testIdempotentReports(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    ids = registerPlayers(db, ["Twilight Sparkle", "Fluttershy", "Applejack"])
+    registerTournamentPlayers(db, t_id, ids)
+    round_id, [pairing_id, bye_id] = createRound(db, swissPairings(db, t_id), t_id)
+    [(_, one, two, _), (_, bye_player, _, _)] = getPairings(db, round_id)
+    match_id = reportMatch(db, one, two, pairing_id=pairing_id)
+    if reportMatch(db, one, two, pairing_id=pairing_id) != match_id:
+        raise ValueError("Reporting a pairing twice should return the same match.")
+    try:
+        reportMatch(db, two, one, pairing_id=pairing_id)
+        raise AssertionError("A conflicting result should be rejected.")
+    except ResultConflict:
+        pass
+    reportMatch(db, bye_player, None, pairing_id=bye_id)
+    reported = [row[3] is not None for row in getPairings(db, round_id)]
+    if len(getMatchHistory(db, t_id)) != 2 or reported != [True, True]:
+        raise ValueError("Each pairing should have exactly one recorded result.")
+    print "27. Results reported against a pairing are recorded exactly once."
+
+
+def testResetDatabase(db):
+    registerTournament(db)
+    registerPlayers(db, ["Twilight Sparkle", "Fluttershy"])
+    resetDatabase(db)
+    if countPlayers(db) != 0 or getTournaments(db) != []:
+        raise ValueError("resetDatabase should empty every table.")
+    [p_id] = registerPlayers(db, ["Applejack"])
+    registerTournament(db)
+    if p_id != 1 or getTournaments(db) != [(1,)]:
+        raise ValueError("resetDatabase should restart ids from 1.")
+    print "28. The database can be reset in one step."
+
+
+def testRatings(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    ids = registerPlayers(db, ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    registerTournamentPlayers(db, t_id, ids)
+    # Played outside the tournament, so every player still scores zero in it.
+    reportMatches(db, [(ids[3], ids[0]), (ids[3], ids[1]), (ids[2], ids[1], True),
+                       (ids[2], None)])
+    rated = playerRatings(db)
+    if [row[0] for row in rated] != [ids[3], ids[2], ids[1], ids[0]]:
+        raise ValueError("Winners should be rated above losers; byes aren't rated.")
+    if abs(sum(row[2] for row in rated) - 4 * ratings.INITIAL_RATING) > 1e-6:
+        raise ValueError("Rating changes should cancel out.")
+    if swissPairings(db, t_id, by_rating=True)[0][0] != ids[3]:
+        raise ValueError("The highest rated player should be seeded first.")
+    deleteTournament(db, t_id)
+    recomputeRatings(db)
+    if any(abs(row[2] - old[2]) > 1e-6 for row, old in zip(playerRatings(db), rated)):
+        raise ValueError("Replaying the history should give the same ratings.")
+    deleteMatches(db)
+    if [row[2] for row in playerRatings(db)] != [ratings.INITIAL_RATING] * 4:
+        raise ValueError("Deleting the matches should reset the ratings.")
+    print "29. Players are rated as results come in and can be seeded by rating."
+
+
+def testLeaderboard(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Player {0}".format(i) for i in range(7)])
+    reportMatches(db, [(ids[0], ids[1]), (ids[2], ids[3], True), (ids[4], ids[5]),
+                       (ids[6], None)])
+    reportMatches(db, [(ids[1], ids[2]), (ids[3], ids[4], True), (ids[5], ids[6])])
+    updateTiebreaks(db)
+    standings = list(iterStandings(db, tiebreaks=True, by_score=True))
+    pages = [leaderboard(db, limit=3)]
+    while pages[-1]:
+        pages.append(leaderboard(db, limit=3, after=pages[-1][-1]))
+    if [len(page) for page in pages] != [3, 3, 1, 0]:
+        raise ValueError("Pages should hold `limit` rows until the last one.")
+    if [row for page in pages for row in page] != standings:
+        raise ValueError("Pages should follow the standings by score.")
+    ranks = [playerRank(db, row.id) for row in standings]
+    if ranks != list(range(1, len(standings) + 1)):
+        raise ValueError("Each player's rank should be their place in the standings.")
+    [late] = registerPlayers(db, ["Rarity"])
+    if playerRank(db, late) is not None:
+        raise ValueError("Players are only ranked by updateTiebreaks.")
+    print "30. The leaderboard is paged by key and players' ranks are stored."
+
+
+def testPairAll(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Player {0}".format(i) for i in range(12)])
+    for i in range(3):
+        registerTournament(db)
+    t_ids = [row[0] for row in getTournaments(db)]
+    for i, t_id in enumerate(t_ids):
+        registerTournamentPlayers(db, t_id, ids[:4 + 3 * i])
+        reportMatches(db, [(row[0], row[2]) for row in swissPairings(db, t_id)], t_id)
+    unknown = max(t_ids) + 1
+    pairings, errors = pairAll(db, t_ids + [unknown], processes=2)
+    if pairings != dict((t_id, swissPairings(db, t_id)) for t_id in t_ids):
+        raise ValueError("pairAll should pair each tournament like swissPairings.")
+    if list(errors) != [unknown] or not isinstance(errors[unknown], ValueError):
+        raise ValueError("A tournament that fails should not stop the others.")
+    print "31. Many tournaments can be paired at once."
+
+
+def testArchive(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Player {0}".format(i) for i in range(5)])
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    registerTournamentPlayers(db, t_id, ids)
+    round_id, pairing_ids = createRound(db, swissPairings(db, t_id), t_id)
+    rows = getPairings(db, round_id)
+    reportMatch(db, rows[0][1], rows[0][2], pairing_id=rows[0][0])
+    reportMatch(db, rows[1][1], rows[1][2], True, pairing_id=rows[1][0])
+    reportMatch(db, rows[2][1], None, pairing_id=rows[2][0])
+    reportMatch(db, ids[4], ids[0], tournament_id=t_id)
+    updateTiebreaks(db, t_id)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "event.archive")
+        counts = exportTournament(db, t_id, path)
+        if counts != {'players': 5, 'roster': 5, 'rounds': 1, 'pairings': 3, 'matches': 4}:
+            raise ValueError("exportTournament should write every row of the tournament.")
+        copy_id = importTournament(db, path)
+    finally:
+        shutil.rmtree(directory)
+    if copy_id == t_id or countPlayers(db) != 10:
+        raise ValueError("An imported tournament should get new ids and new players.")
+    def by_name(rows):
+        return [row[1:] for row in rows]
+    if by_name(playerStandings(db, copy_id, tiebreaks=True)) != \
+            by_name(playerStandings(db, t_id, tiebreaks=True)):
+        raise ValueError("An imported tournament should have the same standings.")
+    if sorted(by_name(playerRatings(db, copy_id))) != sorted(by_name(playerRatings(db, t_id))):
+        raise ValueError("Imported players should be rated by the imported matches.")
+    # Nothing else has created a round since.
+    copied = getPairings(db, round_id + 1)
+    if len(copied) != 3 or None in [row[3] for row in copied]:
+        raise ValueError("Imported pairings should keep their results.")
+    if reportMatch(db, copied[0][1], copied[0][2], pairing_id=copied[0][0]) != copied[0][3]:
+        raise ValueError("Imported results should still be idempotent.")
+    if verifyPlayerStats(db):
+        raise ValueError("Importing should keep player_stats consistent.")
+    print "32. Tournaments can be exported to and imported from archives."
+
+
+def testPreparedStatements(db):
+    deleteMatches(db)
+    deletePlayers(db)
+    registerPlayers(db, ["Twilight Sparkle", "Fluttershy"])
+    configure_prepared_statements()
+    countPlayers(db)
+    before = preparedStatementStats()
+    if [countPlayers(db) for _ in range(3)] != [2, 2, 2]:
+        raise ValueError("Prepared statements should return the same rows.")
+    after = preparedStatementStats()
+    if get_backend() is None:
+        if after['prepares'] != before['prepares'] or \
+                after['executes'] != before['executes'] + 3:
+            raise ValueError("A statement should be prepared once per connection.")
+        if get_pool().current_transaction() is None:
+            # Drop them behind the cache's back, as a connection reset would.
+            c = db.cursor()
+            c.execute("DEALLOCATE ALL;")
+            c.close()
+            db.commit()
+            if countPlayers(db) != 2:
+                raise ValueError("Calls should be retried after a connection reset.")
+            if preparedStatementStats()['invalidations'] != after['invalidations'] + 1:
+                raise ValueError("A reset connection should prepare its statements again.")
+            # A call that used up an iterator can't be retried.
+            [id1, id2] = [row[0] for row in playerStandings(db)]
+            createRound(db, [(id1, id2)], checkpoint=True)
+            c = db.cursor()
+            c.execute("DEALLOCATE ALL;")
+            c.close()
+            db.commit()
+            try:
+                createRound(db, iter([(id1, id2)]), checkpoint=True)
+            except psycopg2.Error:
+                pass
+            if len(resumeTournament(db).pairings) != 1:
+                raise ValueError("A retry should never run with a used up iterator.")
+    disable_prepared_statements()
+    try:
+        if countPlayers(db) != 2 or preparedStatementStats() is not None:
+            raise ValueError("Queries should run as text with prepared statements off.")
+    finally:
+        configure_prepared_statements()
+    print "33. Hot queries run as prepared statements, prepared once per connection."
+
+
+def testStandingsFeed(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Player {0}".format(i) for i in range(3)])
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    registerTournamentPlayers(db, t_id, ids)
+    if get_backend() is None and get_pool().current_transaction() is not None:
+        # Notifications are only sent on commit.
+        print "34. Standings are pushed to subscribers as results come in."
+        return
+
+    def next_change(subscription, kind, expected):
+        # Waits out the resyncs a subscription may start with.
+        while True:
+            change = subscription.get(timeout=5)
+            if change is None:
+                raise ValueError("The feed should push every change.")
+            if isinstance(change[0], kind) and change[1] == expected:
+                return change
+
+    if get_backend() is None:
+        # The feed is off unless a deployment turns it on.
+        with transaction() as tx:
+            tx.cursor().execute("SET tournament.feed = 'on';")
+    try:
+        with subscribeStandings(db, t_id) as live, \
+                subscribeStandings(db, max_queue=1) as slow:
+            if live.standings.standings() != playerStandings(db, t_id):
+                raise ValueError("A subscription should start from the current standings.")
+            round_id, pairing_ids = createRound(db, swissPairings(db, t_id), t_id)
+            rows = getPairings(db, round_id)
+            next_change(live, feed.Round, playerStandings(db, t_id))
+            if live.standings.round != 1:
+                raise ValueError("Subscribers should hear of a new round.")
+            reportMatch(db, rows[0][1], rows[0][2], pairing_id=rows[0][0])
+            event, standings = next_change(live, feed.Result, playerStandings(db, t_id))
+            if event.round != 1 or len(event.players) != 2 or len(event.totals) != 2:
+                raise ValueError("A result should be pushed with its players' records.")
+            reportMatch(db, rows[1][1], None, pairing_id=rows[1][0])
+            next_change(live, feed.Result, playerStandings(db, t_id))
+            # A batch of results makes subscribers read the standings again.
+            reportMatches(db, [(ids[0], ids[1], True), (ids[2], ids[0])], t_id)
+            next_change(live, feed.Resync, playerStandings(db, t_id))
+            if get_backend() is None:
+                # Other payloads on the channel are ignored.
+                with transaction() as tx:
+                    tx.cursor().execute("SELECT pg_notify(%s, 'not an event');",
+                                        (feed.FEED_CHANNEL,))
+
+                # A batch that fails is announced up to its last committed chunk.
+                def results():
+                    yield (ids[1], ids[2])
+                    raise RuntimeError("abort")
+                try:
+                    reportMatches(db, results(), t_id, chunk_size=1, commit_chunks=True)
+                except RuntimeError:
+                    pass
+                next_change(live, feed.Resync, playerStandings(db, t_id))
+            # So does an overflowing queue.
+            next_change(slow, feed.Resync, playerStandings(db))
+            if slow.resyncs < 2:
+                raise ValueError("A subscriber that missed events should resync.")
+    finally:
+        if get_backend() is None:
+            with transaction() as tx:
+                tx.cursor().execute("RESET tournament.feed;")
+    print "34. Standings are pushed to subscribers as results come in."
+
+
+def testCheckpoints(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Player {0}".format(i) for i in range(6)])
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    registerTournamentPlayers(db, t_id, ids)
+    if resumeTournament(db, t_id) is not None:
+        raise ValueError("A tournament without a checkpoint has nothing to resume.")
+    try:
+        checkpointRound(db, t_id)
+        raise ValueError("A tournament without rounds can't be checkpointed.")
+    except ValueError as e:
+        if "no rounds" not in str(e):
+            raise
+    round_id, pairing_ids = createRound(db, swissPairings(db, t_id), t_id, checkpoint=True)
+    rows = getPairings(db, round_id)
+    reportMatch(db, rows[0][1], rows[0][2], pairing_id=rows[0][0])
+    reportMatch(db, rows[1][1], rows[1][2], True, pairing_id=rows[1][0])
+    state = resumeTournament(db, t_id)
+    if state.round_id != round_id or state.pairings != getPairings(db, round_id):
+        raise ValueError("A resumed tournament should have its round's pairings and results.")
+    if state.standings() != playerStandings(db, t_id):
+        raise ValueError("A resumed tournament should count the results reported since.")
+    if not state.history().played(rows[0][2], rows[0][1]):
+        raise ValueError("A resumed tournament should know who has played whom.")
+    reportMatch(db, rows[2][1], rows[2][2], pairing_id=rows[2][0])
+    updateTiebreaks(db, t_id)
+    state = resumeTournament(db, t_id)
+    if state.standings(tiebreaks=True) != playerStandings(db, t_id, tiebreaks=True) or \
+            state.swiss_pairings() != swissPairings(db, t_id):
+        raise ValueError("A resumed tournament should pair as swissPairings does.")
+    # A player registered since the checkpoint makes it read afresh.
+    [late] = registerPlayers(db, ["Player 6"])
+    registerTournamentPlayer(db, t_id, late)
+    if resumeTournament(db, t_id).standings() != playerStandings(db, t_id):
+        raise ValueError("A stale checkpoint should be read afresh.")
+    if checkpointRound(db, t_id) != round_id:
+        raise ValueError("checkpointRound should checkpoint the latest round.")
+    deleteMatches(db)
+    if resumeTournament(db, t_id) is not None:
+        raise ValueError("Deleting matches should delete checkpoints.")
+    print "35. Tournaments resume from round checkpoints."
+
+
+def testSchedules(db):
+    deleteTournaments(db)
+    deleteMatches(db)
+    deletePlayers(db)
+    ids = registerPlayers(db, ["Player {0}".format(i) for i in range(5)])
+    registerTournament(db)
+    [t_id] = [row[0] for row in getTournaments(db)]
+    registerTournamentPlayers(db, t_id, ids)
+    games = set()
+    byes = []
+    for pairs in schedules.round_robin(ids):
+        round_id, pairing_ids = createRound(db, pairs, t_id)
+        for pairing_id, one, two, match_id in getPairings(db, round_id):
+            if two is None:
+                byes.append(one)
+            else:
+                games.add(frozenset([one, two]))
+    if len(games) != schedules.round_robin_matches(5) or sorted(byes) != sorted(ids):
+        raise ValueError("A round robin should pair everyone with everyone once.")
+    for double in (False, True):
+        bracket = schedules.Bracket(ids, double)
+        played = 0
+        for pairs in bracket:
+            round_id, pairing_ids = createRound(db, pairs, t_id)
+            for pairing_id, (one, two) in zip(pairing_ids, pairs):
+                # The better seed wins, except in the grand final.
+                final = double and bracket.number >= 6
+                winner, loser = sorted([one, two], reverse=final)
+                reportMatch(db, winner, loser, pairing_id=pairing_id)
+                bracket.report(winner, loser)
+                played += 1
+        if bracket.number > schedules.elimination_rounds(5, double) or \
+                played != schedules.elimination_matches(5, double):
+            raise ValueError("A bracket should last as long as its format does.")
+        if bracket.champion != (ids[1] if double else ids[0]):
+            raise ValueError("The last player standing should win the bracket.")
+    print "36. Round robins and elimination brackets can be scheduled."
+
+
+TESTS = [
+    testDeleteMatches,
+    testDelete,
+    testCount,
+    testRegister,
+    testRegisterCountDelete,
+    testStandingsBeforeMatches,
+    testReportMatches,
+    testPairings,
+    testMatchDraw,
+    testDeleteTournaments,
+    testDeleteTournament,
+    testGetTournaments,
+    testRegisterTournament,
+    testRegisterTournamentPlayer,
+    testGetTournamentRoster,
+    testSharedTransaction,
+    testBulkRegistration,
+    testPlayerStatsMaintained,
+    testTournamentStandings,
+    testPairingsAvoidRematches,
+    testPairingsOddField,
+    testTiebreaks,
+    testStreaming,
+    testStandingsCache,
+    testInstrumentation,
+    testIncrementalPairing,
+    testIdempotentReports,
+    testResetDatabase,
+    testRatings,
+    testLeaderboard,
+    testPairAll,
+    testArchive,
+    testPreparedStatements,
+    testStandingsFeed,
+    testCheckpoints,
+    testSchedules,
+]
+
+
 if __name__ == '__main__':
-    db = connect(DB_NAME)
-    testDeleteMatches(db)
-    testDelete(db)
-    testCount(db)
-    testRegister(db)
-    testRegisterCountDelete(db)
-    testStandingsBeforeMatches(db)
-    testReportMatches(db)
-    testPairings(db)
-    testMatchDraw(db)
-    testDeleteTournaments(db)
-    testDeleteTournament(db)
-    testGetTournaments(db)
-    testRegisterTournament(db)
-    testRegisterTournamentPlayer(db)
-    testGetTournamentRoster(db)
+    if '--memory' in sys.argv[1:]:
+        db = MemoryBackend()
+        set_backend(db)
+    else:
+        db = connect(DB_NAME)
+    if '--isolated' in sys.argv[1:]:
+        # Every test rolls back to a savepoint, and the whole run rolls
+        # back at the end: nothing is ever deleted from the database.
+        with isolated():
+            resetDatabase(db)
+            for test in TESTS:
+                with isolated():
+                    test(db)
+    else:
+        for test in TESTS:
+            test(db)
     print "Success!  All tests pass!"